@@ -0,0 +1,235 @@
+# In-memory stand-in for the Supabase client, for offline replays and benchmarks
+#
+# Implements the subset of the postgrest query builder the pipelines use (table, select, insert,
+# upsert, update, delete and the eq/neq/gt/gte/lt/lte/in_/is_/ilike/match/contains filters, with
+# not_, order, limit and range) over plain lists of dicts, and counts every executed request so a
+# replay can report its database round trips.
+from datetime import datetime, timedelta
+import copy
+import itertools
+import re
+import threading
+
+import pytz
+
+# Tables whose primary key is not "id"
+PRIMARY_KEYS = {
+    "Show Information": "show_id",
+}
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+class FakeQuery:
+    def __init__(self, database, table):
+        self.database = database
+        self.table = table
+        self.operation = "select"
+        self.http_method = "GET"
+        self.columns = None
+        self.payload = None
+        self.on_conflict = None
+        self.filters = []
+        self.negate = False
+        self.orders = []
+        self.limit_count = None
+        self.offset_range = None
+
+    # operations
+
+    def select(self, columns="*", count=None):
+        if self.operation == "select":
+            self.columns = None if columns.strip() == "*" else [column.strip() for column in columns.split(",")]
+        return self
+
+    def insert(self, json, **kwargs):
+        self.operation, self.http_method, self.payload = "insert", "POST", json
+        return self
+
+    def upsert(self, json, on_conflict=None, **kwargs):
+        self.operation, self.http_method, self.payload = "upsert", "POST", json
+        self.on_conflict = on_conflict
+        return self
+
+    def update(self, json, **kwargs):
+        self.operation, self.http_method, self.payload = "update", "PATCH", json
+        return self
+
+    def delete(self, **kwargs):
+        self.operation, self.http_method = "delete", "DELETE"
+        return self
+
+    # filters
+
+    @property
+    def not_(self):
+        self.negate = True
+        return self
+
+    def filter(self, predicate):
+        if self.negate:
+            self.filters.append(lambda row: not predicate(row))
+            self.negate = False
+        else:
+            self.filters.append(predicate)
+        return self
+
+    def eq(self, column, value):
+        return self.filter(lambda row: row.get(column) == value)
+
+    def neq(self, column, value):
+        return self.filter(lambda row: row.get(column) != value)
+
+    def gt(self, column, value):
+        return self.filter(lambda row: row.get(column) is not None and row[column] > value)
+
+    def gte(self, column, value):
+        return self.filter(lambda row: row.get(column) is not None and row[column] >= value)
+
+    def lt(self, column, value):
+        return self.filter(lambda row: row.get(column) is not None and row[column] < value)
+
+    def lte(self, column, value):
+        return self.filter(lambda row: row.get(column) is not None and row[column] <= value)
+
+    def in_(self, column, values):
+        values = list(values)
+        return self.filter(lambda row: row.get(column) in values)
+
+    def is_(self, column, value):
+        if value in ("null", None):
+            return self.filter(lambda row: row.get(column) is None)
+        return self.filter(lambda row: row.get(column) is (value in (True, "true")))
+
+    def ilike(self, column, pattern):
+        regex = re.compile("^" + ".*".join(re.escape(part) for part in pattern.split("%")) + "$", re.IGNORECASE)
+        return self.filter(lambda row: row.get(column) is not None and regex.match(str(row[column])) is not None)
+
+    def match(self, query):
+        return self.filter(lambda row: all(row.get(column) == value for column, value in query.items()))
+
+    def contains(self, column, values):
+        return self.filter(lambda row: row.get(column) is not None and all(value in row[column] for value in values))
+
+    # modifiers
+
+    def order(self, column, desc=False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size, **kwargs):
+        self.limit_count = size
+        return self
+
+    def range(self, start, end, **kwargs):
+        self.offset_range = (start, end)
+        return self
+
+    def execute(self):
+        return self.database.run(self)
+
+class FakeSupabase:
+    """
+    An in-memory database with the query interface of a Supabase client
+
+    Args:
+        tables (dict): Initial rows per table name (optional)
+    """
+    def __init__(self, tables=None):
+        self.tables = {}
+        self.ids = {}
+        self.requests = 0
+        self.requests_by_table = {}
+        self.lock = threading.Lock()
+        self.clock = itertools.count()
+        self.epoch = datetime.now(pytz.utc)
+
+        for table, rows in (tables or {}).items():
+            for row in rows:
+                self.store(table, dict(row))
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def primary_key(self, table):
+        return PRIMARY_KEYS.get(table, "id")
+
+    def store(self, table, row):
+        key = self.primary_key(table)
+        ids = self.ids.setdefault(table, itertools.count(1))
+        if row.get(key) is None:
+            row[key] = next(ids)
+        else:
+            # keep generated keys ahead of explicitly given ones
+            self.ids[table] = itertools.count(max(row[key] + 1, next(ids)))
+        if "created_at" not in row:
+            # strictly increasing timestamps so ordering by created_at is deterministic
+            row["created_at"] = (self.epoch + timedelta(microseconds=next(self.clock))).isoformat()
+        self.tables.setdefault(table, []).append(row)
+        return row
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests = 0
+            self.requests_by_table = {}
+
+    def run(self, query):
+        with self.lock:
+            self.requests += 1
+            self.requests_by_table[query.table] = self.requests_by_table.get(query.table, 0) + 1
+            return FakeResponse(copy.deepcopy(getattr(self, "run_" + query.operation)(query)))
+
+    def matching(self, query):
+        return [row for row in self.tables.get(query.table, []) if all(predicate(row) for predicate in query.filters)]
+
+    def run_select(self, query):
+        rows = self.matching(query)
+
+        # apply the sort keys last to first so the first one wins
+        for column, desc in reversed(query.orders):
+            present = [row for row in rows if row.get(column) is not None]
+            missing = [row for row in rows if row.get(column) is None]
+            rows = sorted(present, key=lambda row: row[column], reverse=desc) + missing
+
+        if query.offset_range is not None:
+            start, end = query.offset_range
+            rows = rows[start:end + 1]
+        if query.limit_count is not None:
+            rows = rows[:query.limit_count]
+
+        if query.columns is None:
+            return rows
+        return [{column: row.get(column) for column in query.columns} for row in rows]
+
+    def run_insert(self, query):
+        payload = query.payload if isinstance(query.payload, list) else [query.payload]
+        return [self.store(query.table, dict(row)) for row in payload]
+
+    def run_upsert(self, query):
+        payload = query.payload if isinstance(query.payload, list) else [query.payload]
+        conflict = (query.on_conflict or self.primary_key(query.table)).split(",")
+        rows = self.tables.setdefault(query.table, [])
+
+        result = []
+        for new_row in payload:
+            existing = next((row for row in rows if all(row.get(column) == new_row.get(column) for column in conflict)), None)
+            if existing is None:
+                result.append(self.store(query.table, dict(new_row)))
+            else:
+                existing.update(new_row)
+                result.append(existing)
+        return result
+
+    def run_update(self, query):
+        rows = self.matching(query)
+        for row in rows:
+            row.update(query.payload)
+        return rows
+
+    def run_delete(self, query):
+        rows = self.matching(query)
+        deleted = {id(row) for row in rows}
+        self.tables[query.table] = [row for row in self.tables.get(query.table, []) if id(row) not in deleted]
+        return rows
@@ -0,0 +1,48 @@
+# Measure the cold-import cost of the pipeline modules
+#
+# Each module is imported in a fresh interpreter with -X importtime, from its own directory the
+# way the workflows run it, and the median cumulative import time over several runs is reported.
+#
+# Usage: python benchmarks/import_time.py [runs]
+import os
+import statistics
+import subprocess
+import sys
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    ("tkts", "scraper"),
+    ("tkts", "database"),
+    ("tkts", "updateDatabase"),
+    ("tdf", "main"),
+]
+
+def import_time_us(directory, module):
+    """Cumulative import time of a module in microseconds, from a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(root_dir, directory),
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {directory}/{module} failed:\n{result.stderr.splitlines()[-1]}")
+
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative_us)
+    raise RuntimeError(f"No import time reported for {directory}/{module}")
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    for directory, module in MODULES:
+        times = [import_time_us(directory, module) for _ in range(runs)]
+        print(f"{directory}/{module + '.py':<20} {statistics.median(times) / 1000:8.1f} ms (median of {runs})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# Fuzz and benchmark the TKTS row normalizer
+#
+# The fuzz run feeds normalize.normalize_row the formats the board has used (and plausible drift
+# from them: missing minutes, lowercase meridiems, "Up to" discounts, en dashes and runs of dashes
+# between prices, thousands separators, stray spaces and quotes) with known expected values, plus
+# random junk, and fails if a row is misread or anything other than RowFormatError is raised.
+#
+# The benchmark reads the rows of every recorded board in benchmarks/fixtures with the normalizer
+# and with the per-row string handling it replaced, checks that both agree wherever the old code
+# managed to read a row, and reports the time per pass over the cell texts.
+#
+# Usage: python benchmarks/normalize_fuzz.py [cases] [rounds]
+import glob
+import os
+import random
+import statistics
+import string
+import sys
+import time
+from datetime import datetime, time as time_of_day
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, os.path.join(root_dir, "tkts"))
+sys.path.insert(0, root_dir)
+
+import normalize
+import scraper
+
+FIXTURES_DIR = os.path.join(benchmarks_dir, "fixtures")
+PERFORMANCE_DATE = "2025-01-15"
+
+def legacy_row(cells):
+    """The string handling process_div used before the normalizer, kept for comparison"""
+    time_text, discount_text, price_text, title_text = cells
+
+    is_matinee = True
+    if "PM" in time_text:
+        hour = int(time_text.split(":")[0])
+        if hour >= 4:
+            is_matinee = False
+    performance_time = datetime.strptime(time_text, "%I:%M %p").strftime("%H:%M:%S")
+
+    discount = discount_text.replace('%', '')
+    price = price_text.replace('--', '-').replace('---', '-')
+    if '-' in price:
+        low_price, high_price = price.replace('$', '').split('-')
+        low_price = low_price.strip()
+        high_price = high_price.strip()
+    else:
+        low_price = high_price = price.replace('$', '').strip()
+
+    if not low_price:
+        low_price = None
+    if not high_price:
+        high_price = None
+    if not low_price and not high_price:
+        return None
+
+    return {
+        "title": title_text.replace('"', ''),
+        "discount_percent": discount,
+        "low_price": low_price,
+        "high_price": high_price,
+        "performance_time": performance_time,
+        "is_matinee": is_matinee
+    }
+
+def fixture_cells():
+    """Cell texts of every four-column row on the recorded boards"""
+    cells = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "tkts*.html"))):
+        with open(path, "r") as file:
+            sections = scraper.parse_sections(file.read(), "html.parser")
+        for section in sections.values():
+            for row in section.find_all("tr"):
+                row_cells = row.find_all("td")
+                if len(row_cells) == 4:
+                    cells.append([cell.get_text(strip=True) for cell in row_cells])
+    return cells
+
+def time_variants(hour, minute):
+    """Ways the board could write a time, all meaning hour:minute (24-hour)"""
+    hour12 = hour % 12 or 12
+    meridiem = "PM" if hour >= 12 else "AM"
+    variants = [f"{hour12}:{minute:02d} {meridiem}", f"{hour12}:{minute:02d}{meridiem.lower()}", f"{hour12}:{minute:02d} {meridiem[0].lower()}.m."]
+    if minute == 0:
+        variants += [f"{hour12}{meridiem}", f"{hour12} {meridiem}"]
+    return variants
+
+def price_variants(low_cents, high_cents):
+    """Ways the board could write a price range, all meaning low to high"""
+    def dollars(cents, separator=""):
+        whole = f"{cents // 100:,}".replace(",", separator)
+        return whole if cents % 100 == 0 else f"{whole}.{cents % 100:02d}"
+
+    low, high = dollars(low_cents, ","), dollars(high_cents, ",")
+    if low_cents == high_cents:
+        return [f"${low}", f"{low}", f" ${low} "]
+    return [
+        f"${low}-${high}", f"${low} - ${high}", f"${low}--${high}", f"${low}---${high}",
+        f"${low} – ${high}", f"${low}—${high}", f"{dollars(low_cents)}-{dollars(high_cents)}"
+    ]
+
+def discount_variants(percent):
+    return [f"{percent}%", f"{percent} %", f"Up to {percent}%", f"{percent}", f"{percent}.0%"]
+
+def junk(rng):
+    alphabet = string.printable + "–—‐$%:"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+
+def check_case(cells, expected=None):
+    """Normalize one row, failing on anything but a RowFormatError or a misread expected row"""
+    try:
+        row = normalize.normalize_row(cells, PERFORMANCE_DATE, True, "Times Square")
+    except normalize.RowFormatError:
+        if expected is not None:
+            raise AssertionError(f"Rejected {cells!r}")
+        return "rejected"
+    except Exception as e:
+        raise AssertionError(f"{type(e).__name__} on {cells!r}: {e}") from e
+
+    if expected is not None:
+        actual = (row.performance_time, row.discount_percent, row.low_price_cents, row.high_price_cents, row.title, row.is_matinee)
+        if actual != expected:
+            raise AssertionError(f"Read {cells!r} as {actual}, expected {expected}")
+    return "skipped" if row is None else "read"
+
+def fuzz(cases, seed=0):
+    rng = random.Random(seed)
+    outcomes = {"read": 0, "skipped": 0, "rejected": 0}
+
+    for _ in range(cases):
+        hour, minute = rng.randint(0, 23), rng.choice([0, 0, 15, 30, 45])
+        percent = rng.choice([20, 30, 40, 50])
+        low_cents = rng.choice([3900, 4900, 9950, 104950])
+        high_cents = rng.choice([low_cents, low_cents + 5000, low_cents + 10025])
+        title = rng.choice(["Hamilton", "Chicago", "The Lion King", "Hadestown"])
+
+        cells = [
+            rng.choice(time_variants(hour, minute)),
+            rng.choice(discount_variants(percent)),
+            rng.choice(price_variants(low_cents, high_cents)),
+            rng.choice([title, f'"{title}"', f" {title} "])
+        ]
+        expected = (time_of_day(hour, minute), percent, low_cents, high_cents, title, hour < 16)
+        outcomes[check_case(cells, expected)] += 1
+
+        # the same row with one cell replaced by junk must be read, skipped or rejected, never crash
+        broken = list(cells)
+        broken[rng.randrange(4)] = junk(rng)
+        outcomes[check_case(broken)] += 1
+
+    return outcomes
+
+def agree(legacy, row):
+    """Whether the normalizer read a row the way the old code did, where the old code read it"""
+    if legacy is None:
+        return row is None
+    # the old code called 12:xx PM shows evening performances (its rule was "PM" and hour >= 4)
+    return (
+        row is not None
+        and (row.is_matinee == legacy["is_matinee"] or row.performance_time.hour == 12)
+        and row.title == legacy["title"].strip()
+        and row.discount_percent == int(legacy["discount_percent"])
+        and row.low_price_cents == normalize.parse_cents(legacy["low_price"] or "")
+        and row.high_price_cents == normalize.parse_cents(legacy["high_price"] or "")
+        and row.performance_time.strftime("%H:%M:%S") == legacy["performance_time"]
+    )
+
+def benchmark(rounds):
+    cells = fixture_cells()
+    legacy_failures = 0
+    for row_cells in cells:
+        try:
+            legacy = legacy_row(row_cells)
+        except ValueError:
+            legacy_failures += 1
+            continue
+        row = normalize.normalize_row(row_cells, PERFORMANCE_DATE, True, "Times Square")
+        if not agree(legacy, row):
+            raise AssertionError(f"Normalizer and old parsing disagree on {row_cells!r}")
+    print(f"{len(cells)} recorded board rows, normalizer agrees with the old parsing on every row it could read ({legacy_failures} it could not)")
+
+    def run(parse):
+        times = []
+        for _ in range(rounds):
+            normalize.parse_time.cache_clear()
+            start = time.perf_counter()
+            for _ in range(100):
+                for row_cells in cells:
+                    try:
+                        parse(row_cells)
+                    except ValueError:
+                        pass
+            times.append((time.perf_counter() - start) / 100)
+        return times
+
+    for name, parse in [
+        ("legacy", legacy_row),
+        ("normalize", lambda row_cells: normalize.normalize_row(row_cells, PERFORMANCE_DATE, True, "Times Square"))
+    ]:
+        times = run(parse)
+        print(f"{name:<10} min {min(times) * 1e6:8.1f} us  median {statistics.median(times) * 1e6:8.1f} us  per pass over the rows ({rounds} rounds)")
+
+def main():
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    outcomes = fuzz(cases)
+    print(f"Fuzzed {2 * cases} rows: {outcomes['read']} read, {outcomes['skipped']} without a price, {outcomes['rejected']} rejected")
+    benchmark(rounds)
+
+if __name__ == "__main__":
+    main()
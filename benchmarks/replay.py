@@ -0,0 +1,359 @@
+# Replay the TKTS and TDF pipelines offline and benchmark them
+#
+# The pages in benchmarks/fixtures are served in place of the live site (with ETags, so repeat
+# polls take the 304 path) and the database is the in-memory stand-in in fake_supabase.py, so a
+# replay needs no network, credentials or SMTP server. For each stage the wall time over several
+# rounds and the number of database requests of one round are reported:
+#
+#   tkts parse [backend]    parsing the board into rows, once per installed parser backend
+#   tkts sync (cold)        update_database against an empty database and cache
+#   tkts sync (unchanged)   update_database when the board has not changed since the last sync
+#   tdf alerts              main() with new shows to announce to every immediate subscriber
+#   tdf alerts (unchanged)  main() when no show-finder page has changed
+#   tdf alerts (resumed)    main() after a run that crashed halfway through sending its alerts
+#
+# The rows of every parser backend are also checked against each other, and against
+# fixtures/tkts_rows.json when it exists (write it with --update-golden).
+#
+# tests/test_replay.py runs the same stages under pytest-benchmark and asserts their request counts.
+#
+# Usage: python benchmarks/replay.py [rounds]
+#        python benchmarks/replay.py --update-golden
+#        python benchmarks/replay.py --record    (download the live pages into benchmarks/fixtures)
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+
+# Keep the replay's fetch state and caches away from the real ones
+os.environ["TKTS_CACHE_DIR"] = tempfile.mkdtemp(prefix="tkts-replay-")
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, os.path.join(root_dir, "tdf"))
+sys.path.insert(0, os.path.join(root_dir, "tkts"))
+sys.path.insert(0, root_dir)
+sys.path.insert(0, benchmarks_dir)
+
+from pytz import timezone
+
+from common import fetch, supabase_client
+from common.paths import CACHE_DIR
+import scraper
+import database
+import updateDatabase
+from show_cache import ShowCache
+import crawler
+import main as tdf_main
+from fake_supabase import FakeSupabase
+
+# The cache location is fixed by whichever module read it first (under pytest, the temp dir of the tests)
+cache_dir = CACHE_DIR
+
+FIXTURES_DIR = os.path.join(benchmarks_dir, "fixtures")
+GOLDEN_ROWS = os.path.join(FIXTURES_DIR, "tkts_rows.json")
+
+# Fixed fetch time so the rows (and so the golden file) do not depend on the day of the replay
+FETCHED_AT = timezone("US/Eastern").localize(datetime(2025, 1, 15, 14, 0))
+
+# Shows missing from the stored snapshot, so the alert replay has new offers to announce
+NEW_SHOWS_PER_VENUE = 5
+SUBSCRIBERS = 500
+
+def fixture_name(url):
+    """Return the fixture file that stands in for a URL, None if it has none"""
+    if url == scraper.TKTS_URL:
+        return "tkts.html"
+
+    parsed = urlparse(url)
+    if parsed.path.rstrip("/").endswith("/show-finder"):
+        query = parse_qs(parsed.query)
+        return f"show_finder_venue{query['venueId'][0]}_page{query['page'][0]}.html"
+    return None
+
+class FixtureResponse:
+    def __init__(self, url, status_code, text="", headers=None):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"{self.status_code} for {self.url}")
+
+class FixtureSession:
+    """Serves the fixture pages through the interface of a requests session"""
+
+    def __init__(self):
+        self.requests = 0
+        self.pages = {}
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        name = fixture_name(url)
+        if name is None or not os.path.exists(os.path.join(FIXTURES_DIR, name)):
+            return FixtureResponse(url, 404)
+
+        if name not in self.pages:
+            with open(os.path.join(FIXTURES_DIR, name), "r") as file:
+                text = file.read()
+            self.pages[name] = (text, f'"{fetch.digest(text)[:16]}"')
+        text, etag = self.pages[name]
+
+        if (headers or {}).get("If-None-Match") == etag:
+            return FixtureResponse(url, 304, headers={"ETag": etag})
+        return FixtureResponse(url, 200, text, {"ETag": etag})
+
+class RecordingMailer:
+    """Stands in for Mailer, keeping the (subject, recipients) of each message instead of sending it"""
+    sent = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send(self, msg, recipients):
+        RecordingMailer.sent.append((msg["Subject"], tuple(recipients)))
+
+    def send_chunk(self, msg, chunk):
+        RecordingMailer.sent.append((msg["Subject"], tuple(chunk)))
+
+class CrashingMailer(RecordingMailer):
+    """Stands in for a run that dies after sending a number of messages (across all send workers)"""
+    remaining = 0
+    lock = threading.Lock()
+
+    def send_chunk(self, msg, chunk):
+        with CrashingMailer.lock:
+            if CrashingMailer.remaining == 0:
+                raise SystemExit("simulated crash")
+            CrashingMailer.remaining -= 1
+        super().send_chunk(msg, chunk)
+
+class FakeKeys:
+    EMAIL = "alerts@example.com"
+    EMAIL_PASSWORD = None
+
+def reset_state():
+    """Forget the fetch state and caches of earlier rounds"""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+
+def use_database(tables=None):
+    """Point the shared Supabase client at a new in-memory database"""
+    fake = FakeSupabase(tables)
+    supabase_client.client = fake
+    return fake
+
+def new_tkts_connection():
+    db = database.SupabaseConnection()
+    db.show_cache = ShowCache(os.path.join(cache_dir, "shows.sqlite3"))
+    return db
+
+def tdf_tables():
+    """A database whose last stored snapshot lacks a few of the fixture shows, plus subscribers"""
+    current = {}
+    for page in crawler.crawl(tdf_main.VENUES):
+        current.setdefault(page.venue, []).extend(card["title"] for card in page.cards)
+
+    profiles = [
+        {
+            "email": f"subscriber{i}@example.com",
+            "email_verified": True,
+            "frequency": "immediate" if i % 2 else "daily",
+            "broadway": i % 3 != 0,
+            "off_broadway": i % 2 == 0,
+            "off_off_broadway": i % 5 == 0
+        }
+        for i in range(SUBSCRIBERS)
+    ]
+    return {
+        "TDF Show Changes": [{"is_checkpoint": True, "added": {venue: titles[NEW_SHOWS_PER_VENUE:] for venue, titles in current.items()}, "removed": {}}],
+        "TDF User Profiles": profiles
+    }
+
+def measure(rounds, setup, run):
+    """
+    Time run() over several rounds, calling setup() before each one outside the timing
+
+    Returns:
+        tuple: (list of seconds per round, database requests of the last round)
+    """
+    times = []
+    requests = 0
+    for _ in range(rounds):
+        context = setup()
+        fake = supabase_client.client
+        fake.reset_counts()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            run(context)
+            times.append(time.perf_counter() - start)
+        requests = fake.requests
+    return times, requests
+
+def report(name, times, requests=None):
+    requests = "" if requests is None else f"{requests:5d} db requests"
+    print(
+        f"{name:<26} min {min(times) * 1000:8.2f} ms  median {statistics.median(times) * 1000:8.2f} ms  "
+        f"mean {statistics.mean(times) * 1000:8.2f} ms  ({len(times)} rounds) {requests}"
+    )
+
+def installed_backends():
+    backends = list(scraper.PARSER_BACKENDS)
+    if importlib.util.find_spec("lxml") is None:
+        backends.remove("lxml")
+    return backends
+
+def parse_rows(html, backend):
+    return scraper.build_snapshot(html, FETCHED_AT, scraper.parse_sections(html, backend)).rows
+
+def row_states(rows):
+    return [row.to_state() for row in rows]
+
+def check_rows(html, update_golden=False):
+    """Check that every parser backend reads the same rows, and that they match the golden file"""
+    rows = {backend: row_states(parse_rows(html, backend)) for backend in installed_backends()}
+    reference_backend, reference = next(iter(rows.items()))
+    for backend, backend_rows in rows.items():
+        if backend_rows != reference:
+            raise AssertionError(f"Parser backend '{backend}' rows differ from '{reference_backend}'")
+
+    if update_golden:
+        with open(GOLDEN_ROWS, "w") as file:
+            json.dump(reference, file, indent=1)
+        print(f"Wrote {len(reference)} rows to {os.path.relpath(GOLDEN_ROWS, root_dir)}")
+    elif os.path.exists(GOLDEN_ROWS):
+        with open(GOLDEN_ROWS, "r") as file:
+            if json.load(file) != reference:
+                raise AssertionError(f"Parsed rows differ from {os.path.relpath(GOLDEN_ROWS, root_dir)}")
+
+    return len(reference)
+
+# Setups of the stages, each returning the argument of the timed call
+
+def read_fixture_board():
+    with open(os.path.join(FIXTURES_DIR, "tkts.html"), "r") as file:
+        return file.read()
+
+def cold_tkts():
+    reset_state()
+    use_database()
+    return new_tkts_connection()
+
+def unchanged_tkts():
+    db = cold_tkts()
+    with contextlib.redirect_stdout(io.StringIO()):
+        updateDatabase.update_database(db)
+    return db
+
+def new_offers():
+    reset_state()
+    tables = tdf_tables()
+    reset_state()
+    use_database(tables)
+    tdf_main.changes_since_checkpoint = None
+    RecordingMailer.sent = []
+
+def unchanged_offers():
+    new_offers()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tdf_main.main()
+
+def planned_messages():
+    """Number of messages an uninterrupted alert run sends"""
+    new_offers()
+    with contextlib.redirect_stdout(io.StringIO()):
+        tdf_main.main()
+    return len(RecordingMailer.sent)
+
+def crashed_run(sent_before_crash):
+    """Leave behind a run that died after sending a number of its messages"""
+    new_offers()
+    CrashingMailer.remaining = sent_before_crash
+    mailer = tdf_main.Mailer
+    tdf_main.Mailer = CrashingMailer
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tdf_main.main()
+    except SystemExit:
+        pass
+    finally:
+        tdf_main.Mailer = mailer
+
+def check_resumed(planned):
+    """Check that the crashed run and the run resuming it sent every planned message exactly once"""
+    if len(RecordingMailer.sent) != planned:
+        raise AssertionError(f"{len(RecordingMailer.sent)} messages sent across the crash and the resumed run, {planned} planned")
+    if len(set(RecordingMailer.sent)) != len(RecordingMailer.sent):
+        raise AssertionError("A message was sent to the same recipients twice across the crash and the resumed run")
+
+def go_offline():
+    """Serve the fixtures, record mail instead of sending it and use fake credentials"""
+    fetch.session = FixtureSession()
+    tdf_main.Mailer = RecordingMailer
+    tdf_main.get_keys = lambda: FakeKeys
+
+def benchmark(rounds):
+    go_offline()
+    html = read_fixture_board()
+
+    print(f"{check_rows(html)} TKTS rows, identical across parser backends")
+
+    for backend in installed_backends():
+        times, _ = measure(rounds, lambda: use_database(), lambda _: parse_rows(html, backend))
+        report(f"tkts parse [{backend}]", times)
+
+    report("tkts sync (cold)", *measure(rounds, cold_tkts, updateDatabase.update_database))
+    report("tkts sync (unchanged)", *measure(rounds, unchanged_tkts, updateDatabase.update_database))
+
+    report("tdf alerts", *measure(rounds, new_offers, lambda _: tdf_main.main()))
+    print(f"{'':<26} {len(RecordingMailer.sent)} messages, {sum(len(recipients) for _, recipients in RecordingMailer.sent)} recipients")
+
+    report("tdf alerts (unchanged)", *measure(rounds, unchanged_offers, lambda _: tdf_main.main()))
+
+    planned = planned_messages()
+    report("tdf alerts (resumed)", *measure(rounds, lambda: crashed_run(planned // 2), lambda _: tdf_main.main()))
+    check_resumed(planned)
+    print(f"{'':<26} {len(RecordingMailer.sent)} of {planned} messages sent across the crash and the resumed run, none twice")
+
+def record():
+    """Download the live TKTS board and every show-finder page into the fixtures directory"""
+    def save(url, text):
+        with open(os.path.join(FIXTURES_DIR, fixture_name(url)), "w") as file:
+            file.write(text)
+        print(f"Recorded {fixture_name(url)}")
+
+    save(scraper.TKTS_URL, scraper.get_tkts_html())
+    # crawled pages keep only what they parsed, so download each page again to save it
+    for page in crawler.crawl(tdf_main.VENUES):
+        save(page.result.url, fetch.conditional_get(page.result.url, force=True).text)
+
+def main():
+    try:
+        if "--record" in sys.argv:
+            record()
+        elif "--update-golden" in sys.argv:
+            check_rows(read_fixture_board(), update_golden=True)
+        else:
+            benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from common import instrument
+from common.paths import CACHE_DIR
+
+STATE_FILE = os.path.join(CACHE_DIR, "fetch_state.json")
+
+# Jobs running in threads of one process (see service.py) commit to the same state file
+state_lock = threading.Lock()
+
+# Seconds to wait when connecting to / reading from a page
+TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 15))
+
+# One pooled, retrying session shared by every fetch in the process
+session = requests.Session()
+adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+
+@dataclass
+class FetchResult:
+    """Outcome of a conditional GET"""
+    url: str
+    text: str = None  # None when the server answered 304 Not Modified, or once released
+    etag: str = None
+    last_modified: str = None
+    previous: dict = field(default_factory=dict)  # state committed by the last successful run
+    not_modified: bool = False  # the server answered 304 Not Modified
+
+    def release(self):
+        """Drop the downloaded text once it has been parsed, keeping what commit needs"""
+        self.text = None
+
+    def is_unchanged(self, digest=None):
+        """True if the page (or its relevant fragment, given as digest) matches the last committed run"""
+        return self.not_modified or (digest is not None and digest == self.previous.get("digest"))
+
+def digest(content):
+    """Return a stable digest of a page fragment"""
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_state(state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # a temp file of its own, so a concurrent save (e.g. from another process) cannot replace or remove it
+    with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, prefix="fetch_state.", suffix=".tmp", delete=False) as file:
+        json.dump(state, file)
+    try:
+        os.replace(file.name, STATE_FILE)
+    except OSError:
+        os.unlink(file.name)
+        raise
+
+def get_committed(url):
+    """Return the state committed for a URL (or a name given to commit_all) by the last successful run"""
+    return load_state().get(url, {})
+
+def conditional_get(url, force=False):
+    """
+    GET a page, sending If-None-Match/If-Modified-Since from the last committed run
+
+    Args:
+        url (str): Page to fetch
+        force (bool): Ignore the committed validators and always download the page
+
+    Returns:
+        FetchResult: The page, or a not-modified result carrying the committed state
+    """
+    previous = get_committed(url)
+
+    headers = {}
+    if not force:
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    with instrument.span("fetch"):
+        response = session.get(url, headers=headers, timeout=TIMEOUT)
+    instrument.count("fetch_responses", status=response.status_code)
+    if response.status_code == 304:
+        return FetchResult(url, etag=previous.get("etag"), last_modified=previous.get("last_modified"), previous=previous, not_modified=True)
+    response.raise_for_status()
+
+    return FetchResult(
+        url,
+        text=response.text,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        previous=previous
+    )
+
+def commit(result, digest, **extra):
+    """
+    Persist the validators and fragment digest of a fetch once it has been fully processed
+
+    Args:
+        result (FetchResult): The processed fetch
+        digest (str): Digest of the relevant page fragment
+        **extra: Additional state to keep for the next run (e.g. parsed titles)
+    """
+    commit_all([(result, digest, extra)])
+
+def commit_all(fetches, named_state=None):
+    """
+    Persist several processed fetches, plus state not tied to any one page, in one save
+
+    Args:
+        fetches (list): (FetchResult, digest, extra state dict) per fetch, as for commit
+        named_state (dict): Name -> state to keep for the next run, read back with get_committed(name) (optional)
+    """
+    with state_lock:
+        state = load_state()
+        for result, digest, extra in fetches:
+            state[result.url] = {
+                "etag": result.etag,
+                "last_modified": result.last_modified,
+                "digest": digest,
+                **extra
+            }
+        state.update(named_state or {})
+        save_state(state)
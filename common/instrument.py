@@ -0,0 +1,181 @@
+import functools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from common.paths import CACHE_DIR
+
+# Set METRICS_EXPORT to "jsonl" or "prometheus" to collect timing spans and counters;
+# when it is unset every hook below is a no-op
+EXPORT_FORMAT = os.environ.get("METRICS_EXPORT", "").lower() or None
+ENABLED = EXPORT_FORMAT is not None
+
+if EXPORT_FORMAT not in (None, "jsonl", "prometheus"):
+    raise ValueError(f"Unknown METRICS_EXPORT '{EXPORT_FORMAT}', expected 'jsonl' or 'prometheus'")
+
+# JSON lines get one line per export, holding what was recorded since the previous export;
+# the Prometheus text file is rewritten on each export with the totals of the process.
+# The metrics are shared by the whole process, so export from one place only (the end of a
+# script, or the timer in service.py).
+#
+# The status prints of the pipelines stay as the human-readable log the workflows show; the
+# spans and counters here are the structured record of timings, volumes and failures.
+METRICS_FILE = os.environ.get("METRICS_FILE") or os.path.join(
+    CACHE_DIR, "metrics.prom" if EXPORT_FORMAT == "prometheus" else "metrics.jsonl"
+)
+
+PROMETHEUS_PREFIX = "tkts_"
+
+counters = {}
+spans = {}
+lock = threading.Lock()
+
+# Shared no-op span, so disabled spans cost one function call
+disabled_span = nullcontext()
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def count(name, value=1, **labels):
+    """Add value to a counter"""
+    if not ENABLED:
+        return
+    key = (name, label_key(labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def record(name, seconds, **labels):
+    """Record one timed occurrence of a span"""
+    key = (name, label_key(labels))
+    with lock:
+        stats = spans.get(key)
+        if stats is None:
+            spans[key] = {"count": 1, "total_seconds": seconds, "max_seconds": seconds}
+        else:
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+class Span:
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        labels = self.labels if exc_type is None else {**self.labels, "error": exc_type.__name__}
+        record(self.name, time.perf_counter() - self.start, **labels)
+
+def span(name, **labels):
+    """
+    Time a block of code
+
+    Usage:
+        with instrument.span("fetch", url=url):
+            ...
+    """
+    if not ENABLED:
+        return disabled_span
+    return Span(name, labels)
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function as a span (named after the function by default)
+
+    When instrumentation is disabled the function is returned undecorated.
+    """
+    def decorator(function):
+        if not ENABLED:
+            return function
+
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def snapshot(reset=False):
+    """
+    Return the recorded counters and spans
+
+    Args:
+        reset (bool): Start counting from zero again afterwards
+
+    Returns:
+        dict: counters and spans, each a list of dicts with name and labels
+    """
+    with lock:
+        result = {
+            "counters": [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in counters.items()],
+            "spans": [{"name": name, "labels": dict(labels), **stats} for (name, labels), stats in spans.items()]
+        }
+        if reset:
+            counters.clear()
+            spans.clear()
+    return result
+
+def metric_name(name):
+    return PROMETHEUS_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+def prometheus_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + "}"
+
+def to_prometheus(recorded):
+    """Render recorded metrics in the Prometheus text exposition format"""
+    lines = []
+    typed = set()
+
+    for counter in sorted(recorded["counters"], key=lambda counter: counter["name"]):
+        name = metric_name(counter["name"]) + "_total"
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{prometheus_labels(counter['labels'])} {counter['value']}")
+
+    for stats in sorted(recorded["spans"], key=lambda stats: stats["name"]):
+        name = metric_name(stats["name"]) + "_seconds"
+        if name not in typed:
+            lines.append(f"# TYPE {name} summary")
+            typed.add(name)
+        labels = prometheus_labels(stats["labels"])
+        lines.append(f"{name}_count{labels} {stats['count']}")
+        lines.append(f"{name}_sum{labels} {stats['total_seconds']:.6f}")
+
+    return "\n".join(lines) + "\n"
+
+def export(job=None):
+    """
+    Write what has been recorded to METRICS_FILE in the configured format
+
+    Args:
+        job (str): Name of the script or service exporting, added to JSON lines (optional)
+    """
+    if not ENABLED:
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(METRICS_FILE)), exist_ok=True)
+
+    if EXPORT_FORMAT == "jsonl":
+        recorded = snapshot(reset=True)
+        line = {"time": datetime.now(timezone.utc).isoformat(), "job": job, **recorded}
+        with open(METRICS_FILE, "a") as file:
+            file.write(json.dumps(line) + "\n")
+    else:
+        # write then rename, so a scraper never reads a half-written file
+        temp_file = METRICS_FILE + ".tmp"
+        with open(temp_file, "w") as file:
+            file.write(to_prometheus(snapshot()))
+        os.replace(temp_file, METRICS_FILE)
@@ -0,0 +1,4 @@
+import os
+
+# Local state (fetch validators, caches, journals) lives next to the repo unless TKTS_CACHE_DIR points elsewhere
+CACHE_DIR = os.environ.get("TKTS_CACHE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache"))
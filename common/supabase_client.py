@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+
+from common import instrument
+
+# Seconds before a database request times out
+TIMEOUT = float(os.environ.get("SUPABASE_TIMEOUT", 10))
+# Attempts per request, and the backoff before the first retry (doubled for each retry after it)
+MAX_ATTEMPTS = int(os.environ.get("SUPABASE_MAX_ATTEMPTS", 3))
+BACKOFF_SECONDS = float(os.environ.get("SUPABASE_BACKOFF_SECONDS", 0.5))
+
+client = None
+client_lock = threading.Lock()
+
+metrics = {
+    "clients_created": 0,
+    "client_reuses": 0,
+    "requests": 0,
+    "retries": 0,
+    "failures": 0
+}
+metrics_lock = threading.Lock()
+
+def count(metric):
+    with metrics_lock:
+        metrics[metric] += 1
+    instrument.count("supabase_" + metric)
+
+def get_client():
+    """
+    Return the process-wide Supabase client, creating it on first use
+
+    Every caller shares the same client and so the same keep-alive connection pool.
+    """
+    global client
+    with client_lock:
+        if client is None:
+            from supabase import create_client, ClientOptions
+            from keys.keys import SUPABASE_URL, SUPABASE_KEY
+
+            client = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(postgrest_client_timeout=TIMEOUT))
+            count("clients_created")
+        else:
+            count("client_reuses")
+    return client
+
+def is_retryable(error, http_method):
+    """Connection failures are always safe to retry; timeouts and dropped connections only for reads"""
+    import httpx
+
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    return http_method in ("GET", "HEAD") and isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError))
+
+def execute(query):
+    """
+    Execute a query built on the shared client, retrying transient failures with backoff
+
+    Args:
+        query: A Supabase query builder (e.g. client.table(...).select(...))
+
+    Returns:
+        APIResponse: The response of the query
+    """
+    http_method = getattr(query, "http_method", "GET")
+
+    for attempt in range(MAX_ATTEMPTS):
+        count("requests")
+        try:
+            with instrument.span("supabase_request", method=http_method):
+                response = query.execute()
+            instrument.count("supabase_rows", len(response.data or []), method=http_method)
+            return response
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e, http_method):
+                count("failures")
+                raise
+            count("retries")
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+def get_metrics():
+    """Return a copy of the client reuse and request counters"""
+    with metrics_lock:
+        return dict(metrics)
@@ -0,0 +1,109 @@
+from functools import lru_cache
+import html
+import re
+import unicodedata
+
+# Show titles are written differently by the TKTS board, the show finder and over time: straight or
+# curly quotes, HTML entities, "&" or "and", a leading "The", casing, accents and stray punctuation.
+# canonical_key maps all of these to one key, so the same show is matched however it is written.
+
+APOSTROPHES = re.compile(r"['‘’`´]")
+DOUBLE_QUOTES = re.compile(r'["“”„]')
+NON_WORD = re.compile(r"[\W_]+")
+LEADING_ARTICLE = re.compile(r"^the\s+")
+
+# Titles at least this similar (Jaccard similarity of their trigrams) are reported as likely the same show
+MIN_SIMILARITY = 0.5
+
+def clean_title(title):
+    """Display form of a scraped title: entities unescaped, double quotes dropped, whitespace collapsed"""
+    return " ".join(DOUBLE_QUOTES.sub("", html.unescape(title)).split())
+
+@lru_cache(maxsize=4096)
+def canonical_key(title):
+    """Key under which differently written titles of the same show are equal, "" if the title has no words"""
+    text = unicodedata.normalize("NFKD", html.unescape(title))
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    text = APOSTROPHES.sub("", text.replace("&", " and "))
+    text = NON_WORD.sub(" ", text).strip()
+    return LEADING_ARTICLE.sub("", text)
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TitleIndex:
+    """
+    In-memory lookup of values (such as show IDs) by title
+
+    Exact lookups go through the canonical key of the title. Fuzzy lookups go through an inverted
+    index of the trigrams of each key, so only titles sharing a trigram with the query are scored.
+    When several titles have the same key, the first one added wins.
+    """
+
+    def __init__(self, items=()):
+        self.values = {}  # canonical key -> value
+        self.titles = {}  # canonical key -> title as first added
+        self.sizes = {}  # canonical key -> number of trigrams
+        self.postings = {}  # trigram -> set of canonical keys
+        for title, value in items:
+            self.add(title, value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, title, value):
+        key = canonical_key(title)
+        if not key or key in self.values:
+            return
+        self.values[key] = value
+        self.titles[key] = title
+        key_trigrams = trigrams(key)
+        self.sizes[key] = len(key_trigrams)
+        for trigram in key_trigrams:
+            self.postings.setdefault(trigram, set()).add(key)
+
+    def get(self, title, default=None):
+        return self.values.get(canonical_key(title), default)
+
+    def __contains__(self, title):
+        return canonical_key(title) in self.values
+
+    def scored(self, title):
+        """Yield (key, shared trigrams, query trigrams) for every indexed key sharing a trigram with title"""
+        query = trigrams(canonical_key(title))
+        shared = {}
+        for trigram in query:
+            for key in self.postings.get(trigram, ()):
+                shared[key] = shared.get(key, 0) + 1
+        for key, count in shared.items():
+            yield key, count, len(query)
+
+    def search(self, text, limit=10, min_coverage=0.5):
+        """
+        Find titles containing text, tolerating small spelling differences
+
+        Returns:
+            list: (title, value, score) tuples, best first; score is the share of the trigrams of text found in the title
+        """
+        matches = [
+            (self.titles[key], self.values[key], shared / query_size, len(key))
+            for key, shared, query_size in self.scored(text)
+            if shared / query_size >= min_coverage
+        ]
+        matches.sort(key=lambda match: (-match[2], match[3]))
+        return [(title, value, score) for title, value, score, _ in matches[:limit]]
+
+    def closest(self, title, min_similarity=MIN_SIMILARITY):
+        """
+        Return the indexed title most similar to title as a whole (Jaccard similarity of trigrams)
+
+        Returns:
+            tuple: (title, value, similarity), None if no title is similar enough
+        """
+        best = None
+        for key, shared, query_size in self.scored(title):
+            similarity = shared / (query_size + self.sizes[key] - shared)
+            if similarity >= min_similarity and (best is None or similarity > best[2]):
+                best = (self.titles[key], self.values[key], similarity)
+        return best
@@ -0,0 +1,104 @@
+# Long-running service that schedules the TKTS sync and the TDF alert/digest jobs in one process,
+# keeping the HTTP session and Supabase clients warm between runs
+#
+# Usage: python service.py
+#
+# Poll intervals (seconds) are read from the environment:
+#   TKTS_MIN_POLL_INTERVAL          TKTS sync while booths are open and the board churns (default 60)
+#   TKTS_MAX_POLL_INTERVAL          TKTS sync while booths are closed (default 1200)
+#   TKTS_BOOTH_HOURS                Booth hours in Eastern time, used until there is logged history (default 10:00-20:00)
+#   TDF_POLL_INTERVAL               TDF alerts (default 300)
+#   TDF_DIGEST_POLL_INTERVAL        TDF digests (default 3600)
+#
+# Set METRICS_EXPORT=jsonl or prometheus to export the timings and counters of the whole process to
+# METRICS_FILE every METRICS_EXPORT_INTERVAL seconds (default 60) and on shutdown
+import asyncio
+import os
+import signal
+import sys
+
+# Import the pipeline scripts the same way they import their siblings
+root_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(root_dir, "tdf"))
+sys.path.insert(0, os.path.join(root_dir, "tkts"))
+
+import database
+import updateDatabase
+from scheduler import PollScheduler
+import main as tdf_main
+from common import instrument, supabase_client
+
+TKTS_MIN_POLL_INTERVAL = float(os.environ.get("TKTS_MIN_POLL_INTERVAL", 60))
+TKTS_MAX_POLL_INTERVAL = float(os.environ.get("TKTS_MAX_POLL_INTERVAL", 1200))
+TDF_POLL_INTERVAL = float(os.environ.get("TDF_POLL_INTERVAL", 300))
+TDF_DIGEST_POLL_INTERVAL = float(os.environ.get("TDF_DIGEST_POLL_INTERVAL", 3600))
+METRICS_EXPORT_INTERVAL = float(os.environ.get("METRICS_EXPORT_INTERVAL", 60))
+
+async def run_periodically(name, job, get_interval, stop):
+    """
+    Run a blocking job in a worker thread, then wait for its interval, until stop is set
+
+    get_interval may block too (the TKTS scheduler reads its history from Supabase), so it also runs in a worker thread.
+
+    A run that is in progress when stop is set is allowed to finish.
+    """
+    while not stop.is_set():
+        try:
+            await asyncio.to_thread(job)
+        except Exception as e:
+            print(f"❌ {name} failed: {e}")
+            instrument.count("job_failures", job=name)
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=await asyncio.to_thread(get_interval))
+        except asyncio.TimeoutError:
+            pass
+
+    print(f"{name} stopped.")
+
+async def export_metrics(stop):
+    """
+    Export the metrics of every job on a timer, until stop is set (serve exports once more when the jobs have stopped)
+
+    Jobs run concurrently and share the recorded metrics, so they are exported from here alone:
+    a JSON lines export resets what it wrote, which would drop the metrics of a job still running
+    if jobs exported themselves.
+    """
+    if not instrument.ENABLED:
+        return
+
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=METRICS_EXPORT_INTERVAL)
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(instrument.export, "service")
+
+async def serve():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+
+    # one warm Supabase connection for every TKTS run
+    db = database.get_connection()
+    db.test_connection()
+
+    # space TKTS polls by booth hours and board churn
+    scheduler = PollScheduler(db, TKTS_MIN_POLL_INTERVAL, TKTS_MAX_POLL_INTERVAL)
+
+    def sync_tkts():
+        scheduler.record_run(updateDatabase.update_database(db))
+
+    await asyncio.gather(
+        run_periodically("TKTS sync", sync_tkts, scheduler.next_interval, stop),
+        run_periodically("TDF alerts", tdf_main.main, lambda: TDF_POLL_INTERVAL, stop),
+        run_periodically("TDF digests", tdf_main.send_digests, lambda: TDF_DIGEST_POLL_INTERVAL, stop),
+        export_metrics(stop),
+    )
+    scheduler.flush()
+    instrument.export("service")
+    print(f"Supabase client metrics: {supabase_client.get_metrics()}")
+    print("Service shut down.")
+
+if __name__ == "__main__":
+    asyncio.run(serve())
@@ -0,0 +1,59 @@
+-- Tables read and written by the TDF change chain, show intervals, digests, the TKTS poll
+-- scheduler and the TKTS price history. Apply before deploying the code that uses them
+-- (e.g. supabase db push, or paste into the SQL editor); every statement is safe to run twice.
+
+-- TDF offers as a chain of changes with periodic checkpoints (see tdf/snapshots.py)
+CREATE TABLE IF NOT EXISTS "TDF Show Changes" (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    is_checkpoint boolean NOT NULL DEFAULT false,
+    added jsonb NOT NULL DEFAULT '{}'::jsonb,
+    removed jsonb NOT NULL DEFAULT '{}'::jsonb
+);
+CREATE INDEX IF NOT EXISTS "TDF Show Changes_checkpoint_created_at_idx" ON "TDF Show Changes" (is_checkpoint, created_at);
+
+-- One row per continuous stretch a show was listed for a venue (see tdf/main.py)
+CREATE TABLE IF NOT EXISTS "TDF Show Intervals" (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    show_name text NOT NULL,
+    show_key text,
+    venue text NOT NULL,
+    first_seen timestamptz NOT NULL,
+    last_seen timestamptz NOT NULL,
+    left_at timestamptz
+);
+ALTER TABLE "TDF Show Intervals" ADD COLUMN IF NOT EXISTS show_key text;
+CREATE INDEX IF NOT EXISTS "TDF Show Intervals_show_key_idx" ON "TDF Show Intervals" (show_key);
+CREATE INDEX IF NOT EXISTS "TDF Show Intervals_open_idx" ON "TDF Show Intervals" (venue) WHERE left_at IS NULL;
+CREATE INDEX IF NOT EXISTS "TDF Show Intervals_first_seen_idx" ON "TDF Show Intervals" (first_seen);
+
+-- When the digest of each frequency (hourly, daily, weekly) was last sent
+CREATE TABLE IF NOT EXISTS "TDF Digests" (
+    frequency text PRIMARY KEY,
+    last_sent_at timestamptz NOT NULL
+);
+
+-- Every polling decision of the TKTS scheduler (see tkts/scheduler.py)
+CREATE TABLE IF NOT EXISTS "Poll Decisions" (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    decided_at timestamptz,
+    interval_seconds integer NOT NULL,
+    open_probability real NOT NULL,
+    churn real NOT NULL
+);
+ALTER TABLE "Poll Decisions" ADD COLUMN IF NOT EXISTS decided_at timestamptz;
+
+-- Append-only history of what the board showed for each discount record (see tkts/price_history.py)
+CREATE TABLE IF NOT EXISTS "TKTS Price Snapshots" (
+    id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    discount_id bigint NOT NULL REFERENCES "TKTS Discounts" (id) ON DELETE CASCADE,
+    show_id bigint NOT NULL,
+    performance_date date NOT NULL,
+    observed_at timestamptz NOT NULL,
+    discount_percent smallint,
+    low_price_cents integer,
+    high_price_cents integer
+);
+CREATE INDEX IF NOT EXISTS "TKTS Price Snapshots_show_date_observed_idx" ON "TKTS Price Snapshots" (show_id, performance_date, observed_at);
+CREATE INDEX IF NOT EXISTS "TKTS Price Snapshots_discount_observed_idx" ON "TKTS Price Snapshots" (discount_id, observed_at DESC);
@@ -0,0 +1,3 @@
+-- Booth status of every TKTS source in one column, so a new source's booths are logged without a
+-- column of their own (see tkts/updateDatabase.py get_change_log). Apply before deploying.
+ALTER TABLE "Logs" ADD COLUMN IF NOT EXISTS booths_open jsonb;
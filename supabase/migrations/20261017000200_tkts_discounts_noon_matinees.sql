@@ -0,0 +1,15 @@
+-- Shows starting 12:00-12:59 PM count as matinees now (see tkts/normalize.py), but were stored as
+-- evening performances before. is_matinee is part of the key the sync matches records by, so correct
+-- the stored records once; without this a 12:xx performance already stored would gain a second record.
+-- A record is left alone when its performance already has a matinee record. Apply before deploying.
+UPDATE "TKTS Discounts" AS evening
+SET is_matinee = true
+WHERE evening.is_matinee = false
+  AND evening.performance_time::time >= '12:00'
+  AND evening.performance_time::time < '13:00'
+  AND NOT EXISTS (
+    SELECT 1 FROM "TKTS Discounts" AS matinee
+    WHERE matinee.show_id = evening.show_id
+      AND matinee.performance_date = evening.performance_date
+      AND matinee.is_matinee = true
+  );
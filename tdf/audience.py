@@ -0,0 +1,68 @@
+import sys
+
+class AudienceIndex:
+    """
+    Verified subscriber profiles held as interned emails plus one membership bitset per
+    boolean preference column and per frequency, so any preference combination resolves
+    with a few integer ANDs
+    """
+
+    def __init__(self, profiles):
+        self.emails = []
+        self.flags = {}
+        self.frequencies = {}
+
+        for profile in profiles:
+            if not profile.get("email"):
+                continue
+
+            bit = 1 << len(self.emails)
+            self.emails.append(sys.intern(profile["email"]))
+
+            for column, value in profile.items():
+                if value is True:
+                    self.flags[column] = self.flags.get(column, 0) | bit
+            if profile.get("frequency"):
+                self.frequencies[profile["frequency"]] = self.frequencies.get(profile["frequency"], 0) | bit
+
+        self.everyone = (1 << len(self.emails)) - 1
+
+    def mask(self, *flags, frequency=None):
+        """Return the bitset of subscribers with every given flag set (and the given frequency)"""
+        mask = self.everyone
+        for flag in flags:
+            mask &= self.flags.get(flag, 0)
+        if frequency:
+            mask &= self.frequencies.get(frequency, 0)
+        return mask
+
+    def members(self, mask):
+        """Return the emails whose bits are set in mask"""
+        emails = []
+        while mask:
+            lowest = mask & -mask
+            emails.append(self.emails[lowest.bit_length() - 1])
+            mask ^= lowest
+        return emails
+
+    def select(self, *flags, frequency=None):
+        """Return the emails of subscribers with every given flag set (and the given frequency)"""
+        return self.members(self.mask(*flags, frequency=frequency))
+
+    def cohorts(self, flags, frequency=None):
+        """
+        Group subscribers by which of the given flags they have set
+
+        Returns:
+            dict: tuple of set flags -> list of emails, subscribers with none of the flags are left out
+        """
+        base = self.mask(frequency=frequency)
+        groups = {}
+        for bit_index in range(len(self.emails)):
+            bit = 1 << bit_index
+            if not base & bit:
+                continue
+            set_flags = tuple(flag for flag in flags if self.flags.get(flag, 0) & bit)
+            if set_flags:
+                groups.setdefault(set_flags, []).append(self.emails[bit_index])
+        return groups
@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+import html
+import math
+import os
+import re
+import sys
+
+# Add parent directory to path to import the shared fetch layer
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from common import fetch
+from common.titles import clean_title
+
+VENUE_IDS = {
+    "broadway": 1,
+    "off_broadway": 2,
+    "off_off_broadway": 3
+}
+
+PAGE_SIZE = 100
+
+# Pages fetched at once, within the connection pool of the shared session
+CRAWL_WORKERS = 8
+
+# Each show card has a poster image whose alt text is the title, usually wrapped in a link to the show page
+CARD_PATTERN = re.compile(r'<img[^>]*class="to-be-scaled img-el"[^>]*alt="([^"]+)"')
+LINK_PATTERN = re.compile(r'<a[^>]*href="([^"]+)"[^>]*>(?:(?!</a>).)*$', re.DOTALL)
+SHOW_ID_PATTERN = re.compile(r'(\d+)/?(?:\?.*)?$')
+TOTAL_PATTERN = re.compile(r'([\d,]+)\s+(?:results|shows)\b', re.IGNORECASE)
+
+# How far before a card's image to look for the link that wraps it
+LINK_LOOKBEHIND = 1000
+
+@dataclass
+class CrawledPage:
+    """One show-finder results page for a venue"""
+    venue: str
+    number: int
+    result: fetch.FetchResult
+    cards: list = field(default_factory=list)
+    total: int = None  # total number of results for the venue, if the page states it
+
+    @property
+    def digest(self):
+        # the total decides which later pages are fetched, so a page whose total changed has changed
+        return fetch.digest(f"{self.total}\n" + "\n".join(sorted(card["title"] for card in self.cards)))
+
+def page_url(venue_id, page, page_size=PAGE_SIZE):
+    return f"https://www.tdf.org/on-stage/show-finder/?page={page}&pageSize={page_size}&tdfMembership=true&venueId={venue_id}"
+
+def iter_cards(html_content):
+    """Yield a dict with the title, and the show URL/ID when linked, for each show card on a page"""
+    for match in CARD_PATTERN.finditer(html_content):
+        card = {"title": clean_title(match.group(1)), "url": None, "show_id": None}
+
+        link = LINK_PATTERN.search(html_content, max(0, match.start() - LINK_LOOKBEHIND), match.start())
+        if link:
+            card["url"] = html.unescape(link.group(1))
+            show_id = SHOW_ID_PATTERN.search(card["url"])
+            if show_id:
+                card["show_id"] = int(show_id.group(1))
+
+        yield card
+
+def parse_total(html_content, card_count):
+    """Return the total result count stated on a page, None if it cannot be found"""
+    for match in TOTAL_PATTERN.finditer(html_content):
+        total = int(match.group(1).replace(",", ""))
+        if total >= card_count:
+            return total
+    return None
+
+def build_page(venue, number, result):
+    if result.not_modified:
+        cards = result.previous.get("cards") or [{"title": title, "url": None, "show_id": None} for title in result.previous.get("titles", [])]
+        return CrawledPage(venue, number, result, cards, result.previous.get("total"))
+
+    cards = list(iter_cards(result.text))
+    total = parse_total(result.text, len(cards))
+    # crawled pages are kept until the run commits them, which needs the validators but not the page itself
+    result.release()
+    return CrawledPage(venue, number, result, cards, total)
+
+def crawl(venues, page_size=PAGE_SIZE):
+    """
+    Crawl every results page of the show finder for several venues
+
+    The first page of each venue is fetched concurrently. As soon as a first page states the
+    total result count, the remaining pages of its venue are fetched concurrently with whatever
+    is still in flight; otherwise pages are followed one at a time until a page comes back short.
+
+    Args:
+        venues (iterable): Venue names (keys of VENUE_IDS)
+        page_size (int): Results per page
+
+    Yields:
+        CrawledPage: Each fetched page as soon as it arrives, so pages of a venue may come out of order
+    """
+    venues = list(venues)
+    unknown_totals = []
+
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        def submit(venue, number):
+            pending[executor.submit(fetch.conditional_get, page_url(VENUE_IDS[venue], number, page_size))] = (venue, number)
+
+        pending = {}
+        for venue in venues:
+            submit(venue, 1)
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                venue, number = pending.pop(future)
+                page = build_page(venue, number, future.result())
+                yield page
+
+                if number != 1:
+                    continue
+                if page.total is not None:
+                    for later in range(2, math.ceil(page.total / page_size) + 1):
+                        submit(venue, later)
+                elif len(page.cards) >= page_size:
+                    unknown_totals.append(venue)
+
+    for venue in unknown_totals:
+        number = 1
+        page_length = page_size
+        while page_length >= page_size:
+            number += 1
+            page = build_page(venue, number, fetch.conditional_get(page_url(VENUE_IDS[venue], number, page_size)))
+            page_length = len(page.cards)
+            yield page
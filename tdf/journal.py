@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import fcntl
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+# Add parent directory to path to import the shared cache location
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from common.paths import CACHE_DIR
+
+JOURNAL_FILE = os.path.join(CACHE_DIR, "tdf_journal.sqlite3")
+
+# Finished runs are kept this long, for inspecting what was sent
+KEEP = timedelta(days=float(os.environ.get("TDF_JOURNAL_KEEP_DAYS", 7)))
+
+@dataclass
+class Run:
+    """A run whose messages were planned but which has not stored its outcome yet"""
+    run_id: int
+    started_at: str
+    offers: dict  # what to store once every message is sent (alerts: venue -> titles; digests: frequency -> time covered up to)
+
+@dataclass
+class Chunk:
+    """One message of an alert or digest: the email to send and the recipients to blind copy"""
+    email_id: int
+    chunk: int
+    venue: str  # the frequency, for a digest
+    title: str
+    body: str
+    recipients: list
+
+class RunJournal:
+    """
+    Write-ahead journal of a mailing job (alerts or digests), in a local SQLite file, plus a lock so runs cannot overlap
+
+    A run writes every email and recipient chunk it is about to send in one transaction before
+    sending any of them, marks each chunk as soon as the mail server accepted it, and is marked
+    finished once its offers are stored. A run that crashed is resumed by the next one, which
+    sends only the chunks still pending; at most a chunk that was accepted just before the crash
+    is sent twice. Chunks can be marked from several send workers at once.
+    """
+
+    def __init__(self, job, path=JOURNAL_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.job = job
+        self.lock_path = os.path.join(os.path.dirname(path), f"{job}.lock")
+        self.lock_file = None
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = FULL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY AUTOINCREMENT, job TEXT NOT NULL, started_at TEXT NOT NULL, finished_at TEXT, offers TEXT NOT NULL);
+                CREATE TABLE IF NOT EXISTS emails (run_id INTEGER NOT NULL, email_id INTEGER NOT NULL, venue TEXT NOT NULL, title TEXT NOT NULL, body TEXT NOT NULL, PRIMARY KEY (run_id, email_id));
+                CREATE TABLE IF NOT EXISTS chunks (run_id INTEGER NOT NULL, email_id INTEGER NOT NULL, chunk INTEGER NOT NULL, recipients TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'pending', sent_at TEXT, error TEXT, PRIMARY KEY (run_id, email_id, chunk));
+            """)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.release()
+        self.connection.close()
+
+    def acquire(self):
+        """
+        Take the run lock of the job, without waiting
+
+        The lock is an flock on a file next to the journal, so the system releases it if the
+        process dies.
+
+        Returns:
+            bool: True if the lock was taken, False if another run holds it
+        """
+        self.lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+
+    def release(self):
+        if self.lock_file is None:
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+    def now(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def unfinished_run(self):
+        """Return the oldest run of the job that was not finished, None if there is none"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT run_id, started_at, offers FROM runs WHERE job = ? AND finished_at IS NULL ORDER BY run_id LIMIT 1",
+                (self.job,)
+            ).fetchone()
+        return None if row is None else Run(row[0], row[1], json.loads(row[2]))
+
+    def start_run(self, offers, emails):
+        """
+        Record a run and everything it is about to send, in one transaction
+
+        Args:
+            offers (dict): Venue -> titles, the offers to store once the alerts are sent
+            emails (list): (venue, title, body, recipient chunks) tuples, one per alert
+
+        Returns:
+            int: ID of the run
+        """
+        with self.lock, self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (job, started_at, offers) VALUES (?, ?, ?)",
+                (self.job, self.now(), json.dumps(offers))
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO emails (run_id, email_id, venue, title, body) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, email_id, venue, title, body) for email_id, (venue, title, body, _) in enumerate(emails)]
+            )
+            self.connection.executemany(
+                "INSERT INTO chunks (run_id, email_id, chunk, recipients) VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, email_id, number, json.dumps(recipients))
+                    for email_id, (_, _, _, chunks) in enumerate(emails)
+                    for number, recipients in enumerate(chunks)
+                ]
+            )
+        return run_id
+
+    def pending_chunks(self, run_id):
+        """Chunks of a run that still have to be sent, in the order they were planned"""
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT chunks.email_id, chunks.chunk, emails.venue, emails.title, emails.body, chunks.recipients
+                FROM chunks JOIN emails USING (run_id, email_id)
+                WHERE chunks.run_id = ? AND chunks.status = 'pending'
+                ORDER BY chunks.email_id, chunks.chunk
+                """,
+                (run_id,)
+            ).fetchall()
+        return [Chunk(email_id, chunk, venue, title, body, json.loads(recipients)) for email_id, chunk, venue, title, body, recipients in rows]
+
+    def mark_sent(self, run_id, chunk):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE chunks SET status = 'sent', sent_at = ? WHERE run_id = ? AND email_id = ? AND chunk = ?",
+                (self.now(), run_id, chunk.email_id, chunk.chunk)
+            )
+
+    def mark_failed(self, run_id, chunk, error):
+        """Give up on a chunk the mail server rejected permanently, so resuming does not retry it"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                "UPDATE chunks SET status = 'failed', error = ? WHERE run_id = ? AND email_id = ? AND chunk = ?",
+                (str(error), run_id, chunk.email_id, chunk.chunk)
+            )
+
+    def finish(self, run_id):
+        """Mark a run finished, and forget finished runs older than KEEP"""
+        cutoff = (datetime.now(timezone.utc) - KEEP).isoformat()
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (self.now(), run_id))
+            old_runs = "SELECT run_id FROM runs WHERE job = ? AND finished_at < ?"
+            self.connection.execute(f"DELETE FROM chunks WHERE run_id IN ({old_runs})", (self.job, cutoff))
+            self.connection.execute(f"DELETE FROM emails WHERE run_id IN ({old_runs})", (self.job, cutoff))
+            self.connection.execute("DELETE FROM runs WHERE job = ? AND finished_at < ?", (self.job, cutoff))
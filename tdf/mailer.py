@@ -0,0 +1,95 @@
+import os
+import smtplib
+import time
+
+from common import instrument
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 465))
+# set SMTP_SSL=false to talk plain SMTP, e.g. to a local aiosmtpd stand-in
+SMTP_SSL = os.environ.get("SMTP_SSL", "true").lower() != "false"
+
+# Recipients per message the server accepts, counting the To address as well as the blind copies
+# (Gmail accepts at most 100)
+MAX_RECIPIENTS = int(os.environ.get("SMTP_MAX_RECIPIENTS", 100))
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 2
+
+def chunk_recipients(recipients):
+    """Split the addresses to blind copy into chunks that fit in one message next to the To address"""
+    chunk_size = MAX_RECIPIENTS - 1
+    return [recipients[i:i + chunk_size] for i in range(0, len(recipients), chunk_size)] or [[]]
+
+def is_permanent(error):
+    """True for a failure the mail server will answer the same way however often the message is retried"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+class Mailer:
+    """One authenticated SMTP connection reused for every message of a run"""
+
+    def __init__(self, username, password, host=SMTP_HOST, port=SMTP_PORT, use_ssl=SMTP_SSL):
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self):
+        self.server = smtplib.SMTP_SSL(self.host, self.port) if self.use_ssl else smtplib.SMTP(self.host, self.port)
+        if self.password:
+            self.server.login(self.username, self.password)
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except smtplib.SMTPException:
+            pass
+        finally:
+            self.server = None
+
+    def send(self, msg, recipients):
+        """
+        Send a message to its To address, blind copying the recipients in chunks
+
+        Args:
+            msg (EmailMessage): Message to send (without a Bcc header)
+            recipients (list): Addresses to blind copy
+        """
+        for chunk in chunk_recipients(recipients):
+            self.send_chunk(msg, chunk)
+
+    def send_chunk(self, msg, chunk):
+        """Send a message to its To address, blind copying one chunk of chunk_recipients"""
+        self.send_with_retry(msg, [msg['To']] + chunk)
+
+    def send_with_retry(self, msg, to_addrs):
+        """Send one message, reconnecting and backing off on transient failures"""
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                if self.server is None:
+                    self.connect()
+                with instrument.span("smtp_send"):
+                    self.server.send_message(msg, to_addrs=to_addrs)
+                instrument.count("smtp_recipients", len(to_addrs))
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPResponseException, OSError) as e:
+                # 5xx responses are permanent, anything else is worth retrying on a fresh connection
+                if is_permanent(e):
+                    raise
+                self.close()
+                if attempt == MAX_ATTEMPTS - 1:
+                    raise
+                print(f"Transient SMTP failure ({e}), retrying in {BACKOFF_SECONDS * 2 ** attempt}s.")
+                instrument.count("smtp_retries")
+                time.sleep(BACKOFF_SECONDS * 2 ** attempt)
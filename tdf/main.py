@@ -1,86 +1,378 @@
-from supabase import create_client
-import requests
-import re
-from datetime import datetime
+from datetime import datetime, timedelta
 from pprint import pprint
 import pytz
-import smtplib
 from email.message import EmailMessage
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import os, sys
 
 
 # Add parent directory to path to import keys
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
-from keys.keys import SUPABASE_KEY, SUPABASE_URL, EMAIL, EMAIL_PASSWORD
+from common import fetch, instrument, supabase_client
+from common.supabase_client import execute
+from common.titles import canonical_key
 
-URLS = {
-    "broadway": "https://www.tdf.org/on-stage/show-finder/?page=1&pageSize=100&tdfMembership=true&venueId=1",
-    "off_broadway": "https://www.tdf.org/on-stage/show-finder/?page=1&pageSize=100&tdfMembership=true&venueId=2",
-    "off_off_broadway": "https://www.tdf.org/on-stage/show-finder/?page=1&pageSize=100&tdfMembership=true&venueId=3"
-}
+import crawler
+import snapshots
+import templates
+from mailer import Mailer, chunk_recipients, is_permanent
+from audience import AudienceIndex
+from journal import RunJournal
+
+VENUES = crawler.VENUE_IDS.keys()
+
+# alert chunks are sent by this many workers, each over its own SMTP connection
+SEND_WORKERS = int(os.environ.get("TDF_SEND_WORKERS", 1))
 
-VENUES = URLS.keys()
+# import keys/keys.py on first use, so importing this module needs no credentials
+def get_keys():
+    from keys import keys
+    return keys
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# the process-wide Supabase client, created on first use and shared with the TKTS pipeline
+def get_supabase():
+    return supabase_client.get_client()
 
 # use requests to find current TDF offers
 def get_current_tdf_offers():
-    
-    current_tdf_offers = {}
+    current_tdf_offers, _ = poll_current_tdf_offers()
+    return current_tdf_offers
 
-    for venue in VENUES:
+# crawl every show-finder page of every venue; pages answered with 304 reuse the cards committed by the last run
+# returns the current offers and the crawled pages to commit once the offers have been processed
+@instrument.timed()
+def poll_current_tdf_offers():
 
-        response = requests.get(URLS[venue])
-        html_content = response.text.replace('&#x27;', "'").replace('&amp;', "&")
+    current_tdf_offers = {venue: [] for venue in VENUES}
+    crawled_pages = []
+    titles_by_page = {}
 
-        # Use regex to find all alt attributes in img tags with class "to-be-scaled img-el"
-        show_titles = re.findall(r'<img[^>]*class="to-be-scaled img-el"[^>]*alt="([^"]+)"', html_content)
-        
-        current_tdf_offers[venue] = show_titles
+    # pages arrive out of order, so put their titles back in page order
+    for page in crawler.crawl(VENUES):
+        crawled_pages.append(page)
+        titles_by_page[(page.venue, page.number)] = [card["title"] for card in page.cards]
 
-    return current_tdf_offers
+    for (venue, _), titles in sorted(titles_by_page.items()):
+        current_tdf_offers[venue] += titles
+
+    # a show can move between pages while we crawl, so keep the first occurrence only
+    for venue in VENUES:
+        current_tdf_offers[venue] = list(dict.fromkeys(current_tdf_offers[venue]))
+
+    return current_tdf_offers, crawled_pages
+
+# number of pages crawled per venue
+def count_pages(crawled_pages):
+    pages = {}
+    for page in crawled_pages:
+        pages[page.venue] = pages.get(page.venue, 0) + 1
+    return pages
+
+# true if no crawled page changed since the last committed run, and the same pages were crawled
+# (the first page of each venue keeps how many pages its venue had, so a page that is no longer
+# crawled counts as a change)
+def tdf_pages_unchanged(crawled_pages):
+    pages = count_pages(crawled_pages)
+    if any(page.number == 1 and page.result.previous.get("pages") != pages[page.venue] for page in crawled_pages):
+        return False
+    return all(page.result.is_unchanged(page.digest) for page in crawled_pages)
+
+def commit_tdf_fetches(crawled_pages):
+    pages = count_pages(crawled_pages)
+    for page in crawled_pages:
+        extra = {"pages": pages[page.venue]} if page.number == 1 else {}
+        fetch.commit(page.result, page.digest, cards=page.cards, total=page.total, **extra)
+
+# number of change rows stored after the latest checkpoint, as of the last read or write of "TDF Show Changes"
+# (None when unknown, in which case the next stored row is a checkpoint)
+changes_since_checkpoint = None
+
+# store the offers as the changes since last_tdf_offers (the offers last stored), or as a checkpoint every so often
+def store_current_tdf_offers(current_tdf_offers = None, last_tdf_offers = None):
+    global changes_since_checkpoint
 
-def store_current_tdf_offers(current_tdf_offers = None):
     if current_tdf_offers is None:
         current_tdf_offers = get_current_tdf_offers()
-        
+    if last_tdf_offers is None:
+        last_tdf_offers = get_last_tdf_offers()
+    if last_tdf_offers is None:
+        pprint("Not storing TDF offers without the offers stored before them.")
+        return False
+
+    checkpoint = changes_since_checkpoint is None or changes_since_checkpoint + 1 >= snapshots.CHECKPOINT_EVERY
+
     try:
-        supabase.table("TDF Shows").insert({
-            "broadway": current_tdf_offers.get("broadway", []),
-            "off_broadway": current_tdf_offers.get("off_broadway", []),
-            "off_off_broadway": current_tdf_offers.get("off_off_broadway", [])
-        }).execute()
+        stored = execute(get_supabase().table("TDF Show Changes").insert(
+            snapshots.to_row(last_tdf_offers, current_tdf_offers, VENUES, checkpoint)
+        ))
     except Exception as e:
         pprint(f"Error storing current TDF offers: {e}")
+        changes_since_checkpoint = None
+        return False
 
-def get_last_tdf_offers():
+    changes_since_checkpoint = 0 if checkpoint else changes_since_checkpoint + 1
+    return store_show_intervals(current_tdf_offers, stored.data[0]["created_at"])
+
+# update the show intervals for offers already stored, reporting a failure instead of raising it
+def store_show_intervals(current_tdf_offers, seen_at):
     try:
-        last_tdf_offers = (
-            supabase.table("TDF Shows")
-            .select("broadway, off_broadway, off_off_broadway")
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
+        update_show_intervals(current_tdf_offers, seen_at)
+        return True
+    except Exception:
+        return False
+
+# read the latest full snapshot at or before a given time from the legacy "TDF Shows" table, None if there is none
+def read_legacy_tdf_offers(at = None):
+
+    query = get_supabase().table("TDF Shows").select("created_at, broadway, off_broadway, off_off_broadway")
+    if at:
+        query = query.lte("created_at", at)
+    legacy = execute(query.order("created_at", desc=True).limit(1)).data
+    if not legacy:
+        return None
+    return {venue: legacy[0].get(venue) or [] for venue in VENUES}
+
+# read the offers stored at a given time (ISO timestamp, default now) from "TDF Show Changes"
+# returns the offers and how many change rows were applied on top of their checkpoint (None when read from "TDF Shows")
+# before the history is migrated there is no checkpoint yet, so the offers come from the legacy "TDF Shows" table;
+# with neither, the offers are unknown (None), never empty, so that every listed show is not announced as new
+def read_tdf_offers(at = None):
+
+    query = get_supabase().table("TDF Show Changes").select("*").eq("is_checkpoint", True)
+    if at:
+        query = query.lte("created_at", at)
+    checkpoints = execute(query.order("created_at", desc=True).limit(1)).data
+    if not checkpoints:
+        return read_legacy_tdf_offers(at), None
+
+    query = (
+        get_supabase().table("TDF Show Changes")
+        .select("*")
+        .eq("is_checkpoint", False)
+        .gt("created_at", checkpoints[0]["created_at"])
+    )
+    if at:
+        query = query.lte("created_at", at)
+    changes = execute(query.order("created_at")).data
+
+    return snapshots.replay(checkpoints + changes, VENUES), len(changes)
+
+# yield (created_at, offers) for every row of "TDF Show Changes", oldest first
+def iter_tdf_offers(page_size = 1000):
+
+    offers = snapshots.empty(VENUES)
+    start = 0
+
+    while True:
+        rows = execute(
+            get_supabase().table("TDF Show Changes")
+            .select("*")
+            .order("created_at")
+            .range(start, start + page_size - 1)
+        ).data
+
+        for row in rows:
+            offers = snapshots.apply(offers, row, VENUES)
+            yield row["created_at"], offers
+
+        if len(rows) < page_size:
+            break
+        start += page_size
+
+# yield (created_at, offers) for every snapshot of the legacy "TDF Shows" table older than before (all if None), oldest first
+def iter_legacy_tdf_offers(before = None, page_size = 1000):
+
+    start = 0
+    while True:
+        query = (
+            get_supabase().table("TDF Shows")
+            .select("created_at, broadway, off_broadway, off_off_broadway")
+            .order("created_at")
+            .range(start, start + page_size - 1)
         )
-        return last_tdf_offers.data[0]
+        if before:
+            query = query.lt("created_at", before)
+        full_snapshots = execute(query).data
+
+        for snapshot in full_snapshots:
+            yield snapshot["created_at"], {venue: snapshot.get(venue) or [] for venue in VENUES}
+
+        if len(full_snapshots) < page_size:
+            break
+        start += page_size
+
+# the created_at and is_checkpoint of the oldest row of "TDF Show Changes", None if the chain is empty
+def get_first_tdf_change():
+    first = execute(get_supabase().table("TDF Show Changes").select("created_at, is_checkpoint").order("created_at").limit(1)).data
+    return first[0] if first else None
+
+# yield (created_at, offers) for the whole stored history, oldest first: the "TDF Shows" snapshots older than the
+# change chain (all of them before --migrate-snapshots, none after), then the chain
+def iter_offer_history(page_size = 1000):
+
+    first = get_first_tdf_change()
+    yield from iter_legacy_tdf_offers(first["created_at"] if first else None, page_size)
+    if first:
+        yield from iter_tdf_offers(page_size)
+
+# one-off conversion of the full-array "TDF Shows" history into "TDF Show Changes"
+# "TDF Shows" is left untouched, and can be dropped once the converted history has been checked
+# runs before the migration start the chain with a checkpoint (read from "TDF Shows"), so only the snapshots
+# older than the first stored row are converted; the chain stays valid and running it again converts nothing
+def migrate_tdf_snapshots(page_size = 1000):
+
+    first = get_first_tdf_change()
+    if first and not first["is_checkpoint"]:
+        pprint("TDF Show Changes does not start with a checkpoint, not migrating.")
+        return
+
+    rows = []
+    offers = None
+    since_checkpoint = 0
+    converted = 0
+
+    for created_at, current in iter_legacy_tdf_offers(first["created_at"] if first else None, page_size):
+        converted += 1
+        checkpoint = offers is None or since_checkpoint + 1 >= snapshots.CHECKPOINT_EVERY
+        row = snapshots.to_row(offers or {}, current, VENUES, checkpoint)
+
+        # snapshots identical to the one before them add nothing to the history
+        if checkpoint or row["added"] or row["removed"]:
+            rows.append({**row, "created_at": created_at})
+            since_checkpoint = 0 if checkpoint else since_checkpoint + 1
+        offers = current
+
+    for batch_start in range(0, len(rows), page_size):
+        execute(get_supabase().table("TDF Show Changes").insert(rows[batch_start:batch_start + page_size]))
+
+    pprint(f"Migrated {converted} TDF snapshots into {len(rows)} rows ({sum(row['is_checkpoint'] for row in rows)} checkpoints).")
+
+# "TDF Show Intervals" holds one row per continuous stretch a show was listed for a venue:
+# show_name, show_key (canonical key of the name, see common.titles), venue, first_seen, last_seen
+# and left_at (null while the show is still listed); shows are matched by show_key, so a stretch
+# continues when the show finder changes how it writes a title
+
+# a show listed for a venue, keyed by canonical title: (venue, show_key) -> title as listed
+def get_listed_shows(offers):
+    listed = {}
+    for venue in VENUES:
+        for title in offers.get(venue) or []:
+            listed.setdefault((venue, canonical_key(title)), title)
+    return listed
+
+# keep it in step with a newly stored snapshot, taken at seen_at
+# failures are raised; the run that stored the snapshot is left unfinished and the update is retried when it resumes
+def update_show_intervals(current_tdf_offers, seen_at):
+    try:
+        open_intervals = execute(
+            get_supabase().table("TDF Show Intervals")
+            .select("id, show_name, show_key, venue")
+            .is_("left_at", "null")
+        ).data
+
+        open_by_show = {(interval["venue"], canonical_key(interval["show_name"])): interval["id"] for interval in open_intervals}
+        current_shows = get_listed_shows(current_tdf_offers)
+
+        # intervals written before show keys existed get theirs once, so get_show_time_infos finds them by key
+        for interval in open_intervals:
+            if interval["show_key"] is None:
+                execute(get_supabase().table("TDF Show Intervals").update({"show_key": canonical_key(interval["show_name"])}).eq("id", interval["id"]))
+
+        still_listed = [open_by_show[show] for show in current_shows if show in open_by_show]
+        left = [interval_id for show, interval_id in open_by_show.items() if show not in current_shows]
+        added = [
+            {"show_name": title, "show_key": show_key, "venue": venue, "first_seen": seen_at, "last_seen": seen_at}
+            for (venue, show_key), title in current_shows.items() if (venue, show_key) not in open_by_show
+        ]
+
+        if still_listed:
+            execute(get_supabase().table("TDF Show Intervals").update({"last_seen": seen_at}).in_("id", still_listed))
+        if left:
+            execute(get_supabase().table("TDF Show Intervals").update({"left_at": seen_at}).in_("id", left))
+        if added:
+            execute(get_supabase().table("TDF Show Intervals").insert(added))
+
+    except Exception as e:
+        pprint(f"Error updating TDF show intervals: {e}")
+        raise
+
+# one-off backfill of "TDF Show Intervals" from the whole stored history (see iter_offer_history), so it can run
+# before or after --migrate-snapshots; the intervals are worked out before the index is replaced, and an empty
+# history leaves the index alone
+def rebuild_show_intervals(page_size = 1000):
+
+    intervals = []
+    open_intervals = {}
+    history_rows = 0
+
+    for seen_at, offers in iter_offer_history(page_size):
+        history_rows += 1
+        current_shows = get_listed_shows(offers)
+
+        for show in list(open_intervals):
+            if show not in current_shows:
+                open_intervals.pop(show)["left_at"] = seen_at
+
+        for (venue, show_key), title in current_shows.items():
+            if (venue, show_key) in open_intervals:
+                open_intervals[(venue, show_key)]["last_seen"] = seen_at
+            else:
+                interval = {"show_name": title, "show_key": show_key, "venue": venue, "first_seen": seen_at, "last_seen": seen_at, "left_at": None}
+                open_intervals[(venue, show_key)] = interval
+                intervals.append(interval)
+
+    if not history_rows:
+        pprint("No stored TDF offers in TDF Show Changes or TDF Shows, leaving TDF Show Intervals as it is.")
+        return
+
+    execute(get_supabase().table("TDF Show Intervals").delete().neq("venue", ""))
+    for batch_start in range(0, len(intervals), page_size):
+        execute(get_supabase().table("TDF Show Intervals").insert(intervals[batch_start:batch_start + page_size]))
+
+    pprint(f"Rebuilt {len(intervals)} TDF show intervals from {history_rows} stored snapshots and changes.")
+
+# store the current offers as the first checkpoint of a new deployment, without alerting
+def seed_tdf_offers():
+    global changes_since_checkpoint
+
+    if get_last_tdf_offers() is not None:
+        pprint("TDF offers are already stored, not seeding.")
+        return
+
+    changes_since_checkpoint = None
+    current_tdf_offers, crawled_pages = poll_current_tdf_offers()
+    if store_current_tdf_offers(current_tdf_offers, snapshots.empty(VENUES)):
+        commit_tdf_fetches(crawled_pages)
+        pprint(f"Seeded TDF offers with {sum(len(titles) for titles in current_tdf_offers.values())} shows.")
+
+# the offers last stored, None if they cannot be read or nothing was ever stored
+# callers must not alert or store without them, or every listed show would count as new
+def get_last_tdf_offers():
+    global changes_since_checkpoint
+    try:
+        last_tdf_offers, changes_since_checkpoint = read_tdf_offers()
+        if last_tdf_offers is None:
+            pprint("No stored TDF offers in TDF Show Changes or TDF Shows; run with --migrate-snapshots, or --seed-offers on a new deployment.")
+        return last_tdf_offers
     
     except Exception as e:
         pprint(f"Error fetching last TDF offers: {e}")
-        return {"broadway": [], "off_broadway": [], "off_off_broadway": []}
+        changes_since_checkpoint = None
+        return None
 
 
 # get TDF emails according to filter
 # args of form: broadway ensures that only users interested in Broadway shows are returned
 def get_filtered_tdf_emails(*args, frequency = None):
     try:
-        query = supabase.table("TDF User Profiles").select("email")
+        query = get_supabase().table("TDF User Profiles").select("email")
         for arg in args:
             query = query.eq(arg, True)
         if frequency:
             query = query.eq("frequency", frequency)
-        users = query.execute()
+        users = execute(query)
         return [i['email'] for i in users.data if i['email']]
 
     except Exception as e:
@@ -97,58 +389,72 @@ def get_new_tdf_offers(current_tdf_offers = None, last_tdf_offers = None):
 
     if current_tdf_offers is None: current_tdf_offers = get_current_tdf_offers()
     if last_tdf_offers is None: last_tdf_offers = get_last_tdf_offers()
+    if last_tdf_offers is None: return {}
 
     new_offers = {}
     
     for venue in VENUES:
-        # pprint.pprint({"venue": venue, "last_tdf_offers": last_tdf_offers})
-        new_titles = set(current_tdf_offers.get(venue, [])) - set(last_tdf_offers.get(venue, []))
+        # a title only counts as new if no listed title has the same canonical key, so a respelling is not announced again
+        last_keys = {canonical_key(title) for title in last_tdf_offers.get(venue, [])}
+        new_titles = {title for title in current_tdf_offers.get(venue, []) if canonical_key(title) not in last_keys}
         if new_titles:
             new_offers[venue] = list(new_titles)
 
     return new_offers
 
-# given the name of a show, return the last day it was available and the duration it was last available
+# given the names of shows, return the most recent finished interval each was listed on TDF, per venue
+# intervals are matched by canonical key, so they are found however the show was written at the time;
+# intervals stored without a key (before keys existed) are matched by the show name as written
+# returns a dict of (venue, show_name) -> interval with first_seen, last_seen and left_at
+def get_show_time_infos(show_names):
+
+    if not show_names:
+        return {}
+
+    names_by_key = {}
+    for show_name in show_names:
+        names_by_key.setdefault(canonical_key(show_name), []).append(show_name)
+
+    def finished_intervals(column, values):
+        query = get_supabase().table("TDF Show Intervals").select("show_name, show_key, venue, first_seen, last_seen, left_at")
+        if column == "show_name":
+            query = query.is_("show_key", "null")
+        return execute(query.in_(column, values).not_.is_("left_at", "null")).data
+
+    try:
+        intervals = finished_intervals("show_key", list(names_by_key)) + finished_intervals("show_name", list(set(show_names)))
+    except Exception as e:
+        pprint(f"Error fetching TDF show intervals: {e}")
+        return {}
+
+    show_time_infos = {}
+    for interval in sorted(intervals, key=lambda interval: interval["left_at"], reverse=True):
+        show_key = interval["show_key"] or canonical_key(interval["show_name"])
+        for show_name in names_by_key.get(show_key, []):
+            show_time_infos.setdefault((interval["venue"], show_name), interval)
+    return show_time_infos
+
+# given the name of a show, return the last day it was available and when it left TDF
 def get_show_time_info(show_name, venue):
     
     if venue not in VENUES:
         return None, None
 
-    # Get the latest entry where the show is present
-    last_entry_show_is_in_table = (
-        supabase.table("TDF Shows")
-        .select("created_at")
-        .contains(venue, [show_name])
-        .order("created_at", desc=True)
-        .limit(1)
-        .execute()
-    ).data
-
-    if last_entry_show_is_in_table and len(last_entry_show_is_in_table) > 0: 
-        last_entry_show_is_in_table = last_entry_show_is_in_table[0]["created_at"]
-
-    # Get the entry immediately after (i.e., the next most recent entry)
-    next_entry = (
-        supabase.table("TDF Shows")
-        .select("created_at")
-        .not_.contains(venue, [show_name])
-        .order("created_at")
-        .gt("created_at", last_entry_show_is_in_table if len(last_entry_show_is_in_table) > 0 else None)
-        .limit(1)
-        .execute()
-    ).data if last_entry_show_is_in_table else None
-
-    if next_entry and len(next_entry) > 0:
-        next_entry = next_entry[0]["created_at"]
-
-    return last_entry_show_is_in_table, next_entry
-
-# last_date in format 2025-08-20T22:09:02.681815+00:00
-def get_email_body(show_title, venue):
-
-    last_date, next_date = get_show_time_info(show_title, venue)
+    interval = get_show_time_infos([show_name]).get((venue, show_name))
+    if not interval:
+        return None, None
+
+    return interval["last_seen"], interval["left_at"]
+
+# dates in format 2025-08-20T22:09:02.681815+00:00
+# show_time_infos is the result of get_show_time_infos
+# returns a sentence describing when the show was last on TDF
+def get_show_history(show_title, venue, show_time_infos):
+
+    interval = show_time_infos.get((venue, show_title)) or {}
+    first_date, last_date, next_date = interval.get("first_seen"), interval.get("last_seen"), interval.get("left_at")
     
-    subtitle = f"<p class=\"subtitle\">This is the first time {show_title} is available on TDF.</p>"
+    subtitle = f"This is the first time {show_title} is available on TDF."
 
     if last_date:
         # Parse ISO format with timezone
@@ -158,11 +464,12 @@ def get_email_body(show_title, venue):
         dt_eastern = dt.astimezone(eastern)
         formatted_date = dt_eastern.strftime("%B %-d, %Y")
 
-        subtitle = f"<p class=\"subtitle\">{show_title} was last available on TDF on {formatted_date}.</p>"
+        subtitle = f"{show_title} was last available on TDF on {formatted_date}."
 
         if next_date:
 
-            difference_time = datetime.fromisoformat(next_date) - datetime.fromisoformat(last_date)
+            difference_time = datetime.fromisoformat(next_date) - datetime.fromisoformat(first_date)
+            formatted_next_date = datetime.fromisoformat(next_date).astimezone(eastern).strftime("%B %-d, %Y")
             if difference_time.days >= 7:
                 weeks = difference_time.days // 7
                 formatted_difference = f"{weeks} week{'s' if weeks != 1 else ''}"
@@ -177,53 +484,373 @@ def get_email_body(show_title, venue):
             else:
                 formatted_difference = f"{difference_time.seconds} second{'s' if difference_time.seconds != 1 else ''}"
 
-            subtitle = f"<p class=\"subtitle\">The last time {show_title} was on TDF, it stayed on TDF for {formatted_difference}. It ultimately left TDF on {next_date}.</p>"
+            subtitle = f"The last time {show_title} was on TDF, it stayed on TDF for {formatted_difference}. It ultimately left TDF on {formatted_next_date}."
+
+    return subtitle
+
+# show_time_infos is the result of get_show_time_infos, looked up for this show alone if not given
+def get_email_body(show_title, venue, show_time_infos = None):
+
+    if show_time_infos is None: show_time_infos = get_show_time_infos([show_title])
+    subtitle = f"<p class=\"subtitle\">{get_show_history(show_title, venue, show_time_infos)}</p>"
 
-    with open('email.html', 'r') as file:
-        TEMPLATE = file.read()
+    return templates.load_template("email.html").render(ShowTitle=show_title, Subtitle=subtitle)
 
-    return TEMPLATE.replace("{{ShowTitle}}", show_title).replace("{{Subtitle}}", subtitle)
+# rendered bodies keyed by (show title, venue, show history), so a body is only re-rendered when the history changes
+email_body_cache = {}
 
+# render the email body of every new show in one pass, resolving all of their histories in one lookup
+# returns a dict of (venue, show_title) -> body
+@instrument.timed()
+def render_email_bodies(new_offers, show_time_infos = None):
 
-def send_email(show_title, venue, recipients):
+    if show_time_infos is None:
+        show_time_infos = get_show_time_infos({title for titles in new_offers.values() for title in titles})
+
+    bodies = {}
+    for venue, titles in new_offers.items():
+        for title in titles:
+            interval = show_time_infos.get((venue, title)) or {}
+            key = (title, venue, interval.get("first_seen"), interval.get("last_seen"), interval.get("left_at"))
+            if key not in email_body_cache:
+                email_body_cache[key] = get_email_body(title, venue, show_time_infos)
+            bodies[(venue, title)] = email_body_cache[key]
+
+    return bodies
+
+
+# the alert for a show, addressed to ourselves so subscribers can be blind copied
+def build_email(show_title, body):
 
     msg = EmailMessage()
-    msg.set_content(get_email_body(show_title, venue), subtype='html')
+    msg.set_content(body, subtype='html')
 
-    msg['From'] = EMAIL
-    msg['To'] = EMAIL
+    msg['From'] = get_keys().EMAIL
+    msg['To'] = get_keys().EMAIL
     msg['Subject'] = f"{show_title} is Now Available on TDF"
-    msg['Bcc'] = recipients
+    return msg
+
+# send through the given mailer to reuse its connection, or open a one-off connection
+@instrument.timed()
+def send_email(show_title, venue, recipients, body = None, mailer = None):
+
+    if body is None: body = get_email_body(show_title, venue)
+
+    msg = build_email(show_title, body)
+
+    if mailer is None:
+        with Mailer(get_keys().EMAIL, get_keys().EMAIL_PASSWORD) as mailer:
+            mailer.send(msg, recipients)
+    else:
+        mailer.send(msg, recipients)
 
-    with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-        server.login(EMAIL, EMAIL_PASSWORD)
-        server.send_message(msg)
 
+# send every chunk of a run's alerts that is still pending in the journal, marking each one as soon as it is accepted
+# chunks are dealt round-robin to workers (SEND_WORKERS by default) with one SMTP connection each
+def send_pending_alerts(run_journal, run_id, workers = None):
+    send_pending_chunks(run_journal, run_id, build_email, ("tdf_alerts_sent", "tdf_alert_chunks_failed", "venue"), workers or SEND_WORKERS)
+
+# send the pending chunks of any journaled run; build_message(title, body) makes the email of a chunk
+# metrics is (sent counter, failed chunks counter, label), the label taking the chunk's venue field
+def send_pending_chunks(run_journal, run_id, build_message, metrics, workers = 1):
+
+    sent_metric, failed_metric, label = metrics
+    pending = run_journal.pending_chunks(run_id)
+    if not pending:
+        return
+
+    def send_share(chunks):
+        messages = {}
+        with Mailer(get_keys().EMAIL, get_keys().EMAIL_PASSWORD) as mailer:
+            for chunk in chunks:
+                if chunk.email_id not in messages:
+                    messages[chunk.email_id] = build_message(chunk.title, chunk.body)
+                try:
+                    with instrument.span("send_email"):
+                        mailer.send_chunk(messages[chunk.email_id], chunk.recipients)
+                except Exception as e:
+                    if not is_permanent(e):
+                        raise
+                    pprint(f"Mail server rejected {chunk.title} for {len(chunk.recipients)} users, not retrying: {e}")
+                    run_journal.mark_failed(run_id, chunk, e)
+                    instrument.count(failed_metric, **{label: chunk.venue})
+                    continue
+
+                run_journal.mark_sent(run_id, chunk)
+                if chunk.chunk == 0:
+                    instrument.count(sent_metric, **{label: chunk.venue})
+
+    workers = max(1, min(workers, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(send_share, pending[worker::workers]) for worker in range(workers)]
+    # surface the first failure once every worker has stopped, leaving its unsent chunks pending
+    for future in futures:
+        future.result()
+
+# finish a run that stopped before storing its offers: send the alerts it had not sent yet, then store the offers
+# returns True once the run is finished
+def resume_run(run_journal, run):
+
+    pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Resuming the alert run started at {run.started_at}.")
+    send_pending_alerts(run_journal, run.run_id)
+
+    # the offers may be stored already, by a run that stopped before updating the show intervals
+    last_tdf_offers = get_last_tdf_offers()
+    if last_tdf_offers is not None and not is_difference_in_offers(run.offers, last_tdf_offers):
+        stored = store_show_intervals(run.offers, datetime.now(pytz.utc).isoformat())
+    else:
+        stored = store_current_tdf_offers(run.offers, last_tdf_offers)
+    if not stored:
+        return False
+    run_journal.finish(run.run_id)
+    return True
 
 # update tdf offers and send emails to users with immediate frequency
+# runs are journaled (see journal.py), so a run that stopped midway is resumed instead of sending every alert again
+@instrument.timed("tdf_alerts")
 def main():
-    current_tdf_offers = get_current_tdf_offers()
+    with RunJournal("tdf_alerts") as run_journal:
+        if not run_journal.acquire():
+            pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Another TDF alert run is in progress.")
+            return
+
+        run = run_journal.unfinished_run()
+        if run and not resume_run(run_journal, run):
+            return
+
+        run_alerts(run_journal)
+
+def run_alerts(run_journal):
+    current_tdf_offers, crawled_pages = poll_current_tdf_offers()
+
+    if tdf_pages_unchanged(crawled_pages):
+        pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: TDF pages unchanged since last run.")
+        return
+
     last_tdf_offers = get_last_tdf_offers()
+    if last_tdf_offers is None:
+        pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Stored TDF offers unknown, not alerting.")
+        return
+
     new_offers = get_new_tdf_offers(current_tdf_offers, last_tdf_offers)
     
 
     if not is_difference_in_offers(current_tdf_offers, last_tdf_offers):
         pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: TDF offers are the same.")
+        commit_tdf_fetches(crawled_pages)
         return
 
     if not new_offers:
         pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: No new TDF offers found.")
-        store_current_tdf_offers(current_tdf_offers)
+        # journaled without alerts, so a failed show interval update is retried when the run resumes
+        run_id = run_journal.start_run(current_tdf_offers, [])
+        if store_current_tdf_offers(current_tdf_offers, last_tdf_offers):
+            run_journal.finish(run_id)
+            commit_tdf_fetches(crawled_pages)
         return
 
 
+    # render every new show's email once, resolving all of their histories in one lookup
+    email_bodies = render_email_bodies(new_offers)
+
+    # one query for every subscriber; without them, leave the offers unstored so the next run alerts them
+    audience = get_audience_index()
+    if audience is None:
+        return
+
+    emails = []
     for venue in VENUES:
-        bcc_list = get_filtered_tdf_emails(venue, "email_verified", frequency="immediate")
+        bcc_list = audience.select(venue, frequency="immediate")
         for new_title in new_offers.get(venue, []):
             pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: New {venue} show available: {new_title}. Sending emails to {len(bcc_list)} users.")
-            send_email(new_title, venue, bcc_list)
-            
+            emails.append((venue, new_title, email_bodies[(venue, new_title)], chunk_recipients(bcc_list)))
+
+    # journal everything this run is about to send before sending any of it
+    run_id = run_journal.start_run(current_tdf_offers, emails)
+    send_pending_alerts(run_journal, run_id)
+
     # update supabase with current offers
-    store_current_tdf_offers(current_tdf_offers)
+    if store_current_tdf_offers(current_tdf_offers, last_tdf_offers):
+        run_journal.finish(run_id)
+        commit_tdf_fetches(crawled_pages)
+
+# how often each digest frequency is sent, and how early a digest may go out to absorb cron jitter
+DIGEST_PERIODS = {
+    "hourly": timedelta(hours=1),
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1)
+}
+DIGEST_SLACK = timedelta(minutes=5)
+
+# digest slots are counted from a Monday midnight (UTC), so weekly digests cover Monday to Monday
+DIGEST_EPOCH = datetime(1970, 1, 5, tzinfo=pytz.utc)
+
+# the start of the slot of a period that contains the given time
+def get_digest_slot(at, period):
+    return DIGEST_EPOCH + ((at - DIGEST_EPOCH) // period) * period
+
+VENUE_NAMES = {
+    "broadway": "Broadway",
+    "off_broadway": "Off-Broadway",
+    "off_off_broadway": "Off-Off-Broadway"
+}
+
+# "TDF Digests" holds one row per frequency: frequency and last_sent_at
+def get_last_digest_times():
+    try:
+        digests = execute(get_supabase().table("TDF Digests").select("frequency, last_sent_at")).data
+        return {digest["frequency"]: datetime.fromisoformat(digest["last_sent_at"]) for digest in digests}
+    except Exception as e:
+        pprint(f"Error fetching last digest times: {e}")
+        return None
+
+# returns True once stored
+def set_last_digest_time(frequency, sent_at):
+    try:
+        execute(get_supabase().table("TDF Digests").upsert({"frequency": frequency, "last_sent_at": sent_at.isoformat()}, on_conflict="frequency"))
+        return True
+    except Exception as e:
+        pprint(f"Error storing last digest time for {frequency}: {e}")
+        return False
+
+# shows that started a listing since the given time and are still listed, as a list of intervals
+def get_offers_since(since):
+    try:
+        return execute(
+            get_supabase().table("TDF Show Intervals")
+            .select("show_name, venue, first_seen")
+            .gt("first_seen", since.isoformat())
+            .is_("left_at", "null")
+            .order("first_seen")
+        ).data
+    except Exception as e:
+        pprint(f"Error fetching new TDF offers since {since}: {e}")
+        return None
+
+# load every verified subscriber once per run; returns None if the profiles cannot be fetched,
+# so that a run does not mark its emails as sent to an audience it never saw
+def get_audience_index():
+    try:
+        profiles = execute(get_supabase().table("TDF User Profiles").select("*").eq("email_verified", True)).data
+        return AudienceIndex(profiles)
+    except Exception as e:
+        pprint(f"Error fetching users: {e}")
+        return None
+
+def get_digest_body(frequency, offers, show_time_infos):
+
+    shows = "".join(
+        f"<li><strong>{offer['show_name']}</strong> ({VENUE_NAMES[offer['venue']]})<br>"
+        f"<span class=\"subtitle\">{get_show_history(offer['show_name'], offer['venue'], show_time_infos)}</span></li>"
+        for offer in offers
+    )
+    heading = f"{len(offers)} new show{'s' if len(offers) != 1 else ''} on TDF"
+
+    return templates.load_template("digest.html").render(Heading=heading, Frequency=frequency, ShowList=shows)
+
+def get_digest_subject(frequency, offers):
+    return f"Your {frequency} TDF digest: {len(offers)} new show{'s' if len(offers) != 1 else ''}"
+
+# a digest, addressed to ourselves so subscribers can be blind copied
+def build_digest_email(subject, body):
+
+    msg = EmailMessage()
+    msg.set_content(body, subtype='html')
+
+    msg['From'] = get_keys().EMAIL
+    msg['To'] = get_keys().EMAIL
+    msg['Subject'] = subject
+    return msg
+
+# send the digests of a journaled run that are still pending, then store the time each frequency covers up to
+# returns True once the run is finished
+def finish_digest_run(run_journal, run_id, covered_until):
+
+    send_pending_chunks(run_journal, run_id, build_digest_email, ("tdf_digests_sent", "tdf_digest_chunks_failed", "frequency"))
+
+    for frequency, until in covered_until.items():
+        if not set_last_digest_time(frequency, datetime.fromisoformat(until)):
+            return False
+    run_journal.finish(run_id)
+    return True
+
+# send one combined email per cohort (frequency and followed venues) whose digest is due
+# runs are journaled like the alerts (see journal.py), so a run that stopped midway resends no cohort already mailed
+@instrument.timed("tdf_digests")
+def send_digests():
+    with RunJournal("tdf_digests") as run_journal:
+        if not run_journal.acquire():
+            pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Another TDF digest run is in progress.")
+            return
+
+        run = run_journal.unfinished_run()
+        if run:
+            pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Resuming the digest run started at {run.started_at}.")
+            if not finish_digest_run(run_journal, run.run_id, run.offers):
+                return
+
+        run_digests(run_journal)
+
+def run_digests(run_journal):
+
+    now = datetime.now(pytz.utc)
+    last_digest_times = get_last_digest_times()
+    if last_digest_times is None:
+        return
+
+    # a frequency is due once a new slot of its period has started (up to DIGEST_SLACK early) since the last one sent;
+    # the slot is stored rather than the time of the run, so a late run does not push back the following ones,
+    # and a frequency that has never been sent covers one period
+    due = {}
+    for frequency, period in DIGEST_PERIODS.items():
+        slot = get_digest_slot(now + DIGEST_SLACK, period)
+        last_sent_at = last_digest_times.get(frequency, slot - period)
+        if slot - last_sent_at > DIGEST_SLACK:
+            # a run a little early covers up to now, leaving the rest of the slot to the next digest
+            due[frequency] = (last_sent_at, min(slot, now))
+
+    if not due:
+        pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: No digests due.")
+        return
+
+    # one lookup covers the new offers and their histories for every due frequency
+    offers = get_offers_since(min(since for since, _ in due.values()))
+    if offers is None:
+        return
+    show_time_infos = get_show_time_infos({offer["show_name"] for offer in offers})
+
+    # without subscribers, leave last_sent_at alone so the next run sends these digests
+    audience = get_audience_index()
+    if audience is None:
+        return
 
-main()
\ No newline at end of file
+    emails = []
+    for frequency, (since, until) in due.items():
+        frequency_offers = [offer for offer in offers if since < datetime.fromisoformat(offer["first_seen"]) <= until]
+
+        # group subscribers of the frequency by the venues they follow
+        for venues, recipients in audience.cohorts(VENUES, frequency=frequency).items():
+            cohort_offers = [offer for offer in frequency_offers if offer["venue"] in venues]
+            if not cohort_offers:
+                continue
+            pprint(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}: Sending {frequency} digest of {len(cohort_offers)} shows to {len(recipients)} users following {', '.join(venues)}.")
+            body = get_digest_body(frequency, cohort_offers, show_time_infos)
+            emails.append((frequency, get_digest_subject(frequency, cohort_offers), body, chunk_recipients(recipients)))
+
+    # journal every cohort's digest before sending any of them
+    covered_until = {frequency: until.isoformat() for frequency, (_, until) in due.items()}
+    finish_digest_run(run_journal, run_journal.start_run(covered_until, emails), covered_until)
+
+if __name__ == "__main__":
+    if "--migrate-snapshots" in sys.argv:
+        migrate_tdf_snapshots()
+    elif "--seed-offers" in sys.argv:
+        seed_tdf_offers()
+    elif "--rebuild-intervals" in sys.argv:
+        rebuild_show_intervals()
+    elif "--digests" in sys.argv:
+        send_digests()
+        instrument.export("tdf_digests")
+    else:
+        main()
+        instrument.export("tdf_alerts")
\ No newline at end of file
@@ -0,0 +1,56 @@
+import os
+
+# "TDF Show Changes" stores the titles listed per venue as a chain of changes: id, created_at,
+# is_checkpoint, added and removed (json objects of venue -> list of titles). A checkpoint row holds
+# every listed title in added; any other row holds what changed since the row before it. The offers
+# at any time are the latest checkpoint at or before it with the changes after it applied in order.
+
+# A checkpoint is written after this many changes, bounding how many rows a read has to apply
+CHECKPOINT_EVERY = int(os.environ.get("TDF_CHECKPOINT_EVERY", 96))
+
+def empty(venues):
+    return {venue: [] for venue in venues}
+
+def diff(previous, current, venues):
+    """Return the titles added and removed per venue between two sets of offers, leaving out unchanged venues"""
+    added = {}
+    removed = {}
+    for venue in venues:
+        previous_titles = set(previous.get(venue) or [])
+        current_titles = set(current.get(venue) or [])
+
+        venue_added = [title for title in current.get(venue) or [] if title not in previous_titles]
+        venue_removed = [title for title in previous.get(venue) or [] if title not in current_titles]
+        if venue_added:
+            added[venue] = venue_added
+        if venue_removed:
+            removed[venue] = venue_removed
+    return added, removed
+
+def to_row(previous, current, venues, checkpoint=False):
+    """Return the row that takes the offers from previous to current (all of current for a checkpoint)"""
+    if checkpoint:
+        return {"is_checkpoint": True, "added": {venue: list(current.get(venue) or []) for venue in venues}, "removed": {}}
+
+    added, removed = diff(previous, current, venues)
+    return {"is_checkpoint": False, "added": added, "removed": removed}
+
+def apply(offers, row, venues):
+    """Return the offers after a row of the chain"""
+    if row["is_checkpoint"]:
+        return {venue: list((row["added"] or {}).get(venue) or []) for venue in venues}
+
+    result = {}
+    for venue in venues:
+        removed = set((row["removed"] or {}).get(venue) or [])
+        titles = [title for title in offers.get(venue, []) if title not in removed]
+        listed = set(titles)
+        result[venue] = titles + [title for title in (row["added"] or {}).get(venue) or [] if title not in listed]
+    return result
+
+def replay(rows, venues):
+    """Return the offers after a checkpoint row and the change rows that follow it, in order"""
+    offers = empty(venues)
+    for row in rows:
+        offers = apply(offers, row, venues)
+    return offers
@@ -0,0 +1,39 @@
+import functools
+import os
+import re
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Placeholders look like {{ShowTitle}}
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+class Template:
+    """An email template split once into literal text and placeholders"""
+
+    def __init__(self, source):
+        # re.split with a capture group alternates literal text and placeholder names
+        parts = PLACEHOLDER_PATTERN.split(source)
+        self.literals = parts[0::2]
+        self.placeholders = parts[1::2]
+
+    def render(self, **values):
+        """
+        Fill in the placeholders
+
+        Args:
+            **values: Value for each placeholder; placeholders without a value are left as is
+
+        Returns:
+            str: The rendered template
+        """
+        rendered = [self.literals[0]]
+        for placeholder, literal in zip(self.placeholders, self.literals[1:]):
+            rendered.append(str(values[placeholder]) if placeholder in values else "{{" + placeholder + "}}")
+            rendered.append(literal)
+        return "".join(rendered)
+
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+    """Read and compile a template from the tdf directory, once per process"""
+    with open(os.path.join(TEMPLATE_DIR, name), 'r') as file:
+        return Template(file.read())
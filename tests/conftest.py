@@ -0,0 +1,27 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Keep the fetch state, caches and journals of the tests away from the real ones
+os.environ.setdefault("TKTS_CACHE_DIR", tempfile.mkdtemp(prefix="tkts-tests-"))
+
+# Import the pipeline scripts the way they import their siblings
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("benchmarks", "tdf", "tkts", ""):
+    sys.path.insert(0, os.path.join(root_dir, directory))
+
+from replay import FixtureSession, RecordingMailer, FakeKeys, reset_state
+from common import fetch
+import main as tdf_main
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Run the TDF pipeline against the recorded pages, with a recording mailer and no fetch state"""
+    reset_state()
+    monkeypatch.setattr(fetch, "session", FixtureSession())
+    monkeypatch.setattr(tdf_main, "Mailer", RecordingMailer)
+    monkeypatch.setattr(tdf_main, "get_keys", lambda: FakeKeys)
+    monkeypatch.setattr(tdf_main, "changes_since_checkpoint", None)
+    RecordingMailer.sent = []
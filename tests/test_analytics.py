@@ -0,0 +1,74 @@
+import numpy as np
+
+from analytics import DiscountHistory, appearance_probabilities, median_by_group, most_discounted_shows, typical_prices
+
+def record(record_id, show_id, performance_date, discount_percent=50, low_price=59, high_price=99, is_matinee=False):
+    return {
+        "id": record_id, "show_id": show_id, "discount_percent": discount_percent, "low_price": low_price,
+        "high_price": high_price, "performance_date": performance_date, "is_matinee": is_matinee
+    }
+
+def history(*records):
+    return DiscountHistory.from_records(list(records))
+
+def test_median_by_group():
+    medians, sizes = median_by_group(np.array([0, 1, 0, 0, 1]), np.array([5, 2, 1, 3, 4]), 3)
+
+    assert medians[:2].tolist() == [3.0, 3.0]
+    assert np.isnan(medians[2])
+    assert sizes.tolist() == [3, 2, 0]
+
+def test_typical_prices():
+    # 2025-01-13 was a Monday, 2025-01-15 a Wednesday
+    prices = typical_prices(history(
+        record(1, 1, "2025-01-13", low_price="59.00", high_price="99"),
+        record(2, 2, "2025-01-13", low_price=79, high_price=129.0),
+        record(3, 3, "2025-01-13", low_price=None, high_price=None),
+        record(4, 1, "2025-01-15", low_price=49.5, high_price=None, is_matinee=True),
+        record(5, 1, "2025-01-15", low_price=None, high_price=89),
+    ))
+
+    assert prices == {
+        ("Monday", False): {"low_price": 69.0, "high_price": 114.0, "performances": 2},
+        ("Wednesday", True): {"low_price": 49.5, "high_price": None, "performances": 1},
+        ("Wednesday", False): {"low_price": None, "high_price": 89.0, "performances": 1},
+    }
+
+def test_string_discounts_are_read_as_numbers():
+    assert history(record(1, 1, "2025-01-13", discount_percent="40.0")).discount_percent.tolist() == [40]
+
+def test_appearance_probabilities():
+    # the Mondays before 2025-01-27 within 28 days: Dec 30 (nothing listed), Jan 6, 13 and 20
+    probabilities = appearance_probabilities(history(
+        record(1, 1, "2025-01-06"),
+        record(2, 1, "2025-01-13"),
+        record(3, 1, "2025-01-20"),
+        record(4, 1, "2025-01-20", is_matinee=True),
+        record(5, 2, "2025-01-13"),
+        record(6, 3, "2025-01-21"),
+        record(7, 3, "2025-01-27"),
+    ), day="2025-01-27")
+
+    assert probabilities == {1: 1.0, 2: 1 / 3}
+
+def test_most_discounted_shows():
+    shows = history(
+        record(1, 1, "2025-01-13", discount_percent=50),
+        record(2, 1, "2025-01-14", discount_percent=40),
+        record(3, 1, "2025-01-15", discount_percent=60),
+        record(4, 2, "2025-01-13", discount_percent=50),
+        record(5, 3, "2025-01-13", discount_percent=30),
+    )
+
+    assert most_discounted_shows(shows, percent=50) == [(1, 2, 3), (2, 1, 1)]
+    assert most_discounted_shows(shows, percent=50, limit=1) == [(1, 2, 3)]
+    assert most_discounted_shows(history(), percent=50) == []
+
+def test_merge_keeps_the_newer_record_of_an_id():
+    older = history(record(1, 1, "2025-01-13"), record(2, 1, "2025-01-14", discount_percent=30), record(3, 2, "2025-01-13"))
+    newer = history(record(2, 1, "2025-01-14", discount_percent=40), record(4, 3, "2025-01-15"))
+
+    merged = older.merge(newer)
+
+    assert merged.id.tolist() == [1, 2, 3, 4]
+    assert merged.discount_percent.tolist() == [50, 40, 50, 50]
@@ -0,0 +1,102 @@
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from replay import FixtureResponse, reset_state
+from common import fetch
+import crawler
+import main as tdf_main
+
+def show_finder_page(titles, total=None):
+    cards = "".join(
+        f'<a href="/on-stage/show-finder/show/{i}"><img class="to-be-scaled img-el" alt="{title}" /></a>'
+        for i, title in enumerate(titles)
+    )
+    count = "" if total is None else f'<p class="results-count">{total} results</p>'
+    return f"<html><body>{count}{cards}</body></html>"
+
+class ShowFinder:
+    """Serves show-finder pages for a listing per venue, with ETags"""
+
+    def __init__(self, listings, state_totals=True):
+        self.listings = listings
+        self.state_totals = state_totals
+        self.requested = []
+
+    def get(self, url, headers=None, timeout=None):
+        query = parse_qs(urlparse(url).query)
+        venue = {venue_id: venue for venue, venue_id in crawler.VENUE_IDS.items()}[int(query["venueId"][0])]
+        number, size = int(query["page"][0]), int(query["pageSize"][0])
+        self.requested.append((venue, number))
+
+        titles = self.listings.get(venue, [])
+        text = show_finder_page(titles[(number - 1) * size:number * size], len(titles) if self.state_totals else None)
+        etag = f'"{fetch.digest(text)[:16]}"'
+        if (headers or {}).get("If-None-Match") == etag:
+            return FixtureResponse(url, 304, headers={"ETag": etag})
+        return FixtureResponse(url, 200, text, {"ETag": etag})
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    reset_state()
+
+def listings(broadway_shows):
+    return {"broadway": [f"Show {i}" for i in range(broadway_shows)], "off_broadway": ["Off 1"], "off_off_broadway": ["Downtown 1"]}
+
+def crawl_and_commit(monkeypatch, session):
+    monkeypatch.setattr(fetch, "session", session)
+    current, pages = tdf_main.poll_current_tdf_offers()
+    unchanged = tdf_main.tdf_pages_unchanged(pages)
+    tdf_main.commit_tdf_fetches(pages)
+    return current, pages, unchanged
+
+def test_crawl_fetches_every_page_of_every_venue(monkeypatch):
+    session = ShowFinder(listings(250))
+    current, pages, _ = crawl_and_commit(monkeypatch, session)
+
+    assert current["broadway"] == [f"Show {i}" for i in range(250)]
+    assert all(page.result.text is None for page in pages)
+    assert sorted(session.requested) == sorted([("broadway", 1), ("broadway", 2), ("broadway", 3), ("off_broadway", 1), ("off_off_broadway", 1)])
+
+def test_repeat_crawl_is_unchanged(monkeypatch):
+    crawl_and_commit(monkeypatch, ShowFinder(listings(150)))
+    _, _, unchanged = crawl_and_commit(monkeypatch, ShowFinder(listings(150)))
+
+    assert unchanged
+
+def test_changed_page_is_a_change_once_its_text_is_released(monkeypatch):
+    crawl_and_commit(monkeypatch, ShowFinder(listings(150)))
+    renamed = listings(150)
+    renamed["broadway"][120] = "Renamed Show"
+    current, pages, unchanged = crawl_and_commit(monkeypatch, ShowFinder(renamed))
+
+    assert not unchanged
+    assert "Renamed Show" in current["broadway"]
+    assert [page.result.not_modified for page in sorted(pages, key=lambda page: (page.venue, page.number))] == [True, False, True, True]
+
+def test_dropped_page_is_a_change(monkeypatch):
+    crawl_and_commit(monkeypatch, ShowFinder(listings(150)))
+    current, pages, unchanged = crawl_and_commit(monkeypatch, ShowFinder(listings(100)))
+
+    assert not unchanged
+    assert len(current["broadway"]) == 100 and len([page for page in pages if page.venue == "broadway"]) == 1
+
+def test_changed_page_count_is_a_change_without_totals(monkeypatch):
+    crawl_and_commit(monkeypatch, ShowFinder(listings(150), state_totals=False))
+    _, pages, unchanged = crawl_and_commit(monkeypatch, ShowFinder(listings(150), state_totals=False))
+    assert unchanged
+
+    # the first page alone, as if the later one was no longer followed
+    first_pages = [page for page in pages if page.number == 1]
+    assert not tdf_main.tdf_pages_unchanged(first_pages)
+
+def test_crawl_yields_pages_before_all_are_fetched(monkeypatch):
+    session = ShowFinder(listings(250))
+    monkeypatch.setattr(fetch, "session", session)
+    monkeypatch.setattr(crawler, "CRAWL_WORKERS", 1)
+
+    pages = crawler.crawl(tdf_main.VENUES)
+    next(pages)
+
+    assert len(session.requested) < 5
+    pages.close()
@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from common import fetch
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fetch, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(fetch, "STATE_FILE", str(tmp_path / "fetch_state.json"))
+    return tmp_path
+
+def test_concurrent_commits_keep_every_url(state_dir):
+    urls = [f"https://example.com/{job}/{page}" for job in range(8) for page in range(25)]
+
+    def commit(url):
+        fetch.commit(fetch.FetchResult(url, etag=f'"{url}"'), fetch.digest(url), rows=[url])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(commit, urls))
+
+    state = fetch.load_state()
+    assert set(state) == set(urls)
+    assert all(state[url]["etag"] == f'"{url}"' and state[url]["rows"] == [url] for url in urls)
+    assert os.listdir(state_dir) == ["fetch_state.json"]
+
+def test_commit_replaces_only_its_own_url(state_dir):
+    fetch.commit(fetch.FetchResult("https://example.com/a", etag='"1"'), "digest a")
+    fetch.commit(fetch.FetchResult("https://example.com/b", etag='"2"'), "digest b")
+    fetch.commit(fetch.FetchResult("https://example.com/a", etag='"3"'), "digest a2")
+
+    assert fetch.get_committed("https://example.com/a")["etag"] == '"3"'
+    assert fetch.get_committed("https://example.com/b")["digest"] == "digest b"
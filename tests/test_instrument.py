@@ -0,0 +1,19 @@
+from replay import FakeSupabase, new_tkts_connection, reset_state
+from common import instrument, supabase_client
+
+class UnreachableDatabase(FakeSupabase):
+    def table(self, name):
+        raise ConnectionError("database unavailable")
+
+def test_swallowed_db_failures_are_counted(monkeypatch):
+    reset_state()
+    monkeypatch.setattr(instrument, "ENABLED", True)
+    monkeypatch.setattr(instrument, "counters", {})
+    supabase_client.client = UnreachableDatabase()
+    db = new_tkts_connection()
+
+    assert db.get_change_logs_since("2025-01-01T00:00:00+00:00") is None
+    assert db.add_poll_decisions([{"interval_seconds": 60}]) is None
+
+    failures = {counter["labels"]["method"]: counter["value"] for counter in instrument.snapshot()["counters"] if counter["name"] == "db_failures"}
+    assert failures == {"get_change_logs_since": 1, "add_poll_decisions": 1}
@@ -0,0 +1,82 @@
+import smtplib
+from email.message import EmailMessage
+
+import pytest
+
+import mailer
+
+def test_chunks_fill_a_message_next_to_the_to_address():
+    recipients = [f"subscriber{i}@example.com" for i in range(250)]
+
+    chunks = mailer.chunk_recipients(recipients)
+
+    assert [len(chunk) for chunk in chunks] == [99, 99, 52]
+    assert [address for chunk in chunks for address in chunk] == recipients
+
+def test_no_recipients_is_one_empty_chunk():
+    assert mailer.chunk_recipients([]) == [[]]
+
+class StubSMTP:
+    """An SMTP server that answers each message with the next scripted failure, then accepts"""
+    connections = []
+    failures = []
+
+    def __init__(self, host, port):
+        self.sent = []
+        self.closed = False
+        StubSMTP.connections.append(self)
+
+    def login(self, username, password):
+        pass
+
+    def send_message(self, msg, to_addrs):
+        if StubSMTP.failures:
+            raise StubSMTP.failures.pop(0)
+        self.sent.append(to_addrs)
+
+    def quit(self):
+        self.closed = True
+
+@pytest.fixture
+def stub_smtp(monkeypatch):
+    StubSMTP.connections = []
+    StubSMTP.failures = []
+    monkeypatch.setattr(smtplib, "SMTP_SSL", StubSMTP)
+    monkeypatch.setattr(mailer, "BACKOFF_SECONDS", 0)
+    return StubSMTP
+
+def message():
+    msg = EmailMessage()
+    msg["To"] = "alerts@example.com"
+    msg["Subject"] = "New show"
+    return msg
+
+def test_transient_failure_reconnects_and_retries(stub_smtp):
+    stub_smtp.failures = [smtplib.SMTPResponseException(421, b"try again later")]
+
+    with mailer.Mailer("user", "password", use_ssl=True) as smtp:
+        smtp.send_with_retry(message(), ["alerts@example.com", "a@example.com"])
+
+    first, second = stub_smtp.connections
+    assert first.closed and first.sent == []
+    assert second.sent == [["alerts@example.com", "a@example.com"]]
+
+def test_permanent_failure_is_raised_without_retrying(stub_smtp):
+    stub_smtp.failures = [smtplib.SMTPResponseException(550, b"mailbox unavailable")]
+
+    with mailer.Mailer("user", "password", use_ssl=True) as smtp:
+        with pytest.raises(smtplib.SMTPResponseException):
+            smtp.send_with_retry(message(), ["alerts@example.com"])
+
+    assert len(stub_smtp.connections) == 1
+    assert stub_smtp.failures == []
+
+def test_one_connection_sends_every_chunk(stub_smtp):
+    recipients = [f"subscriber{i}@example.com" for i in range(250)]
+
+    with mailer.Mailer("user", "password", use_ssl=True) as smtp:
+        smtp.send(message(), recipients)
+
+    [connection] = stub_smtp.connections
+    assert [len(to_addrs) for to_addrs in connection.sent] == [100, 100, 53]
+    assert connection.closed
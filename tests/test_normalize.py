@@ -0,0 +1,54 @@
+from datetime import time
+
+import pytest
+
+from normalize import RowFormatError, normalize_row, parse_price_range, parse_time
+
+def normalize(time_text="7:00 PM", discount_text="50%", price_text="$49-$99", title_text="Hadestown"):
+    return normalize_row([time_text, discount_text, price_text, title_text], "2025-01-15", True, "Times Square")
+
+@pytest.mark.parametrize("text", ["$49-$99", "$49---$99", "$49 – $99", "$49—$99", "49 - 99"])
+def test_dash_ranges(text):
+    assert parse_price_range(text) == (4900, 9900)
+
+def test_single_price_and_cents():
+    assert parse_price_range("$1,049.5") == (104950, 104950)
+    assert parse_price_range("") == (None, None)
+
+@pytest.mark.parametrize("text, expected", [
+    ("7PM", time(19, 0)),
+    ("7 p.m.", time(19, 0)),
+    ("11:30 a.m.", time(11, 30)),
+    ("12 PM", time(12, 0)),
+    ("12:00 AM", time(0, 0)),
+    ("19:00", time(19, 0)),
+])
+def test_times_with_or_without_minutes(text, expected):
+    assert parse_time(text) == expected
+
+@pytest.mark.parametrize("time_text, is_matinee", [
+    ("11:59 AM", True),
+    ("12:00 PM", True),
+    ("12:59 PM", True),
+    ("3:59 PM", True),
+    ("4:00 PM", False),
+    ("4 PM", False),
+    ("8:00 PM", False),
+])
+def test_matinee_cutoff(time_text, is_matinee):
+    assert normalize(time_text=time_text).is_matinee is is_matinee
+
+def test_row_without_a_price_is_skipped():
+    assert normalize(price_text="Sold out") is None
+
+@pytest.mark.parametrize("cells", [
+    {"time_text": "13:00 PM"},
+    {"time_text": "7:75 PM"},
+    {"time_text": "evening"},
+    {"discount_text": "half off"},
+    {"price_text": "$49-$79-$99"},
+    {"title_text": "   "},
+])
+def test_unexpected_formats_raise(cells):
+    with pytest.raises(RowFormatError):
+        normalize(**cells)
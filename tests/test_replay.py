@@ -0,0 +1,63 @@
+import pytest
+
+import replay
+from replay import RecordingMailer
+from common import supabase_client
+import updateDatabase
+import main as tdf_main
+
+# Rounds of each timed stage (pytest-benchmark runs each stage once under --benchmark-disable)
+ROUNDS = 3
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def run_stage(benchmark, setup, run):
+    """
+    Time run(setup()) with pytest-benchmark, leaving setup out of the timing
+
+    Returns:
+        int: Database requests of the last round
+    """
+    requests = []
+
+    def prepare():
+        context = setup()
+        supabase_client.client.reset_counts()
+        return (context,), {}
+
+    def timed(context):
+        run(context)
+        requests.append(supabase_client.client.requests)
+
+    benchmark.pedantic(timed, setup=prepare, rounds=ROUNDS)
+    return requests[-1]
+
+@pytest.mark.parametrize("backend", replay.installed_backends())
+def test_tkts_parse(benchmark, backend):
+    html = replay.read_fixture_board()
+    rows = benchmark.pedantic(replay.parse_rows, args=(html, backend), rounds=ROUNDS)
+    assert rows
+
+def test_tkts_sync_cold(benchmark):
+    assert run_stage(benchmark, replay.cold_tkts, updateDatabase.update_database) == 8
+
+def test_tkts_sync_unchanged(benchmark):
+    assert run_stage(benchmark, replay.unchanged_tkts, updateDatabase.update_database) == 1
+
+def test_tdf_alerts(benchmark):
+    assert run_stage(benchmark, replay.new_offers, lambda _: tdf_main.main()) == 8
+    assert len(RecordingMailer.sent) == 20
+    assert sum(len(recipients) for _, recipients in RecordingMailer.sent) == 1085
+
+def test_tdf_alerts_unchanged(benchmark):
+    def unchanged_offers():
+        replay.unchanged_offers()
+        RecordingMailer.sent = []
+
+    assert run_stage(benchmark, unchanged_offers, lambda _: tdf_main.main()) == 0
+    assert RecordingMailer.sent == []
+
+def test_tdf_alerts_resumed(benchmark):
+    planned = replay.planned_messages()
+    assert run_stage(benchmark, lambda: replay.crashed_run(planned // 2), lambda _: tdf_main.main()) == 7
+    replay.check_resumed(planned)
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from pytz import timezone
+
+from replay import use_database, new_tkts_connection, reset_state
+from scheduler import PollScheduler
+
+EASTERN = timezone('US/Eastern')
+
+def log(at, is_open):
+    return {"created_at": at.isoformat(), "times_square_open": is_open, "lincoln_center_open": False}
+
+def test_change_logs_are_read_a_page_at_a_time():
+    reset_state()
+    start = datetime.now(EASTERN) - timedelta(days=2)
+    fake = use_database({"Logs": [log(start + timedelta(minutes=i), i % 2 == 0) for i in range(2500)]})
+    db = new_tkts_connection()
+    fake.reset_counts()
+
+    logs = db.get_change_logs_since((start - timedelta(minutes=1)).isoformat())
+
+    assert len(logs) == 2500
+    assert fake.requests_by_table["Logs"] == 3
+    assert [entry["created_at"] for entry in logs] == sorted(entry["created_at"] for entry in logs)
+
+def test_logs_are_weighted_by_the_time_until_the_next_one():
+    reset_state()
+    # Monday 10:00 opened, 10:15 closed, no more logs until 11:00: open a quarter of the hour
+    monday = EASTERN.localize(datetime(2026, 10, 12, 10, 0))
+    use_database({"Logs": [log(monday, True), log(monday + timedelta(minutes=15), False), log(monday + timedelta(hours=1), False)]})
+    scheduler = PollScheduler(new_tkts_connection(), history_days=10000)
+    scheduler.load_history()
+
+    opened, total = scheduler.open_counts[(0, 10)]
+    assert (opened, total) == (15 * 60, 60 * 60)
+    assert scheduler.open_probability(monday) == 0.25
+
+def test_long_gaps_are_capped():
+    reset_state()
+    monday = EASTERN.localize(datetime(2026, 10, 12, 10, 0))
+    use_database({"Logs": [log(monday, True), log(monday + timedelta(days=3), False)]})
+    scheduler = PollScheduler(new_tkts_connection(), history_days=10000, max_gap_hours=2)
+    scheduler.load_history()
+
+    assert scheduler.open_counts[(0, 10)] == (3600, 3600)
+    assert scheduler.open_counts[(0, 11)] == (3600, 3600)
+    assert (0, 12) not in scheduler.open_counts
+
+def test_poll_decisions_are_written_in_batches():
+    reset_state()
+    fake = use_database({"Logs": []})
+    scheduler = PollScheduler(new_tkts_connection(), flush_every=5)
+
+    for _ in range(12):
+        scheduler.next_interval()
+
+    assert len(fake.tables["Poll Decisions"]) == 10
+    assert fake.requests_by_table["Poll Decisions"] == 2
+
+    scheduler.flush()
+    assert len(fake.tables["Poll Decisions"]) == 12
+    assert fake.requests_by_table["Poll Decisions"] == 3
+    assert all(decision["decided_at"] for decision in fake.tables["Poll Decisions"])
@@ -0,0 +1,14 @@
+import json
+
+import pytest
+
+import replay
+
+@pytest.mark.parametrize("backend", replay.installed_backends())
+def test_backend_reads_the_golden_rows(backend):
+    with open(replay.GOLDEN_ROWS, "r") as file:
+        golden = json.load(file)
+
+    rows = replay.row_states(replay.parse_rows(replay.read_fixture_board(), backend))
+
+    assert rows == golden
@@ -0,0 +1,22 @@
+import asyncio
+import threading
+
+import service
+
+def test_intervals_are_worked_out_off_the_event_loop():
+    threads = []
+
+    async def run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def get_interval():
+            threads.append(threading.current_thread())
+            loop.call_soon_threadsafe(stop.set)
+            return 60
+
+        await service.run_periodically("job", lambda: None, get_interval, stop)
+
+    asyncio.run(run())
+
+    assert threads and threading.main_thread() not in threads
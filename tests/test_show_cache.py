@@ -0,0 +1,38 @@
+import sqlite3
+
+from show_cache import ShowCache
+
+def test_shows_sharing_a_name_keep_their_ids(tmp_path):
+    cache = ShowCache(str(tmp_path / "shows.sqlite3"))
+
+    cache.replace_all([
+        {"show_id": 7, "show_name": "Hamlet", "is_broadway": False},
+        {"show_id": 3, "show_name": "Hamlet", "is_broadway": True},
+    ])
+
+    assert cache.get_id("Hamlet") == 3
+    assert cache.find_id("hamlet") == 3
+    assert cache.get_name(7) == "Hamlet"
+    assert [show["show_id"] for show in cache.search("Hamlet")] == [3]
+
+def test_cache_with_unique_names_is_reloaded(tmp_path):
+    path = str(tmp_path / "shows.sqlite3")
+    with sqlite3.connect(path) as connection:
+        connection.executescript("""
+            CREATE TABLE shows (show_id INTEGER PRIMARY KEY, show_name TEXT UNIQUE NOT NULL, is_broadway INTEGER);
+            CREATE TABLE pending_shows (show_name TEXT PRIMARY KEY, is_broadway INTEGER);
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            INSERT INTO shows VALUES (7, 'Hamlet', 0);
+            INSERT INTO pending_shows VALUES ('Wicked', 1);
+            INSERT INTO meta VALUES ('ever_loaded', '1');
+        """)
+    connection.close()
+
+    cache = ShowCache(path)
+
+    assert not cache.is_loaded()
+    assert cache.get_id("Hamlet") is None
+    assert cache.pending() == [{"show_name": "Wicked", "is_broadway": True}]
+    cache.replace_all([{"show_id": 3, "show_name": "Hamlet"}, {"show_id": 7, "show_name": "Hamlet"}])
+    assert cache.get_id("Hamlet") == 3
+    assert ShowCache(path).is_loaded()
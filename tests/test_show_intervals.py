@@ -0,0 +1,61 @@
+import pytest
+
+from replay import FakeSupabase, use_database, new_tkts_connection, reset_state
+from common import supabase_client
+import main as tdf_main
+
+class FailingIntervalInserts(FakeSupabase):
+    """A database that rejects new show intervals"""
+    def run_insert(self, query):
+        if query.table == "TDF Show Intervals":
+            raise ConnectionError("insert rejected")
+        return super().run_insert(query)
+
+def interval(show_name, show_key, left_at):
+    return {"show_name": show_name, "show_key": show_key, "venue": "broadway", "first_seen": "2025-01-01T00:00:00+00:00", "last_seen": left_at, "left_at": left_at}
+
+def test_intervals_without_a_key_are_matched_by_name():
+    use_database({"TDF Show Intervals": [
+        interval("Hadestown", None, "2025-02-01T00:00:00+00:00"),
+        interval("Chicago", "chicago", "2025-03-01T00:00:00+00:00"),
+    ]})
+
+    infos = tdf_main.get_show_time_infos(["Hadestown", "Chicago"])
+
+    assert infos[("broadway", "Hadestown")]["left_at"] == "2025-02-01T00:00:00+00:00"
+    assert infos[("broadway", "Chicago")]["left_at"] == "2025-03-01T00:00:00+00:00"
+
+def test_latest_interval_wins_whether_keyed_or_not():
+    use_database({"TDF Show Intervals": [
+        interval("Hadestown", "hadestown", "2025-02-01T00:00:00+00:00"),
+        interval("Hadestown", None, "2025-04-01T00:00:00+00:00"),
+    ]})
+
+    assert tdf_main.get_show_time_infos(["Hadestown"])[("broadway", "Hadestown")]["left_at"] == "2025-04-01T00:00:00+00:00"
+
+def test_open_intervals_without_a_key_get_one():
+    fake = use_database({"TDF Show Intervals": [interval("Hadestown", None, None)]})
+
+    tdf_main.update_show_intervals({"broadway": ["Hadestown"]}, "2025-05-01T00:00:00+00:00")
+
+    [row] = fake.tables["TDF Show Intervals"]
+    assert row["show_key"] == "hadestown"
+    assert row["last_seen"] == "2025-05-01T00:00:00+00:00"
+
+def test_interval_insert_failure_is_raised():
+    supabase_client.client = FailingIntervalInserts()
+
+    with pytest.raises(ConnectionError):
+        tdf_main.update_show_intervals({"broadway": ["Hadestown"]}, "2025-05-01T00:00:00+00:00")
+
+def test_search_returns_every_full_record():
+    reset_state()
+    shows = [{"show_id": show_id, "show_name": f"Show Number {show_id}", "is_broadway": True, "notes": "kept"} for show_id in range(1, 16)]
+    use_database({"Show Information": shows})
+    db = new_tkts_connection()
+    assert db.get_show_cache().is_loaded()
+
+    results = db.search_shows_by_name("Show Number")
+
+    assert sorted(show["show_id"] for show in results) == list(range(1, 16))
+    assert all(show["notes"] == "kept" for show in results)
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from replay import RecordingMailer, FakeSupabase, use_database, reset_state, tdf_tables
+from common import supabase_client
+import main as tdf_main
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+class UnreachableProfiles(FakeSupabase):
+    """A database whose subscriber profiles cannot be read"""
+    def table(self, name):
+        if name == "TDF User Profiles":
+            raise ConnectionError("profiles unavailable")
+        return super().table(name)
+
+def use_unreachable_profiles(tables):
+    fake = UnreachableProfiles(tables)
+    supabase_client.client = fake
+    return fake
+
+def digest_tables():
+    now = datetime.now(timezone.utc)
+    return {
+        "TDF Digests": [{"frequency": "daily", "last_sent_at": (now - timedelta(days=3)).isoformat()}],
+        "TDF Show Intervals": [{"show_name": "Hadestown", "show_key": "hadestown", "venue": "broadway", "first_seen": (now - timedelta(hours=30)).isoformat(), "last_seen": now.isoformat(), "left_at": None}],
+        "TDF User Profiles": tdf_tables()["TDF User Profiles"]
+    }
+
+def test_digest_is_not_marked_sent_without_audience():
+    tables = digest_tables()
+    fake = use_unreachable_profiles(tables)
+    last_sent_at = tables["TDF Digests"][0]["last_sent_at"]
+
+    tdf_main.send_digests()
+
+    assert RecordingMailer.sent == []
+    assert {row["frequency"]: row["last_sent_at"] for row in fake.tables["TDF Digests"]}["daily"] == last_sent_at
+
+def test_digest_is_sent_and_marked_with_audience():
+    fake = use_database(digest_tables())
+
+    tdf_main.send_digests()
+
+    assert RecordingMailer.sent
+    assert {row["frequency"] for row in fake.tables["TDF Digests"]} >= {"daily", "hourly", "weekly"}
+
+def test_alerts_are_not_stored_without_audience():
+    fake = use_unreachable_profiles(tdf_tables())
+    reset_state()
+
+    tdf_main.main()
+
+    assert RecordingMailer.sent == []
+    assert len(fake.tables["TDF Show Changes"]) == 1
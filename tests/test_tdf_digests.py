@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+import smtplib
+
+import pytest
+
+from replay import RecordingMailer, use_database, reset_state, tdf_tables
+import main as tdf_main
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def run_at(monkeypatch, now):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now if tz else now.replace(tzinfo=None)
+
+    monkeypatch.setattr(tdf_main, "datetime", FrozenDatetime)
+    tdf_main.send_digests()
+
+def last_sent(fake):
+    return {row["frequency"]: datetime.fromisoformat(row["last_sent_at"]) for row in fake.tables["TDF Digests"]}
+
+def interval(show_name, venue, first_seen):
+    return {"show_name": show_name, "show_key": show_name.lower(), "venue": venue, "first_seen": first_seen.isoformat(), "last_seen": first_seen.isoformat(), "left_at": None}
+
+def hourly_tables(last_sent_at):
+    return {
+        "TDF Digests": [
+            {"frequency": "hourly", "last_sent_at": last_sent_at.isoformat()},
+            {"frequency": "daily", "last_sent_at": datetime(2030, 1, 1, tzinfo=timezone.utc).isoformat()},
+            {"frequency": "weekly", "last_sent_at": datetime(2030, 1, 1, tzinfo=timezone.utc).isoformat()}
+        ],
+        "TDF Show Intervals": [],
+        "TDF User Profiles": []
+    }
+
+def test_late_run_stores_the_slot_not_the_run_time(monkeypatch):
+    fake = use_database(hourly_tables(datetime(2026, 10, 12, 12, 0, tzinfo=timezone.utc)))
+
+    run_at(monkeypatch, datetime(2026, 10, 12, 13, 20, tzinfo=timezone.utc))
+
+    assert last_sent(fake)["hourly"] == datetime(2026, 10, 12, 13, 0, tzinfo=timezone.utc)
+
+def test_early_runs_neither_skip_nor_repeat_an_hour(monkeypatch):
+    fake = use_database(hourly_tables(datetime(2026, 10, 12, 12, 0, tzinfo=timezone.utc)))
+
+    run_at(monkeypatch, datetime(2026, 10, 12, 12, 58, tzinfo=timezone.utc))
+    assert last_sent(fake)["hourly"] == datetime(2026, 10, 12, 12, 58, tzinfo=timezone.utc)
+
+    # the 13:00 slot was sent early, so a run a few minutes after it has nothing due
+    run_at(monkeypatch, datetime(2026, 10, 12, 13, 3, tzinfo=timezone.utc))
+    assert last_sent(fake)["hourly"] == datetime(2026, 10, 12, 12, 58, tzinfo=timezone.utc)
+
+    run_at(monkeypatch, datetime(2026, 10, 12, 14, 1, tzinfo=timezone.utc))
+    assert last_sent(fake)["hourly"] == datetime(2026, 10, 12, 14, 0, tzinfo=timezone.utc)
+
+def test_digest_covers_shows_up_to_its_slot(monkeypatch):
+    tables = hourly_tables(datetime(2026, 10, 12, 12, 0, tzinfo=timezone.utc))
+    tables["TDF Show Intervals"] = [
+        interval("Hadestown", "broadway", datetime(2026, 10, 12, 12, 30, tzinfo=timezone.utc)),
+        interval("Chicago", "broadway", datetime(2026, 10, 12, 13, 10, tzinfo=timezone.utc))
+    ]
+    tables["TDF User Profiles"] = [{"email": "a@example.com", "email_verified": True, "frequency": "hourly", "broadway": True, "off_broadway": False, "off_off_broadway": False}]
+    use_database(tables)
+
+    run_at(monkeypatch, datetime(2026, 10, 12, 13, 20, tzinfo=timezone.utc))
+
+    assert [subject for subject, _ in RecordingMailer.sent] == ["Your hourly TDF digest: 1 new show"]
+
+class FailingMailer(RecordingMailer):
+    """Stands in for a mail server that drops the connection after a number of messages"""
+    remaining = 0
+
+    def send_chunk(self, msg, chunk):
+        if FailingMailer.remaining == 0:
+            raise smtplib.SMTPServerDisconnected("connection lost")
+        FailingMailer.remaining -= 1
+        super().send_chunk(msg, chunk)
+
+def test_failed_run_resumes_without_resending_cohorts(monkeypatch):
+    now = datetime.now(timezone.utc)
+    tables = {
+        "TDF Digests": [{"frequency": "daily", "last_sent_at": (now - timedelta(days=3)).isoformat()}],
+        "TDF Show Intervals": [interval(f"Show {venue}", venue, now - timedelta(hours=30)) for venue in tdf_main.VENUES],
+        "TDF User Profiles": tdf_tables()["TDF User Profiles"]
+    }
+    reset_state()
+
+    use_database({table: [dict(row) for row in rows] for table, rows in tables.items()})
+    tdf_main.send_digests()
+    planned = list(RecordingMailer.sent)
+    assert len(planned) > 2
+
+    reset_state()
+    RecordingMailer.sent = []
+    fake = use_database(tables)
+    FailingMailer.remaining = 2
+    monkeypatch.setattr(tdf_main, "Mailer", FailingMailer)
+    with pytest.raises(smtplib.SMTPServerDisconnected):
+        tdf_main.send_digests()
+    assert len(RecordingMailer.sent) == 2
+    assert last_sent(fake)["daily"] == datetime.fromisoformat(tables["TDF Digests"][0]["last_sent_at"])
+
+    monkeypatch.setattr(tdf_main, "Mailer", RecordingMailer)
+    tdf_main.send_digests()
+
+    assert sorted(RecordingMailer.sent) == sorted(planned)
+    assert last_sent(fake)["daily"] > now - timedelta(days=1)
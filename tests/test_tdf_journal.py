@@ -0,0 +1,64 @@
+import smtplib
+import sqlite3
+import threading
+
+import pytest
+
+import replay
+from replay import RecordingMailer
+from journal import RunJournal, JOURNAL_FILE
+import main as tdf_main
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+class RejectingMailer(RecordingMailer):
+    """Stands in for a mail server that permanently rejects the first message it is given"""
+    rejected = None
+    lock = threading.Lock()
+
+    def send_chunk(self, msg, chunk):
+        with RejectingMailer.lock:
+            if RejectingMailer.rejected is None:
+                RejectingMailer.rejected = (msg["Subject"], tuple(chunk))
+                raise smtplib.SMTPDataError(550, b"Message rejected")
+        super().send_chunk(msg, chunk)
+
+def chunk_statuses():
+    with sqlite3.connect(JOURNAL_FILE) as connection:
+        return dict(connection.execute("SELECT status, COUNT(*) FROM chunks GROUP BY status").fetchall())
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_resumed_run_sends_every_message_once(monkeypatch, workers):
+    monkeypatch.setattr(tdf_main, "SEND_WORKERS", workers)
+    planned = replay.planned_messages()
+
+    replay.crashed_run(planned // 2)
+    sent_before_crash = len(RecordingMailer.sent)
+    assert 0 < sent_before_crash < planned
+
+    tdf_main.main()
+
+    replay.check_resumed(planned)
+    with RunJournal("tdf_alerts") as run_journal:
+        assert run_journal.unfinished_run() is None
+
+def test_permanently_rejected_chunk_is_not_retried(monkeypatch):
+    monkeypatch.setattr(tdf_main, "SEND_WORKERS", 2)
+    planned = replay.planned_messages()
+
+    replay.new_offers()
+    RejectingMailer.rejected = None
+    monkeypatch.setattr(tdf_main, "Mailer", RejectingMailer)
+    tdf_main.main()
+
+    assert RejectingMailer.rejected is not None
+    assert RejectingMailer.rejected not in RecordingMailer.sent
+    assert len(RecordingMailer.sent) == planned - 1
+    assert chunk_statuses() == {"sent": planned - 1, "failed": 1}
+
+    # the run was finished despite the rejection, so the next one neither resumes it nor resends
+    with RunJournal("tdf_alerts") as run_journal:
+        assert run_journal.unfinished_run() is None
+    RecordingMailer.sent = []
+    tdf_main.main()
+    assert RecordingMailer.sent == []
@@ -0,0 +1,111 @@
+import pytest
+
+from replay import RecordingMailer, FakeSupabase, use_database, reset_state, tdf_tables
+from common import supabase_client
+import crawler
+import main as tdf_main
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+class FlakyIntervalInserts(FakeSupabase):
+    """A database that rejects the first insert of new show intervals"""
+    failed = False
+
+    def run_insert(self, query):
+        if query.table == "TDF Show Intervals" and not self.failed:
+            self.failed = True
+            raise ConnectionError("insert rejected")
+        return super().run_insert(query)
+
+def sorted_offers(offers):
+    return {venue: sorted(titles) for venue, titles in offers.items()}
+
+def listed_offers():
+    offers = {}
+    for page in crawler.crawl(tdf_main.VENUES):
+        offers.setdefault(page.venue, []).extend(card["title"] for card in page.cards)
+    reset_state()
+    return offers
+
+def test_reads_legacy_snapshot_before_migration():
+    offers = listed_offers()
+    use_database({"TDF Shows": [{"created_at": "2025-01-01T00:00:00+00:00", **offers}]})
+
+    assert tdf_main.get_last_tdf_offers() == offers
+
+def test_unmigrated_history_sends_no_mass_alert():
+    offers = listed_offers()
+    legacy = {venue: titles[1:] for venue, titles in offers.items()}
+    fake = use_database({**tdf_tables(), "TDF Shows": [{"created_at": "2025-01-01T00:00:00+00:00", **legacy}]})
+    fake.tables["TDF Show Changes"] = []
+    reset_state()
+
+    tdf_main.main()
+
+    assert len({subject for subject, _ in RecordingMailer.sent}) == len(offers)
+    assert fake.tables["TDF Show Changes"][0]["is_checkpoint"]
+
+def test_no_stored_offers_neither_alerts_nor_stores():
+    fake = use_database({"TDF User Profiles": tdf_tables()["TDF User Profiles"]})
+
+    tdf_main.main()
+
+    assert RecordingMailer.sent == []
+    assert not fake.tables.get("TDF Show Changes")
+
+def test_migration_after_fallback_run_keeps_chain_valid():
+    offers = listed_offers()
+    older = {venue: titles[2:] for venue, titles in offers.items()}
+    legacy = {venue: titles[1:] for venue, titles in offers.items()}
+    fake = use_database({"TDF Shows": [
+        {"created_at": "2025-01-01T00:00:00+00:00", **older},
+        {"created_at": "2025-01-02T00:00:00+00:00", **legacy}
+    ]})
+
+    tdf_main.main()
+    tdf_main.migrate_tdf_snapshots()
+    migrated = len(fake.tables["TDF Show Changes"])
+    tdf_main.migrate_tdf_snapshots()
+
+    assert migrated == 3 and len(fake.tables["TDF Show Changes"]) == 3
+    history = [offers for _, offers in tdf_main.iter_tdf_offers()]
+    assert [sorted_offers(offers) for offers in history] == [sorted_offers(older), sorted_offers(legacy), sorted_offers(offers)]
+
+def test_rebuild_before_migration_covers_the_legacy_history():
+    offers = listed_offers()
+    fake = use_database({"TDF Shows": [
+        {"created_at": "2025-01-01T00:00:00+00:00", "broadway": ["Gone Show"]},
+        {"created_at": "2025-01-02T00:00:00+00:00", **offers}
+    ]})
+    tdf_main.main()
+
+    tdf_main.rebuild_show_intervals()
+
+    intervals = fake.tables["TDF Show Intervals"]
+    [gone] = [interval for interval in intervals if interval["show_name"] == "Gone Show"]
+    assert (gone["first_seen"], gone["left_at"]) == ("2025-01-01T00:00:00+00:00", "2025-01-02T00:00:00+00:00")
+    assert {interval["show_name"] for interval in intervals if interval["left_at"] is None} == {title for titles in offers.values() for title in titles}
+
+def test_rebuild_without_history_keeps_the_index():
+    kept = {"show_name": "Hadestown", "show_key": "hadestown", "venue": "broadway", "first_seen": "2025-01-01T00:00:00+00:00", "last_seen": "2025-01-01T00:00:00+00:00", "left_at": None}
+    fake = use_database({"TDF Show Intervals": [kept]})
+
+    tdf_main.rebuild_show_intervals()
+
+    assert [interval["show_name"] for interval in fake.tables["TDF Show Intervals"]] == ["Hadestown"]
+
+def test_failed_interval_update_without_new_offers_is_retried():
+    offers = listed_offers()
+    stored = {**offers, "broadway": offers["broadway"] + ["Gone Show"]}
+    fake = FlakyIntervalInserts({"TDF Show Changes": [{"is_checkpoint": True, "added": stored, "removed": {}}]})
+    supabase_client.client = fake
+
+    tdf_main.main()
+    assert not fake.tables.get("TDF Show Intervals")
+
+    tdf_main.main()
+
+    assert RecordingMailer.sent == []
+    assert len(fake.tables["TDF Show Changes"]) == 2
+    listed = {title for titles in offers.values() for title in titles}
+    assert {interval["show_name"] for interval in fake.tables["TDF Show Intervals"]} == listed
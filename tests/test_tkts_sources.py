@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+from pytz import timezone
+
+import replay
+from replay import FixtureSession
+from common import fetch
+import scraper
+import updateDatabase
+from scheduler import PollScheduler
+
+@pytest.fixture
+def synced(monkeypatch):
+    """A database and fetch state after one sync of the fixture board"""
+    replay.reset_state()
+    monkeypatch.setattr(fetch, "session", FixtureSession())
+    fake = replay.use_database()
+    db = replay.new_tkts_connection()
+    assert updateDatabase.update_database(db)
+    return fake, db
+
+def edit_state(name, edit):
+    state = fetch.load_state()
+    edit(state[name])
+    fetch.save_state(state)
+
+def test_change_log_holds_every_booth():
+    log = updateDatabase.get_change_log({"Times Square": True, "Pier 17": False})
+
+    assert log == {"booths_open": {"Times Square": True, "Pier 17": False}, "times_square_open": True}
+
+def test_sync_state_is_kept_apart_from_the_sources(synced):
+    fake, _ = synced
+
+    assert fetch.get_committed(scraper.SYNC_STATE)["record_ids"]
+    assert "record_ids" not in fetch.get_committed(scraper.TKTS_URL)
+    [log] = fake.tables["Logs"]
+    assert set(log["booths_open"]) == {"Times Square", "Lincoln Center"}
+    assert log["times_square_open"] == log["booths_open"]["Times Square"]
+
+def test_unchanged_board_is_not_synced_again(synced):
+    snapshot, poll = scraper.poll_tkts_snapshot()
+
+    assert snapshot is None
+    assert poll.previous["record_ids"]
+
+@pytest.mark.parametrize("field", ["rows", "booths_open", "digest"])
+def test_incomplete_source_state_is_rebuilt(synced, field):
+    edit_state(scraper.TKTS_URL, lambda state: state.pop(field))
+
+    snapshot, _ = scraper.poll_tkts_snapshot()
+
+    assert snapshot is not None
+    assert len(snapshot.rows) == len(replay.parse_rows(replay.read_fixture_board(), "html.parser"))
+
+def test_missing_sync_state_syncs_again(synced):
+    state = fetch.load_state()
+    del state[scraper.SYNC_STATE]
+    fetch.save_state(state)
+
+    snapshot, poll = scraper.poll_tkts_snapshot()
+
+    assert snapshot is not None
+    assert poll.previous == {}
+
+def test_scheduler_reads_every_booth_of_the_log():
+    replay.reset_state()
+    monday = timezone('US/Eastern').localize(datetime(2026, 10, 12, 10, 0))
+    replay.use_database({"Logs": [
+        {"created_at": monday.isoformat(), "booths_open": {"Pier 17": True}, "times_square_open": None, "lincoln_center_open": None},
+        {"created_at": (monday + timedelta(hours=1)).isoformat(), "booths_open": {"Pier 17": False}, "times_square_open": None, "lincoln_center_open": None},
+    ]})
+    scheduler = PollScheduler(replay.new_tkts_connection(), history_days=10000)
+    scheduler.load_history()
+
+    assert scheduler.open_counts[(0, 10)] == (3600, 3600)
@@ -0,0 +1,29 @@
+from datetime import time
+
+import replay
+import updateDatabase
+from normalize import TktsRow
+
+def row(hour, minute, is_matinee):
+    return TktsRow("Hadestown", 40, 5900, 9900, time(hour, minute), is_matinee, "2025-01-15", True, "Times Square")
+
+def stored(record_id, performance_time, is_matinee):
+    return {
+        "id": record_id, "show_id": 1, "discount_percent": 30, "low_price": 59.0, "high_price": 99.0,
+        "performance_time": performance_time, "performance_date": "2025-01-15", "is_matinee": is_matinee,
+        "last_available_time": "2025-01-15 10:00:00-0500"
+    }
+
+def sync(records, rows):
+    replay.reset_state()
+    fake = replay.use_database({
+        "Show Information": [{"show_id": 1, "show_name": "Hadestown", "is_broadway": True}],
+        "TKTS Discounts": records
+    })
+    assert updateDatabase.sync_discount_records(replay.new_tkts_connection(), rows) is not None
+    return fake.tables["TKTS Discounts"]
+
+def test_evening_record_is_not_taken_for_a_noon_show():
+    records = sync([stored(7, "19:00:00", False)], [row(12, 30, True)])
+
+    assert {(record["performance_time"], record["is_matinee"]) for record in records} == {("19:00:00", False), ("12:30:00", True)}
@@ -0,0 +1,288 @@
+# Reports over the whole TKTS Discounts history
+#
+# The table is exported page by page into NumPy columns and cached in CACHE_DIR/discounts.npz, so
+# later runs only read the records added since, plus those of the last few performance dates (which
+# the sync may still merge into). The reports are computed over whole columns at once.
+#
+# Usage: python analytics.py [--offline] [--percent 50] [--day YYYY-MM-DD]
+#   --offline   use the cached export as is, without reading the database
+#   --percent   discount threshold of the most-discounted report (default 50)
+#   --day       performance date to estimate appearance probabilities for (default tomorrow)
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
+from pytz import timezone
+import os
+import sys
+import time
+
+import numpy as np
+
+# Add parent directory to path to import the shared cache location
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from common.paths import CACHE_DIR
+from price_history import to_cents
+import database
+
+CACHE_FILE = os.path.join(CACHE_DIR, "discounts.npz")
+
+PAGE_SIZE = 1000
+COLUMNS = "id, show_id, discount_percent, low_price, high_price, performance_date, is_matinee"
+
+# Records of performance dates this recent are re-read on every refresh, since syncs merge into them
+REFRESH_DAYS = 2
+
+# Stands in for a missing price in the integer price columns
+NO_PRICE = -1
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def weekday(dates):
+    """Weekday (Monday is 0) of datetime64[D] values; day 0 of the epoch was a Thursday"""
+    return (dates.astype(np.int64) + 3) % 7
+
+@dataclass
+class DiscountHistory:
+    """The TKTS Discounts table as NumPy columns, one entry per record, in id order"""
+    id: np.ndarray  # int64
+    show_id: np.ndarray  # int64
+    discount_percent: np.ndarray  # int16
+    low_price_cents: np.ndarray  # int32, NO_PRICE when missing
+    high_price_cents: np.ndarray  # int32, NO_PRICE when missing
+    performance_date: np.ndarray  # datetime64[D]
+    is_matinee: np.ndarray  # bool
+
+    def __len__(self):
+        return len(self.id)
+
+    @classmethod
+    def from_records(cls, records):
+        def cents(price):
+            cents = to_cents(price)
+            return NO_PRICE if cents is None else cents
+
+        return cls(
+            id=np.array([record["id"] for record in records], dtype=np.int64),
+            show_id=np.array([record["show_id"] for record in records], dtype=np.int64),
+            discount_percent=np.array([float(record["discount_percent"]) for record in records]).astype(np.int16),
+            low_price_cents=np.array([cents(record["low_price"]) for record in records], dtype=np.int32),
+            high_price_cents=np.array([cents(record["high_price"]) for record in records], dtype=np.int32),
+            performance_date=np.array([record["performance_date"] for record in records], dtype="datetime64[D]"),
+            is_matinee=np.array([bool(record["is_matinee"]) for record in records], dtype=bool)
+        )
+
+    def columns(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+    def merge(self, other):
+        """Return the records of both, those of other replacing records with the same id"""
+        combined = {name: np.concatenate([column, getattr(other, name)]) for name, column in self.columns().items()}
+
+        # np.unique keeps the first occurrence, so look from the end to keep the newest copy of each id
+        _, last_from_end = np.unique(combined["id"][::-1], return_index=True)
+        keep = len(combined["id"]) - 1 - last_from_end
+        return DiscountHistory(**{name: column[keep] for name, column in combined.items()})
+
+    def save(self, path=CACHE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = path + ".tmp.npz"
+        np.savez(temp_file, **self.columns())
+        os.replace(temp_file, path)
+
+    @classmethod
+    def load(cls, path=CACHE_FILE):
+        """Return the cached export, None if there is none"""
+        try:
+            with np.load(path) as columns:
+                return cls(**{field.name: columns[field.name] for field in fields(cls)})
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+def read_discount_records(db, after_id=0, min_performance_date=None, page_size=PAGE_SIZE):
+    """Read every discount record past after_id (and on or after min_performance_date), None if a page failed"""
+    records = []
+    while True:
+        page = db.get_discount_records_page(after_id, page_size, COLUMNS, min_performance_date)
+        if page is None:
+            return None
+        records += page
+        if len(page) < page_size:
+            return records
+        after_id = page[-1]["id"]
+
+def export_discounts(db, history=None):
+    """
+    Bring an export of the TKTS Discounts table up to date
+
+    Args:
+        db (SupabaseConnection): Database connection
+        history (DiscountHistory): Previous export to refresh (optional, exports everything without one)
+
+    Returns:
+        DiscountHistory: The up to date export, None if the table could not be read
+    """
+    if history is None or not len(history):
+        records = read_discount_records(db)
+        return None if records is None else DiscountHistory.from_records(records)
+
+    recent = (datetime.now(timezone('US/Eastern')) - timedelta(days=REFRESH_DAYS)).strftime("%Y-%m-%d")
+    added = read_discount_records(db, after_id=int(history.id.max()))
+    merged_into = read_discount_records(db, min_performance_date=recent)
+    if added is None or merged_into is None:
+        return None
+
+    return history.merge(DiscountHistory.from_records(merged_into + added))
+
+def load_discounts(db=None, refresh=True):
+    """
+    Return the discount history, refreshing the cached export from the database first
+
+    Falls back to the cached export when the database cannot be read.
+
+    Returns:
+        DiscountHistory: The discount history, None if there is neither a database nor a cached export
+    """
+    history = DiscountHistory.load()
+    if not refresh:
+        return history
+
+    if db is None:
+        db = database.get_connection()
+
+    updated = export_discounts(db, history)
+    if updated is None:
+        print("❌ Could not refresh the discount history, using the cached export.")
+        return history
+
+    updated.save()
+    return updated
+
+def most_discounted_shows(history, percent=50, limit=10):
+    """
+    Rank shows by how many of their performances were offered at a discount of at least percent
+
+    Returns:
+        list: (show_id, performances at the discount, performances listed) tuples, most first
+    """
+    if not len(history):
+        return []
+
+    hits = np.bincount(history.show_id, weights=history.discount_percent >= percent).astype(np.int64)
+    listed = np.bincount(history.show_id)
+    ranked = np.argsort(-hits, kind="stable")[:limit]
+    return [(int(show_id), int(hits[show_id]), int(listed[show_id])) for show_id in ranked if hits[show_id]]
+
+def median_by_group(groups, values, group_count):
+    """Median of values per group number (0 to group_count - 1), NaN for empty groups"""
+    order = np.lexsort((values, groups))
+    sorted_values = values[order].astype(np.float64)
+    starts = np.searchsorted(groups[order], np.arange(group_count), side="left")
+    ends = np.searchsorted(groups[order], np.arange(group_count), side="right")
+    sizes = ends - starts
+
+    medians = np.full(group_count, np.nan)
+    present = sizes > 0
+    lower = starts[present] + (sizes[present] - 1) // 2
+    upper = starts[present] + sizes[present] // 2
+    medians[present] = (sorted_values[lower] + sorted_values[upper]) / 2
+    return medians, sizes
+
+def typical_prices(history):
+    """
+    Median low and high price per weekday, for matinees and evening performances
+
+    Returns:
+        dict: (weekday name, is_matinee) -> dict with low_price, high_price (dollars) and performances
+    """
+    if not len(history):
+        return {}
+
+    groups = weekday(history.performance_date) * 2 + history.is_matinee
+    result = {}
+
+    low_valid = history.low_price_cents != NO_PRICE
+    high_valid = history.high_price_cents != NO_PRICE
+    low, _ = median_by_group(groups[low_valid], history.low_price_cents[low_valid], 14)
+    high, _ = median_by_group(groups[high_valid], history.high_price_cents[high_valid], 14)
+    performances = np.bincount(groups[low_valid | high_valid], minlength=14)
+
+    for group in np.flatnonzero(performances):
+        result[(WEEKDAYS[group // 2], bool(group % 2))] = {
+            "low_price": None if np.isnan(low[group]) else float(low[group]) / 100,
+            "high_price": None if np.isnan(high[group]) else float(high[group]) / 100,
+            "performances": int(performances[group])
+        }
+    return result
+
+def appearance_probabilities(history, day=None, window_days=28):
+    """
+    Estimate the chance of each show being on the board for a performance date
+
+    The estimate is the share of the same weekdays within the window before the date on which the
+    show was listed, counting only weekdays on which the board listed anything.
+
+    Args:
+        history (DiscountHistory): Discount history
+        day (str): Performance date (YYYY-MM-DD format, default tomorrow)
+        window_days (int): How far back to look
+
+    Returns:
+        dict: show_id -> probability, for shows listed at least once in the window
+    """
+    if day is None:
+        day = (datetime.now(timezone('US/Eastern')) + timedelta(days=1)).strftime("%Y-%m-%d")
+    day = np.datetime64(day, "D")
+
+    dates = history.performance_date
+    in_window = (dates >= day - window_days) & (dates < day) & (weekday(dates) == weekday(day))
+    board_days = np.unique(dates[in_window])
+    if not len(board_days):
+        return {}
+
+    # count each show once per date, however many performances it had that day
+    show_days = np.unique(history.show_id[in_window] * 100_000 + dates[in_window].astype(np.int64))
+    listed_days = np.bincount(show_days // 100_000)
+
+    return {int(show_id): float(listed_days[show_id] / len(board_days)) for show_id in np.flatnonzero(listed_days)}
+
+def main():
+    offline = "--offline" in sys.argv
+    percent = int(sys.argv[sys.argv.index("--percent") + 1]) if "--percent" in sys.argv else 50
+    day = sys.argv[sys.argv.index("--day") + 1] if "--day" in sys.argv else None
+
+    history = load_discounts(refresh=not offline)
+    if history is None:
+        print("❌ No discount history available.")
+        return
+
+    start = time.perf_counter()
+    discounted = most_discounted_shows(history, percent)
+    prices = typical_prices(history)
+    probabilities = appearance_probabilities(history, day)
+    elapsed = time.perf_counter() - start
+
+    db = None if offline else database.get_connection()
+
+    def show_name(show_id):
+        name = db.get_show_name_by_id(show_id) if db else None
+        return name or f"Show {show_id}"
+
+    print(f"{len(history)} discount records, reports computed in {elapsed * 1000:.1f} ms\n")
+
+    print(f"Shows most often at {percent}% off:")
+    for show_id, hits, listed in discounted:
+        print(f"  {show_name(show_id):<40} {hits:5d} of {listed:5d} performances")
+
+    print("\nMedian prices:")
+    for (day_name, is_matinee), typical in prices.items():
+        low = "-" if typical["low_price"] is None else f"${typical['low_price']:.0f}"
+        high = "-" if typical["high_price"] is None else f"${typical['high_price']:.0f}"
+        print(f"  {day_name:<10} {'matinee' if is_matinee else 'evening':<8} {low:>6} to {high:>6} ({typical['performances']} performances)")
+
+    print(f"\nChance of being on the board {day or 'tomorrow'}:")
+    for show_id, probability in sorted(probabilities.items(), key=lambda item: -item[1])[:20]:
+        print(f"  {show_name(show_id):<40} {probability:6.0%}")
+
+if __name__ == "__main__":
+    main()
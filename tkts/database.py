@@ -1,36 +1,56 @@
-from supabase import create_client, Client
 import sys
 import os
+import threading
 
-# Add parent directory to path to import keys
+# Add parent directory to path to import the shared Supabase client
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, parent_dir)
 
-from keys.keys import SUPABASE_URL, SUPABASE_KEY
+from common import instrument, supabase_client
+from common.titles import TitleIndex
+from show_cache import ShowCache
+from datetime import datetime, timedelta
+
+# How often a connection checks whether its show cache is still current
+SHOW_CACHE_CHECK_INTERVAL = timedelta(seconds=60)
+
+shared_connection = None
+shared_connection_lock = threading.Lock()
+
+def get_connection():
+    """Return a SupabaseConnection created on first use and shared for the rest of the process"""
+    global shared_connection
+    with shared_connection_lock:
+        if shared_connection is None:
+            shared_connection = SupabaseConnection()
+    return shared_connection
 
 class SupabaseConnection:
     def __init__(self):
-        """Initialize Supabase client"""
-        self.url = SUPABASE_URL
-        self.key = SUPABASE_KEY
-        self.supabase: Client = create_client(self.url, self.key)
+        """Initialize Supabase client (shared by every connection in the process)"""
+        self.supabase = supabase_client.get_client()
+        self.show_cache = None
+        self.show_cache_checked_at = None
     
     def get_client(self):
         """Return the Supabase client"""
         return self.supabase
     
+    @instrument.timed()
     def test_connection(self):
         """Test the connection to Supabase"""
         try:
             # Test connection with the new table names
-            response = self.supabase.table('TKTS Discounts').select("*").limit(1).execute()
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').select("*").limit(1))
             print("✅ Connection to Supabase successful!")
             return True
         except Exception as e:
+            instrument.count("db_failures", method="test_connection")
             print(f"❌ Connection failed: {e}")
             return False
     
     # TKTS Discounts table methods
+    @instrument.timed()
     def add_discount_record(self, show_id, discount_percent, low_price, high_price, performance_time, performance_date=None, is_matinee=False):
         """
         Add a new discount record to the TKTS Discounts table
@@ -56,13 +76,15 @@ class SupabaseConnection:
                 "is_matinee": is_matinee,
                 "performance_time": performance_time,
             }
-            response = self.supabase.table('TKTS Discounts').insert(data).execute()
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').insert(data))
             print(f"✅ Successfully added discount record for {self.get_show_name_by_id(show_id)} on {performance_date} (Matinee: {is_matinee})")
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="add_discount_record")
             print(f"❌ Failed to add discount record: {e}")
             return None
         
+    @instrument.timed()
     def get_discount_record_by_fields(self, **kwargs):
         """
         Get a discount record by arbitrary fields
@@ -74,14 +96,106 @@ class SupabaseConnection:
             dict: Discount record if found, None otherwise
         """
         try:
-            response = self.supabase.table('TKTS Discounts').select("*").match(kwargs).execute()
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').select("*").match(kwargs))
             if response.data:
                 return response.data[0]
             return None
         except Exception as e:
+            instrument.count("db_failures", method="get_discount_record_by_fields")
             print(f"❌ Failed to fetch discount record: {e}")
             return None
 
+    @instrument.timed()
+    def get_discount_records_by_dates(self, performance_dates):
+        """
+        Get every discount record for the given performance dates in a single query
+        
+        Args:
+            performance_dates (list): Performance dates (YYYY-MM-DD format)
+        
+        Returns:
+            list: Matching discount records, None if the query failed
+        """
+        try:
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').select("*").in_('performance_date', list(performance_dates)))
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="get_discount_records_by_dates")
+            print(f"❌ Failed to fetch discount records for {performance_dates}: {e}")
+            return None
+
+    @instrument.timed()
+    def get_discount_records_page(self, after_id=0, page_size=1000, columns="*", min_performance_date=None):
+        """
+        Get one page of the TKTS Discounts table in id order, for bulk exports
+        
+        Pages are read by id rather than by offset, so each page costs the same however deep the export is.
+        
+        Args:
+            after_id (int): Only records with a greater id
+            page_size (int): Records per page
+            columns (str): Columns to select
+            min_performance_date (str): Only records on or after this performance date (YYYY-MM-DD format, optional)
+        
+        Returns:
+            list: Up to page_size records, None if the query failed
+        """
+        try:
+            query = self.supabase.table('TKTS Discounts').select(columns).gt('id', after_id)
+            if min_performance_date:
+                query = query.gte('performance_date', min_performance_date)
+            response = supabase_client.execute(query.order('id').limit(page_size))
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="get_discount_records_page")
+            print(f"❌ Failed to fetch discount records after id {after_id}: {e}")
+            return None
+
+    @instrument.timed()
+    def add_discount_records(self, records):
+        """
+        Add several discount records to the TKTS Discounts table in one bulk insert
+        
+        Args:
+            records (list): Discount records (dicts with the add_discount_record fields)
+        
+        Returns:
+            list: Inserted records, None if the insert failed
+        """
+        if not records:
+            return []
+        try:
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').insert(records))
+            print(f"✅ Successfully added {len(records)} discount records")
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="add_discount_records")
+            print(f"❌ Failed to add discount records: {e}")
+            return None
+
+    @instrument.timed()
+    def upsert_discount_records(self, records):
+        """
+        Write back several existing discount records in one bulk upsert
+        
+        Args:
+            records (list): Discount records, each including its id
+        
+        Returns:
+            list: Upserted records, None if the upsert failed
+        """
+        if not records:
+            return []
+        try:
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').upsert(records, on_conflict='id'))
+            print(f"✅ Successfully updated {len(records)} discount records")
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="upsert_discount_records")
+            print(f"❌ Failed to update discount records: {e}")
+            return None
+
+    @instrument.timed()
     def update_discount(self, record_id, **kwargs):
         """
         Update a discount record
@@ -94,13 +208,38 @@ class SupabaseConnection:
             dict: Updated record
         """
         try:
-            response = self.supabase.table('TKTS Discounts').update(kwargs).eq('id', record_id).execute()
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').update(kwargs).eq('id', record_id))
             print(f"✅ Successfully updated discount record {record_id}.")
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="update_discount")
             print(f"❌ Failed to update discount record {record_id}: {e}")
             return None
     
+    @instrument.timed()
+    def touch_discount_records(self, record_ids, last_available_time):
+        """
+        Bump the last available time of several discount records in one update
+        
+        Args:
+            record_ids (list): IDs of the records still on the board
+            last_available_time (str): Timestamp of this run
+        
+        Returns:
+            list: Updated records, None if the update failed
+        """
+        if not record_ids:
+            return []
+        try:
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').update({"last_available_time": last_available_time}).in_('id', list(record_ids)))
+            print(f"✅ Successfully updated last available time of {len(record_ids)} discount records")
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="touch_discount_records")
+            print(f"❌ Failed to update last available time of discount records: {e}")
+            return None
+
+    @instrument.timed()
     def delete_discount(self, record_id):
         """
         Delete a discount record
@@ -112,14 +251,16 @@ class SupabaseConnection:
             bool: True if successful, False otherwise
         """
         try:
-            response = self.supabase.table('TKTS Discounts').delete().eq('id', record_id).execute()
+            response = supabase_client.execute(self.supabase.table('TKTS Discounts').delete().eq('id', record_id))
             print(f"✅ Successfully deleted discount record {record_id}")
             return True
         except Exception as e:
+            instrument.count("db_failures", method="delete_discount")
             print(f"❌ Failed to delete discount record {record_id}: {e}")
             return False
 
     # Show Information table methods
+    @instrument.timed()
     def add_show_mapping(self, show_name, is_broadway=None):
         """
         Add a new show to the Show Information table
@@ -136,30 +277,119 @@ class SupabaseConnection:
                 "show_name": show_name,
                 "is_broadway": is_broadway
             }
-            response = self.supabase.table('Show Information').insert(data).execute()
+            response = supabase_client.execute(self.supabase.table('Show Information').insert(data))
             print(f"✅ Successfully added show mapping for '{show_name}'")
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="add_show_mapping")
             print(f"❌ Failed to add show mapping: {e}")
             return None
 
+    @instrument.timed()
+    def add_show_mappings(self, shows):
+        """
+        Add several shows to the Show Information table in one bulk insert
+        
+        Args:
+            shows (list): Dicts with show_name and is_broadway
+        
+        Returns:
+            list: The new show records (including show_id), None if the insert failed
+        """
+        if not shows:
+            return []
+        try:
+            response = supabase_client.execute(self.supabase.table('Show Information').insert(shows))
+            print(f"✅ Successfully added {len(shows)} show mappings")
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="add_show_mappings")
+            print(f"❌ Failed to add show mappings: {e}")
+            return None
+
+    @instrument.timed()
     def get_all_show_mappings(self):
         """
         Get all show information records
         
         Returns:
-            list: All show mappings
+            list: All show mappings, None if the query failed
         """
         try:
-            response = self.supabase.table('Show Information').select("*").execute()
+            response = supabase_client.execute(self.supabase.table('Show Information').select("*"))
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="get_all_show_mappings")
             print(f"❌ Failed to fetch show mappings: {e}")
-            return []
+            return None
+
+    @instrument.timed()
+    def get_show_cache(self):
+        """
+        Get the local show cache, reloading it from the Show Information table when stale
+        
+        Whether the cache is current is checked at most once per SHOW_CACHE_CHECK_INTERVAL.
+        
+        Returns:
+            ShowCache: The local show cache
+        """
+        if self.show_cache is None:
+            self.show_cache = ShowCache()
+
+        now = datetime.now()
+        if self.show_cache_checked_at and now - self.show_cache_checked_at < SHOW_CACHE_CHECK_INTERVAL:
+            return self.show_cache
+
+        try:
+            response = supabase_client.execute(self.supabase.table('Show Information').select("show_id").order('show_id', desc=True).limit(1))
+            latest_show_id = response.data[0]['show_id'] if response.data else None
+        except Exception as e:
+            instrument.count("db_failures", method="get_show_cache")
+            print(f"❌ Failed to check show cache version: {e}")
+            if self.show_cache.is_loaded():
+                return self.show_cache
+            latest_show_id = None
+
+        if not self.show_cache.is_fresh(latest_show_id):
+            shows = self.get_all_show_mappings()
+            if shows is None:
+                return self.show_cache
+            self.show_cache.replace_all(shows)
+            print(f"✅ Reloaded show cache with {len(shows)} shows")
 
+        self.show_cache_checked_at = now
+        return self.show_cache
+
+    @instrument.timed()
+    def flush_pending_shows(self):
+        """
+        Create every show queued in the show cache with one bulk insert
+        
+        Returns:
+            bool: True if the queue was flushed, False otherwise
+        """
+        cache = self.get_show_cache()
+        pending = cache.pending()
+        if not pending:
+            return True
+
+        created = self.add_show_mappings(pending)
+        if created is None:
+            # the insert may still have gone through, so reload before trying again
+            cache.invalidate()
+            self.show_cache_checked_at = None
+            return False
+
+        cache.add(created)
+        return True
+
+    @instrument.timed()
     def get_show_id_by_name(self, show_name):
         """
-        Get show ID by show name
+        Get show ID by show name, from the show cache when possible
+
+        A cached show whose name differs only in casing, punctuation, quotes or a leading "The"
+        counts as the same show (see common.titles.canonical_key).
         
         Args:
             show_name (str): Name of the show
@@ -167,26 +397,72 @@ class SupabaseConnection:
         Returns:
             int: Show ID if found, None otherwise
         """
+        cache = self.get_show_cache()
+        show_id = cache.find_id(show_name)
+        if show_id:
+            return show_id
+
         try:
-            response = self.supabase.table('Show Information').select("show_id").eq('show_name', show_name).execute()
+            response = supabase_client.execute(self.supabase.table('Show Information').select("show_id, show_name, is_broadway").eq('show_name', show_name).order('show_id'))
             if response.data:
+                cache.add(response.data[:1])
                 return response.data[0]['show_id']
             return None
         except Exception as e:
+            instrument.count("db_failures", method="get_show_id_by_name")
             print(f"❌ Failed to fetch show ID for '{show_name}': {e}")
             return None
         
+    @instrument.timed()
     def get_show_id_by_name_or_create(self, show_name, theatre=None):
         show_id = self.get_show_id_by_name(show_name)
         if not show_id:
             print(f"Show '{show_name}' not found, creating new record.")
-            self.add_show_mapping(show_name, theatre)
-            show_id = self.get_show_id_by_name(show_name)
+            self.show_cache.queue(show_name, theatre)
+            self.flush_pending_shows()
+            show_id = self.show_cache.find_id(show_name)
         return show_id
 
+    @instrument.timed()
+    def get_show_ids_by_names_or_create(self, shows):
+        """
+        Get the show IDs of many shows at once, creating all unknown shows in one bulk insert
+
+        Names are matched by canonical key, so only one show is created for several spellings of
+        an unknown name, and a spelling of a known show maps to the existing show.
+        
+        Args:
+            shows (dict): Show name -> whether it is a Broadway show
+        
+        Returns:
+            dict: Show name -> show ID, None if unknown shows could not be created
+        """
+        cache = self.get_show_cache()
+        if not cache.is_loaded():
+            print("❌ Show cache could not be loaded, not creating shows.")
+            return None
+
+        queued = TitleIndex()
+        for show_name, is_broadway in shows.items():
+            if cache.find_id(show_name) or show_name in queued:
+                continue
+
+            print(f"Show '{show_name}' not found, creating new record.")
+            similar = cache.get_index().closest(show_name)
+            if similar:
+                print(f"⚠️ '{show_name}' looks like the existing show '{similar[0]}' (ID {similar[1]}), check whether it is a duplicate.")
+            cache.queue(show_name, is_broadway)
+            queued.add(show_name, show_name)
+
+        if not self.flush_pending_shows():
+            return None
+
+        return {show_name: cache.find_id(show_name) for show_name in shows}
+
+    @instrument.timed()
     def get_show_name_by_id(self, show_id):
         """
-        Get show name by show ID
+        Get show name by show ID, from the show cache when possible
         
         Args:
             show_id (int): ID of the show
@@ -194,15 +470,23 @@ class SupabaseConnection:
         Returns:
             str: Show name if found, None otherwise
         """
+        cache = self.get_show_cache()
+        show_name = cache.get_name(show_id)
+        if show_name:
+            return show_name
+
         try:
-            response = self.supabase.table('Show Information').select("show_name").eq('show_id', show_id).execute()
+            response = supabase_client.execute(self.supabase.table('Show Information').select("show_id, show_name, is_broadway").eq('show_id', show_id))
             if response.data:
+                cache.add(response.data[:1])
                 return response.data[0]['show_name']
             return None
         except Exception as e:
+            instrument.count("db_failures", method="get_show_name_by_id")
             print(f"❌ Failed to fetch show name for ID {show_id}: {e}")
             return None
 
+    @instrument.timed()
     def update_show_mapping(self, mapping_id, show_name=None, is_broadway=None):
         """
         Update a show information record
@@ -222,30 +506,49 @@ class SupabaseConnection:
             if is_broadway is not None:
                 update_data["is_broadway"] = is_broadway
                 
-            response = self.supabase.table('Show Information').update(update_data).eq('id', mapping_id).execute()
+            response = supabase_client.execute(self.supabase.table('Show Information').update(update_data).eq('id', mapping_id))
+            self.get_show_cache().invalidate()
+            self.show_cache_checked_at = None
             print(f"✅ Successfully updated show mapping {mapping_id}")
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="update_show_mapping")
             print(f"❌ Failed to update show mapping {mapping_id}: {e}")
             return None
 
+    @instrument.timed()
     def search_shows_by_name(self, search_term):
         """
         Search for shows by partial name match
+
+        Once the show cache is loaded, matches are found in its trigram index (which also finds names
+        written slightly differently) and their full records read from the database by ID; otherwise
+        falls back to a substring match in the database.
         
         Args:
             search_term (str): Partial show name to search for
         
         Returns:
-            list: List of matching show records
+            list: List of matching show records, best match first when searched in the cache
         """
+        cache = self.get_show_cache()
         try:
-            response = self.supabase.table('Show Information').select("*").ilike('show_name', f'%{search_term}%').execute()
-            return response.data
+            if not cache.is_loaded():
+                response = supabase_client.execute(self.supabase.table('Show Information').select("*").ilike('show_name', f'%{search_term}%'))
+                return response.data
+
+            show_ids = [show["show_id"] for show in cache.search(search_term)]
+            if not show_ids:
+                return []
+            response = supabase_client.execute(self.supabase.table('Show Information').select("*").in_('show_id', show_ids))
+            rank = {show_id: position for position, show_id in enumerate(show_ids)}
+            return sorted(response.data, key=lambda show: rank[show["show_id"]])
         except Exception as e:
+            instrument.count("db_failures", method="search_shows_by_name")
             print(f"❌ Failed to search shows with term '{search_term}': {e}")
             return []
 
+    @instrument.timed()
     def add_change_log(self, **kwargs):
         """
         Update the logs table with a new entry
@@ -257,13 +560,150 @@ class SupabaseConnection:
             dict: Response from Supabase with the new log entry
         """
         try:
-            response = self.supabase.table('Logs').insert(kwargs).execute()
+            response = supabase_client.execute(self.supabase.table('Logs').insert(kwargs))
             print(f"✅ Successfully added log entry")
             return response.data
         except Exception as e:
+            instrument.count("db_failures", method="add_change_log")
             print(f"❌ Failed to add log entry: {e}")
             return None
 
+    @instrument.timed()
+    def get_change_logs_since(self, since, page_size=1000):
+        """
+        Get the booth open/closed history logged since a given time, oldest first, reading the table a page at a time
+
+        Args:
+            since (str): ISO timestamp
+            page_size (int): Rows per request
+
+        Returns:
+            list: Log entries (created_at, booths_open, times_square_open, lincoln_center_open), None if a query failed
+        """
+        logs = []
+        try:
+            while True:
+                page = supabase_client.execute(
+                    self.supabase.table('Logs')
+                    .select("created_at, booths_open, times_square_open, lincoln_center_open")
+                    .gte('created_at', since)
+                    .order('created_at')
+                    .order('id')
+                    .range(len(logs), len(logs) + page_size - 1)
+                ).data
+                logs += page
+                if len(page) < page_size:
+                    return logs
+        except Exception as e:
+            instrument.count("db_failures", method="get_change_logs_since")
+            print(f"❌ Failed to fetch log entries: {e}")
+            return None
+
+    @instrument.timed()
+    def add_poll_decisions(self, decisions):
+        """
+        Record several polling decisions of the TKTS scheduler in the Poll Decisions table with one bulk insert
+
+        Args:
+            decisions (list): Decisions (decided_at, interval_seconds, open_probability, churn)
+
+        Returns:
+            list: The inserted decisions, None if the insert failed
+        """
+        if not decisions:
+            return []
+
+        try:
+            response = supabase_client.execute(self.supabase.table('Poll Decisions').insert(decisions))
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="add_poll_decisions")
+            print(f"❌ Failed to record poll decisions: {e}")
+            return None
+
+    @instrument.timed()
+    def add_price_snapshots(self, snapshots):
+        """
+        Append several rows to the TKTS Price Snapshots table in one bulk insert (see price_history.py)
+        
+        Args:
+            snapshots (list): Snapshot rows (discount_id, show_id, performance_date, observed_at,
+                              discount_percent, low_price_cents, high_price_cents)
+        
+        Returns:
+            list: Inserted rows, None if the insert failed
+        """
+        if not snapshots:
+            return []
+        try:
+            response = supabase_client.execute(self.supabase.table('TKTS Price Snapshots').insert(snapshots))
+            print(f"✅ Successfully added {len(snapshots)} price snapshots")
+            return response.data
+        except Exception as e:
+            instrument.count("db_failures", method="add_price_snapshots")
+            print(f"❌ Failed to add price snapshots: {e}")
+            return None
+
+    @instrument.timed()
+    def get_latest_price_snapshots(self, discount_ids):
+        """
+        Get the newest price snapshot of each of several discount records in a single query
+        
+        Args:
+            discount_ids (list): IDs of discount records
+        
+        Returns:
+            dict: discount_id -> newest snapshot row, None if the query failed
+        """
+        if not discount_ids:
+            return {}
+        try:
+            response = supabase_client.execute(
+                self.supabase.table('TKTS Price Snapshots')
+                .select("*")
+                .in_('discount_id', list(discount_ids))
+                .order('observed_at', desc=True)
+            )
+            latest = {}
+            for snapshot in response.data:
+                latest.setdefault(snapshot["discount_id"], snapshot)
+            return latest
+        except Exception as e:
+            instrument.count("db_failures", method="get_latest_price_snapshots")
+            print(f"❌ Failed to fetch latest price snapshots: {e}")
+            return None
+
+    @instrument.timed()
+    def get_price_snapshots(self, show_id, performance_date=None, since=None, page_size=1000):
+        """
+        Get the price snapshots of a show, oldest first, reading the table a page at a time
+        
+        Args:
+            show_id (int): ID of the show
+            performance_date (str): Only this performance date (YYYY-MM-DD format, optional)
+            since (str): Only snapshots observed at or after this ISO timestamp (optional)
+            page_size (int): Rows per request
+        
+        Returns:
+            list: Snapshot rows, None if a query failed
+        """
+        snapshots = []
+        try:
+            while True:
+                query = self.supabase.table('TKTS Price Snapshots').select("*").eq('show_id', show_id)
+                if performance_date:
+                    query = query.eq('performance_date', performance_date)
+                if since:
+                    query = query.gte('observed_at', since)
+                page = supabase_client.execute(query.order('observed_at').order('id').range(len(snapshots), len(snapshots) + page_size - 1)).data
+                snapshots += page
+                if len(page) < page_size:
+                    return snapshots
+        except Exception as e:
+            instrument.count("db_failures", method="get_price_snapshots")
+            print(f"❌ Failed to fetch price snapshots for show {show_id}: {e}")
+            return None
+
     
 def main():
     """Example usage of Supabase connection with both tables"""
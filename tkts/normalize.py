@@ -0,0 +1,142 @@
+from dataclasses import dataclass, astuple
+from datetime import time
+from functools import lru_cache
+import os
+import re
+import sys
+
+# Add parent directory to path to import the shared title handling
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from common.titles import clean_title
+
+# "7:00 PM", "7PM", "11:30 a.m."
+TIME_PATTERN = re.compile(r"^\s*(\d{1,2})(?::(\d{2}))?\s*([ap])\.?\s*m\.?\s*$", re.IGNORECASE)
+# "50%", "50 %", "Up to 50%", or a bare "50"
+PERCENT_PATTERN = re.compile(r"(\d{1,3})(?:\.\d+)?\s*%")
+BARE_PERCENT_PATTERN = re.compile(r"\s*(\d{1,3})\s*")
+# "$49", "$1,049.50", "49" - a price range is two of these separated by any run of dashes
+PRICE_PATTERN = re.compile(r"\$?\s*(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d{1,2}))?")
+RANGE_SEPARATOR_PATTERN = re.compile(r"\s*[-‐-―]+\s*")
+
+# Performances starting before this time are matinees
+EVENING_STARTS = time(16, 0)
+
+# Bumped whenever the stored form of a row changes, so rows committed by an older version are not reused
+ROW_STATE_VERSION = 2
+
+class RowFormatError(ValueError):
+    """A board row that does not look like any known format"""
+
+@dataclass(slots=True)
+class TktsRow:
+    """One normalized row of the TKTS board"""
+    title: str  # interned
+    discount_percent: int
+    low_price_cents: int  # None if the board shows no price
+    high_price_cents: int  # None if the board shows no price
+    performance_time: time
+    is_matinee: bool
+    performance_date: str  # YYYY-MM-DD
+    on_broadway: bool
+    booth: str
+
+    def to_state(self):
+        """Compact JSON-serializable form, see from_state"""
+        row = list(astuple(self))
+        row[4] = self.performance_time.strftime("%H:%M")
+        return row
+
+    @classmethod
+    def from_state(cls, row):
+        title, discount_percent, low_price_cents, high_price_cents, performance_time, is_matinee, performance_date, on_broadway, booth = row
+        return cls(
+            sys.intern(title), discount_percent, low_price_cents, high_price_cents,
+            parse_time(performance_time), is_matinee, performance_date, on_broadway, booth
+        )
+
+@lru_cache(maxsize=256)
+def parse_time(text):
+    """Parse a board time like "7:00 PM" (or a stored "19:00") into a time"""
+    match = TIME_PATTERN.match(text)
+    if match:
+        hour, minute, meridiem = int(match.group(1)), int(match.group(2) or 0), match.group(3).lower()
+        if not 1 <= hour <= 12 or minute > 59:
+            raise RowFormatError(f"Unexpected time '{text}'")
+        return time(hour % 12 + (12 if meridiem == "p" else 0), minute)
+
+    try:
+        return time.fromisoformat(text.strip())
+    except ValueError:
+        raise RowFormatError(f"Unexpected time '{text}'") from None
+
+def parse_percent(text):
+    match = PERCENT_PATTERN.search(text) or BARE_PERCENT_PATTERN.fullmatch(text)
+    if not match:
+        raise RowFormatError(f"Unexpected discount '{text}'")
+    return int(match.group(1))
+
+def parse_cents(text):
+    """Parse one price like "$1,049.50" into cents, None if the text holds no price"""
+    match = PRICE_PATTERN.search(text)
+    if not match:
+        return None
+    return int(match.group(1).replace(",", "")) * 100 + int((match.group(2) or "0").ljust(2, "0"))
+
+def parse_price_range(text):
+    """
+    Parse a price or price range into cents
+
+    Returns:
+        tuple: (low price, high price) in cents, both None if the text holds no price
+    """
+    parts = [part for part in RANGE_SEPARATOR_PATTERN.split(text.strip()) if part]
+    if len(parts) > 2:
+        raise RowFormatError(f"Unexpected price '{text}'")
+
+    prices = [parse_cents(part) for part in parts]
+    if not prices:
+        return None, None
+    if len(prices) == 1:
+        return prices[0], prices[0]
+    return prices[0], prices[1]
+
+def normalize_row(cells, performance_date, on_broadway, booth):
+    """
+    Normalize the four cell texts of a board row (time, discount, price, title)
+
+    Returns:
+        TktsRow: The row, None if the board lists it without a price
+
+    Raises:
+        RowFormatError: If a cell is in an unexpected format
+    """
+    time_text, discount_text, price_text, title_text = cells
+
+    performance_time = parse_time(time_text)
+    low_price_cents, high_price_cents = parse_price_range(price_text)
+    if low_price_cents is None and high_price_cents is None:
+        return None
+
+    title = clean_title(title_text)
+    if not title:
+        raise RowFormatError("Missing title")
+
+    return TktsRow(
+        title=sys.intern(title),
+        discount_percent=parse_percent(discount_text),
+        low_price_cents=low_price_cents,
+        high_price_cents=high_price_cents,
+        performance_time=performance_time,
+        is_matinee=performance_time < EVENING_STARTS,
+        performance_date=performance_date,
+        on_broadway=on_broadway,
+        booth=booth
+    )
+
+def cents_to_dollars(cents):
+    """Price as stored in TKTS Discounts: whole dollars as an int, otherwise a float"""
+    if cents is None:
+        return None
+    return cents // 100 if cents % 100 == 0 else cents / 100
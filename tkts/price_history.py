@@ -0,0 +1,148 @@
+# "TKTS Price Snapshots" is an append-only history of what the board showed for each discount record:
+# id, discount_id, show_id, performance_date, observed_at, discount_percent (smallint) and
+# low_price_cents, high_price_cents (integer). A row is only written when a record's observed values
+# change, plus one row with null values when its performance leaves the board, so a record's price
+# curve is the step function through its rows ordered by observed_at. Curves are read by show, so the
+# table is indexed on (show_id, performance_date, observed_at).
+
+def to_cents(price):
+    return None if price is None else round(float(price) * 100)
+
+def lowest(*prices):
+    prices = [price for price in prices if price is not None]
+    return min(prices) if prices else None
+
+def highest(*prices):
+    prices = [price for price in prices if price is not None]
+    return max(prices) if prices else None
+
+def get_observations(tkts_data, show_ids):
+    """
+    Reduce the rows of one poll to the values shown per performance
+
+    A performance listed by both booths counts as one observation, with the highest discount,
+    lowest low price and highest high price of the two.
+
+    Returns:
+        dict: (show_id, performance_date, is_matinee) -> [discount_percent, low_price_cents, high_price_cents]
+    """
+    observations = {}
+    for record in tkts_data:
+        key = (show_ids[record.title], record.performance_date, record.is_matinee)
+        observed = [record.discount_percent, record.low_price_cents, record.high_price_cents]
+
+        previous = observations.get(key)
+        if previous is not None:
+            observed = [max(observed[0], previous[0]), lowest(observed[1], previous[1]), highest(observed[2], previous[2])]
+        observations[key] = observed
+    return observations
+
+def get_price_deltas(observations, discount_records, baseline, observed_at):
+    """
+    Work out the snapshot rows of a poll from what the previous poll showed
+
+    Args:
+        observations (dict): Result of get_observations
+        discount_records (list): Synced discount records, each including its id
+        baseline (dict): str(discount_id) -> [discount_percent, low_price_cents, high_price_cents, show_id,
+                         performance_date] as last written, for every record listed by the previous poll
+        observed_at (str): Timestamp of this poll
+
+    Returns:
+        tuple: (snapshot rows to insert, baseline for the next poll)
+    """
+    rows = []
+    listed = {}
+
+    for record in discount_records:
+        key = (record["show_id"], record["performance_date"], record["is_matinee"])
+        if key not in observations:
+            continue
+
+        discount_id = str(record["id"])
+        observed = observations[key]
+        listed[discount_id] = observed
+        if baseline.get(discount_id, [])[:3] != observed:
+            rows.append({
+                "discount_id": record["id"],
+                "show_id": record["show_id"],
+                "performance_date": record["performance_date"],
+                "observed_at": observed_at,
+                "discount_percent": observed[0],
+                "low_price_cents": observed[1],
+                "high_price_cents": observed[2]
+            })
+
+    for discount_id, previous in baseline.items():
+        if discount_id not in listed:
+            rows.append({
+                "discount_id": int(discount_id),
+                "show_id": previous[3],
+                "performance_date": previous[4],
+                "observed_at": observed_at,
+                "discount_percent": None,
+                "low_price_cents": None,
+                "high_price_cents": None
+            })
+
+    # keep the show and date of each listed record, to write its removal row later
+    next_baseline = {}
+    for record in discount_records:
+        discount_id = str(record["id"])
+        if discount_id in listed:
+            next_baseline[discount_id] = listed[discount_id] + [record["show_id"], record["performance_date"]]
+    return rows, next_baseline
+
+def get_baseline(latest_snapshots):
+    """Rebuild a baseline from the newest snapshot of each record (see get_latest_price_snapshots)"""
+    return {
+        str(discount_id): [snapshot["discount_percent"], snapshot["low_price_cents"], snapshot["high_price_cents"], snapshot["show_id"], snapshot["performance_date"]]
+        for discount_id, snapshot in latest_snapshots.items()
+        if snapshot["discount_percent"] is not None
+    }
+
+def get_price_curve(snapshots):
+    """
+    Turn the snapshot rows of one discount record into its price curve
+
+    Args:
+        snapshots (list): Rows of TKTS Price Snapshots for one discount_id, in any order
+
+    Returns:
+        list: Dicts with observed_at, discount_percent, low_price and high_price (dollars),
+              one per change; values are None while the performance was not listed
+    """
+    curve = []
+    for snapshot in sorted(snapshots, key=lambda snapshot: snapshot["observed_at"]):
+        point = {
+            "observed_at": snapshot["observed_at"],
+            "discount_percent": snapshot["discount_percent"],
+            "low_price": None if snapshot["low_price_cents"] is None else snapshot["low_price_cents"] / 100,
+            "high_price": None if snapshot["high_price_cents"] is None else snapshot["high_price_cents"] / 100
+        }
+        if curve and all(curve[-1][field] == point[field] for field in ("discount_percent", "low_price", "high_price")):
+            continue
+        curve.append(point)
+    return curve
+
+def get_price_curves(db, show_id, performance_date=None, since=None):
+    """
+    Get the price curve of every discount record of a show
+
+    Args:
+        db (SupabaseConnection): Database connection
+        show_id (int): ID of the show
+        performance_date (str): Only this performance date (YYYY-MM-DD format, optional)
+        since (str): Only changes observed at or after this ISO timestamp (optional)
+
+    Returns:
+        dict: discount_id -> price curve (see get_price_curve), None if the snapshots could not be read
+    """
+    snapshots = db.get_price_snapshots(show_id, performance_date, since)
+    if snapshots is None:
+        return None
+
+    by_record = {}
+    for snapshot in snapshots:
+        by_record.setdefault(snapshot["discount_id"], []).append(snapshot)
+    return {discount_id: get_price_curve(record_snapshots) for discount_id, record_snapshots in by_record.items()}
@@ -0,0 +1,117 @@
+from collections import deque
+from datetime import datetime, timedelta
+from pytz import timezone
+import os
+
+# Fallback booth hours (Eastern) for hours of the week without logged history
+BOOTH_HOURS = os.environ.get("TKTS_BOOTH_HOURS", "10:00-20:00")
+
+def in_booth_hours(now=None):
+    """True if the current Eastern time falls inside BOOTH_HOURS"""
+    now = now or datetime.now(timezone('US/Eastern'))
+    opens, closes = (datetime.strptime(hour, "%H:%M").time() for hour in BOOTH_HOURS.split("-"))
+    return opens <= now.time() < closes
+
+class PollScheduler:
+    """
+    Chooses how long to wait before the next TKTS poll
+
+    Booth open/closed history from the Logs table gives the probability that a booth is open
+    for each hour of the week, and recent runs give how often the board changes. Polls are
+    spaced geometrically between min_interval (booths open, board churning) and max_interval
+    (booths closed). Decisions are buffered and written to the Poll Decisions table in batches
+    of flush_every; call flush() on shutdown to write the rest.
+
+    Logs are only written when the board changes, so each log counts for the time until the
+    next one (at most max_gap_hours) rather than once, and long unchanged stretches are not
+    outweighed by busy ones.
+    """
+
+    def __init__(self, db, min_interval=60, max_interval=1200, history_days=28, refresh_hours=6, recent_runs=6, max_gap_hours=12, flush_every=20):
+        self.db = db
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.history_days = history_days
+        self.refresh_after = timedelta(hours=refresh_hours)
+        self.recent_runs = deque(maxlen=recent_runs)
+        self.max_gap = timedelta(hours=max_gap_hours)
+        self.flush_every = flush_every
+        self.open_counts = {}  # (weekday, hour) -> (seconds a booth was open, seconds logged)
+        self.loaded_at = None
+        self.decisions = []
+
+    def load_history(self):
+        """Sum, for each (weekday, hour) in Eastern time, how long the logs found a booth open out of how long they cover"""
+        eastern = timezone('US/Eastern')
+        now = datetime.now(eastern)
+        logs = self.db.get_change_logs_since((now - timedelta(days=self.history_days)).isoformat())
+        if logs is None:
+            return
+
+        times = [datetime.fromisoformat(log["created_at"]).astimezone(eastern) for log in logs]
+        open_counts = {}
+        for log, start, end in zip(logs, times, times[1:] + [now]):
+            is_open = any(log["booths_open"].values()) if log.get("booths_open") else bool(log["times_square_open"] or log["lincoln_center_open"])
+            end = min(end, start + self.max_gap)
+            # split the stretch at hour boundaries so each hour of the week gets its share
+            while start < end:
+                slot_end = min(end, start.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1))
+                seconds = (slot_end - start).total_seconds()
+                slot = (start.weekday(), start.hour)
+                opened, total = open_counts.get(slot, (0, 0))
+                open_counts[slot] = (opened + seconds * is_open, total + seconds)
+                start = eastern.normalize(slot_end)
+
+        self.open_counts = open_counts
+        self.loaded_at = now
+
+    def record_run(self, changed):
+        """Remember whether the latest poll found a changed board"""
+        self.recent_runs.append(bool(changed))
+
+    def open_probability(self, now):
+        """Probability a booth is open at this hour or the next one, so polling speeds up ahead of opening"""
+        probabilities = []
+        for moment in (now, now + timedelta(hours=1)):
+            opened, total = self.open_counts.get((moment.weekday(), moment.hour), (0, 0))
+            probabilities.append(opened / total if total else float(in_booth_hours(moment)))
+        return max(probabilities)
+
+    def churn(self):
+        """Share of recent polls that found a changed board (0.5 before any polls)"""
+        if not self.recent_runs:
+            return 0.5
+        return sum(self.recent_runs) / len(self.recent_runs)
+
+    def next_interval(self):
+        """Return the number of seconds to wait before the next poll, recording the decision"""
+        now = datetime.now(timezone('US/Eastern'))
+        if self.loaded_at is None or now - self.loaded_at >= self.refresh_after:
+            self.load_history()
+
+        open_probability = self.open_probability(now)
+        churn = self.churn()
+
+        # activity 0 -> max_interval, activity 1 -> min_interval
+        activity = open_probability * (0.5 + 0.5 * churn) if open_probability >= 0.1 else 0
+        interval = self.max_interval * (self.min_interval / self.max_interval) ** activity
+
+        print(f"Next TKTS poll in {interval:.0f}s (open probability {open_probability:.2f}, churn {churn:.2f}).")
+        self.decisions.append({
+            "decided_at": now.isoformat(),
+            "interval_seconds": round(interval),
+            "open_probability": round(open_probability, 3),
+            "churn": round(churn, 3)
+        })
+        if len(self.decisions) >= self.flush_every:
+            self.flush()
+        return interval
+
+    def flush(self):
+        """Write the buffered decisions to the Poll Decisions table, keeping the latest ones if the insert failed"""
+        if not self.decisions:
+            return
+        if self.db.add_poll_decisions(self.decisions) is None:
+            self.decisions = self.decisions[-10 * self.flush_every:]
+        else:
+            self.decisions = []
@@ -1,105 +1,317 @@
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from datetime import datetime, timedelta
 from pytz import timezone
-import pprint
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import importlib.util
+import os
+import re
+import sys
 
-def get_tkts_html():
-    url = "https://www.tdf.org/discount-ticket-programs/tkts-by-tdf/tkts-live/?tab=TimesSquare"
-    response = requests.get(url)
+# Add parent directory to path to import the shared fetch layer
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, parent_dir)
+
+from common import fetch, instrument
+import normalize
+
+TKTS_URL = "https://www.tdf.org/discount-ticket-programs/tkts-by-tdf/tkts-live/?tab=TimesSquare"
+
+# The four sections each TKTS booth lists; a section's rows are for performances day_offset days after the fetch
+TKTS_SECTIONS = [
+    {"suffix": "-broadway-shows", "day_offset": 0, "on_broadway": True, "header": True},
+    {"suffix": "-off-broadway-shows", "day_offset": 0, "on_broadway": False, "header": True},
+    {"suffix": "-next-day-matinee-broadway-shows", "day_offset": 1, "on_broadway": True, "header": False},
+    {"suffix": "-next-day-matinee-off-broadway-shows", "day_offset": 1, "on_broadway": False, "header": False}
+]
+
+# Every board the TKTS sync reads. A source is one page listing one or more booths: a booth's
+# sections are the divs whose ids are the booth's div followed by a section suffix (for example
+# "TimesSquare-next-day-matinee-off-broadway-shows"), and a booth is closed when the page contains
+# its closed_text. Sources are fetched and parsed concurrently, so adding one adds no serial latency.
+SOURCES = [
+    {
+        "url": TKTS_URL,
+        "booths": [{"div": "TimesSquare", "name": "Times Square"}, {"div": "LincolnCenter", "name": "Lincoln Center"}],
+        "sections": TKTS_SECTIONS,
+        "closed_text": "The {booth} booth is currently <span class=\"underlined\">closed</span>"
+    }
+]
+
+def get_section_pattern(source):
+    """Pattern matching the ids of a source's section divs"""
+    return re.compile("(?:" + "|".join(re.escape(section["suffix"]) for section in source["sections"]) + ")$")
+
+SECTION_ID_PATTERN = get_section_pattern(SOURCES[0])
+
+# "html.parser" builds the full document tree; "strainer" and "lxml" only build the section divs
+PARSER_BACKENDS = ("lxml", "strainer", "html.parser")
+
+@dataclass
+class TktsSnapshot:
+    """One fetch and parse of the TKTS board"""
+    rows: list  # normalize.TktsRow per board row
+    booths_open: dict
+    fetched_at: datetime
+    html_digest: str
+    board_digest: str
+
+@instrument.timed()
+def get_tkts_html(url=TKTS_URL):
+    response = fetch.session.get(url, timeout=fetch.TIMEOUT)
     response.raise_for_status()
 
     return response.text
 
-def process_div(div, div_location, soup):
+def get_parser_backend():
+    """Return the parser backend selected by TKTS_PARSER, defaulting to the fastest one installed"""
+    backend = os.environ.get("TKTS_PARSER")
+    if backend:
+        if backend not in PARSER_BACKENDS:
+            raise ValueError(f"Unknown TKTS parser backend '{backend}', expected one of {PARSER_BACKENDS}")
+        return backend
+
+    return "lxml" if importlib.util.find_spec("lxml") else "strainer"
+
+@instrument.timed()
+def parse_sections(html_content, backend=None, pattern=SECTION_ID_PATTERN):
+    """
+    Parse the board sections of the TKTS page into an id-indexed lookup
+
+    Args:
+        html_content (str): Raw TKTS page
+        backend (str): One of PARSER_BACKENDS (optional, see get_parser_backend)
+        pattern (re.Pattern): Ids of the section divs (optional, see get_section_pattern)
 
-    div_id = div_location + div["Div"]
+    Returns:
+        dict: Section div id -> div element
+    """
+    backend = backend or get_parser_backend()
+
+    if backend == "html.parser":
+        soup = BeautifulSoup(html_content, "html.parser")
+    elif backend in ("strainer", "lxml"):
+        features = "lxml" if backend == "lxml" else "html.parser"
+        soup = BeautifulSoup(html_content, features, parse_only=SoupStrainer("div", id=pattern))
+    else:
+        raise ValueError(f"Unknown TKTS parser backend '{backend}', expected one of {PARSER_BACKENDS}")
+
+    sections = {}
+    for section in soup.find_all("div", id=pattern):
+        sections.setdefault(section["id"], section)
+    return sections
+
+@instrument.timed()
+def process_div(div, booth, sections):
+
+    div_id = booth["div"] + div["Div"]
 
     data = []
 
-    if not soup.find("div", id=div_id):
+    if div_id not in sections:
         print(f"No data found for {div_id}")
         return data
 
-    table = soup.find("div", id=div_id).find("table")
+    table = sections[div_id].find("table")
     rows = table.find_all("tr")[1 if div["header"] else 0:]  # Skip header row
 
     for row in rows:
         cells = row.find_all("td")
         if len(cells) == 4:  # Ensure we have the right number of columns
-            
-            time = cells[0].get_text(strip=True)
-            is_matinee = True
-            if "PM" in time:
-                hour = int(time.split(":")[0])
-                if hour >= 4:
-                    is_matinee = False
-
-            # Convert time like "4:00 PM" or "11:00 AM" to "HH:MM:SS" in 24-hour format
-            performance_time = datetime.strptime(time, "%I:%M %p").strftime("%H:%M:%S")
-
-            discount = cells[1].get_text(strip=True).replace('%', '')
-            price = cells[2].get_text(strip=True)
-
-            # Handle price ranges with different dash formats
-            price = price.replace('--', '-').replace('---', '-')
-            if '-' in price:
-                low_price, high_price = price.replace('$', '').split('-')
-                low_price = low_price.strip()
-                high_price = high_price.strip()
-            else:
-                low_price = high_price = price.replace('$', '').strip()
-                
-            if not low_price:
-                low_price = None
-            if not high_price:
-                high_price = None
-                
-            if not low_price and not high_price:
+            try:
+                normalized = normalize.normalize_row([cell.get_text(strip=True) for cell in cells], div["Date"], div["onBroadway"], booth["name"])
+            except normalize.RowFormatError as e:
+                # skip the row rather than the whole board, so one odd row does not stop the sync
+                print(f"Skipping row of {div_id}: {e}")
+                instrument.count("board_rows_skipped")
                 continue
 
-            title = cells[3].get_text(strip=True).replace('"', '')
-            data.append({
-                "title": title,
-                "discount_percent": discount,
-                "low_price": low_price,
-                "high_price": high_price,
-                "performance_time": performance_time,
-                "is_matinee": is_matinee,
-                "performance_date": div["Date"],
-                "on_broadway": div["onBroadway"]
-            })
+            if normalized is not None:
+                data.append(normalized)
 
     return data
 
-def location_is_closed(location_name, html_content):
-    return f"The {location_name} booth is currently <span class=\"underlined\">closed</span>" in html_content
+def location_is_closed(location_name, html_content, source=SOURCES[0]):
+    return source["closed_text"].format(booth=location_name) in html_content
 
-def get_tkts_data():
-    html_content = get_tkts_html()
+def get_booth_status(html_content, source=SOURCES[0]):
+    """Return open/closed status per booth name"""
+    return {booth["name"]: not location_is_closed(booth["name"], html_content, source) for booth in source["booths"]}
+
+def get_board_digest(sections, booths_open):
+    """Digest of the parts of the page that feed the discount sync: the board sections and booth status"""
+    board = "".join(str(sections[div_id]) for div_id in sorted(sections))
+    return fetch.digest(board + repr(sorted(booths_open.items())))
 
-    soup = BeautifulSoup(html_content, "html.parser")
+@instrument.timed()
+def build_snapshot(html_content, fetched_at, sections=None, source=SOURCES[0]):
+    """
+    Parse a downloaded TKTS page into a snapshot
 
-    current_date = datetime.now(timezone('US/Eastern'))
+    Args:
+        html_content (str): Raw TKTS page
+        fetched_at (datetime): When the page was fetched (Eastern time), used to date the rows
+        sections (dict): Already parsed sections (optional, see parse_sections)
+        source (dict): The entry of SOURCES the page was fetched for
+
+    Returns:
+        TktsSnapshot: Parsed rows, open/closed status per booth name, fetch time and digests of the page
+    """
+    if sections is None:
+        sections = parse_sections(html_content, pattern=get_section_pattern(source))
 
     divs = [
-        {"Div": "-broadway-shows", "Date": current_date.strftime("%Y-%m-%d"), "onBroadway": True, "header": True},
-        {"Div": "-off-broadway-shows", "Date": current_date.strftime("%Y-%m-%d"), "onBroadway": False, "header": True},
-        {"Div": "-next-day-matinee-broadway-shows", "Date": (current_date + timedelta(days=1)).strftime("%Y-%m-%d"), "onBroadway": True, "header": False},
-        {"Div": "-next-day-matinee-off-broadway-shows", "Date": (current_date + timedelta(days=1)).strftime("%Y-%m-%d"), "onBroadway": False, "header": False}
+        {
+            "Div": section["suffix"],
+            "Date": (fetched_at + timedelta(days=section["day_offset"])).strftime("%Y-%m-%d"),
+            "onBroadway": section["on_broadway"],
+            "header": section["header"]
+        }
+        for section in source["sections"]
     ]
 
     tkts_data = []
+    booths_open = get_booth_status(html_content, source)
 
-    for location in [{"div": "TimesSquare", "name": "Times Square"}, {"div": "LincolnCenter", "name": "Lincoln Center"}]:
-        if location_is_closed(location['name'], html_content):
-            print(f"{location['name']} booth is closed.")
+    for booth in source["booths"]:
+        if not booths_open[booth["name"]]:
+            print(f"{booth['name']} booth is closed.")
             continue
 
         for div in divs:
-            tkts_data += process_div(div, location["div"], soup)
-    
-    return tkts_data
+            tkts_data += process_div(div, booth, sections)
+
+    instrument.count("board_rows_parsed", len(tkts_data))
+
+    return TktsSnapshot(
+        rows=tkts_data,
+        booths_open=booths_open,
+        fetched_at=fetched_at,
+        html_digest=hashlib.sha256(html_content.encode()).hexdigest(),
+        board_digest=get_board_digest(sections, booths_open)
+    )
+
+def combine_snapshots(snapshots, fetched_at):
+    """Combine the snapshots of several sources into one, rows in source order"""
+    if len(snapshots) == 1:
+        return snapshots[0]
+
+    return TktsSnapshot(
+        rows=[row for snapshot in snapshots for row in snapshot.rows],
+        booths_open={booth: is_open for snapshot in snapshots for booth, is_open in snapshot.booths_open.items()},
+        fetched_at=fetched_at,
+        html_digest=fetch.digest("".join(snapshot.html_digest or "" for snapshot in snapshots)),
+        board_digest=fetch.digest("".join(snapshot.board_digest for snapshot in snapshots))
+    )
+
+def get_tkts_snapshot(sources=SOURCES):
+    """
+    Fetch and parse every TKTS source once, concurrently
+
+    Returns:
+        TktsSnapshot: Parsed rows, open/closed status per booth name, fetch time and digests of the pages
+    """
+    fetched_at = datetime.now(timezone('US/Eastern'))
+
+    def fetch_and_parse(source):
+        return build_snapshot(get_tkts_html(source["url"]), fetched_at, source=source)
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        return combine_snapshots(list(executor.map(fetch_and_parse, sources)), fetched_at)
+
+# Name of the fetch state holding what the sync of the whole board keeps between runs (e.g. record IDs),
+# so it does not depend on which sources are listed or in what order
+SYNC_STATE = "tkts-sync"
+
+# What a source's committed state needs for its board to be rebuilt without parsing the page
+SOURCE_STATE_FIELDS = ("board_date", "rows_version", "rows", "booths_open", "digest")
+
+@dataclass
+class TktsPoll:
+    """The conditional fetches of every source in one poll, committed together once the board has been synced"""
+    results: list  # FetchResult per source
+    snapshots: list  # TktsSnapshot per source, rebuilt from the committed state for unchanged sources
+    fetched_at: datetime
+    previous: dict  # sync state committed by the last run (empty if there is none)
+
+    def commit(self, **sync_state):
+        """Commit every source, keeping its rows so an unchanged source need not be parsed again, and the sync state, in one save"""
+        fetch.commit_all(
+            [
+                (result, snapshot.board_digest, {
+                    "board_date": self.fetched_at.strftime("%Y-%m-%d"),
+                    "rows": [row.to_state() for row in snapshot.rows],
+                    "rows_version": normalize.ROW_STATE_VERSION,
+                    "booths_open": snapshot.booths_open
+                })
+                for result, snapshot in zip(self.results, self.snapshots)
+            ],
+            {SYNC_STATE: sync_state}
+        )
+
+def can_rebuild(state, fetched_at):
+    """True if a source's committed state holds today's board in the current row format"""
+    return (
+        all(state.get(field) is not None for field in SOURCE_STATE_FIELDS)
+        and state["board_date"] == fetched_at.strftime("%Y-%m-%d")
+        and state["rows_version"] == normalize.ROW_STATE_VERSION
+    )
+
+def poll_source(source, fetched_at):
+    """
+    Conditionally fetch and parse one source
+
+    Returns:
+        tuple: (FetchResult, TktsSnapshot, True if the board changed since the last committed run)
+    """
+    # when the committed rows are for other performance dates (or missing), download and rebuild the board
+    force = not can_rebuild(fetch.get_committed(source["url"]), fetched_at)
+
+    result = fetch.conditional_get(source["url"], force=force)
+    if not result.not_modified:
+        sections = parse_sections(result.text, pattern=get_section_pattern(source))
+        if force or not can_rebuild(result.previous, fetched_at) or not result.is_unchanged(get_board_digest(sections, get_booth_status(result.text, source))):
+            return result, build_snapshot(result.text, fetched_at, sections, source), True
+
+    elif not can_rebuild(result.previous, fetched_at):
+        # the state changed since it was checked (e.g. another process committed), so it cannot be trusted
+        result = fetch.conditional_get(source["url"], force=True)
+        return result, build_snapshot(result.text, fetched_at, source=source), True
+
+    snapshot = TktsSnapshot(
+        rows=[normalize.TktsRow.from_state(row) for row in result.previous.get("rows")],
+        booths_open=result.previous.get("booths_open"),
+        fetched_at=fetched_at,
+        html_digest=None,
+        board_digest=result.previous.get("digest")
+    )
+    return result, snapshot, False
+
+def poll_tkts_snapshot(sources=SOURCES):
+    """
+    Conditionally fetch every TKTS source concurrently, skipping row parsing for boards that have not changed since the last committed run
+
+    A source is always downloaded in full on the first poll of a new day, since the same board
+    then describes different performance dates. Without committed sync state the board counts
+    as changed, so it is synced again.
+
+    Returns:
+        tuple: (TktsSnapshot of all sources or None if no board changed, TktsPoll to commit once synced)
+    """
+    fetched_at = datetime.now(timezone('US/Eastern'))
+
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        polled = list(executor.map(lambda source: poll_source(source, fetched_at), sources))
+
+    poll = TktsPoll([result for result, _, _ in polled], [snapshot for _, snapshot, _ in polled], fetched_at, fetch.get_committed(SYNC_STATE))
+    if poll.previous and not any(changed for _, _, changed in polled):
+        return None, poll
+
+    return combine_snapshots(poll.snapshots, fetched_at), poll
+
+def get_tkts_data():
+    return get_tkts_snapshot().rows
 
 if __name__ == "__main__":
     data = get_tkts_data()
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+import os
+import sqlite3
+import threading
+
+from common.paths import CACHE_DIR
+from common.titles import TitleIndex
+
+CACHE_FILE = os.path.join(CACHE_DIR, "shows.sqlite3")
+
+# Bumped whenever the tables change; a cache file of an older version is reloaded from the database
+SCHEMA_VERSION = 2
+
+# Reload the whole catalog at least this often, to pick up renames made elsewhere
+TTL = timedelta(hours=float(os.environ.get("SHOW_CACHE_TTL_HOURS", 24)))
+
+class ShowCache:
+    """
+    On-disk copy of the Show Information table, plus a write-behind queue of shows still to be created
+
+    The cache is considered stale once its TTL has passed or when the newest show_id in the
+    database no longer matches the newest cached one. A TitleIndex over the cached shows is built
+    on first use, to match titles written differently and to search them without the database.
+    """
+
+    def __init__(self, path=CACHE_FILE, ttl=TTL):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.index = None
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            # version 1 kept show names unique, losing the show_ids of shows that share a name
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self.connection.executescript("""
+                    DROP TABLE IF EXISTS shows;
+                    DROP TABLE IF EXISTS meta;
+                """)
+            self.connection.executescript(f"""
+                CREATE TABLE IF NOT EXISTS shows (show_id INTEGER PRIMARY KEY, show_name TEXT NOT NULL, is_broadway INTEGER);
+                CREATE INDEX IF NOT EXISTS shows_by_name ON shows (show_name, show_id);
+                CREATE TABLE IF NOT EXISTS pending_shows (show_name TEXT PRIMARY KEY, is_broadway INTEGER);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+
+    def get_meta(self, key):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def is_loaded(self):
+        """True once the cache has been filled from the database"""
+        with self.lock:
+            return self.get_meta("ever_loaded") is not None
+
+    def is_fresh(self, latest_show_id):
+        """True if the cache was loaded within its TTL and already holds the newest show"""
+        with self.lock:
+            loaded_at = self.get_meta("loaded_at")
+            if loaded_at is None or datetime.now(timezone.utc) - datetime.fromisoformat(loaded_at) > self.ttl:
+                return False
+            cached_latest = self.connection.execute("SELECT MAX(show_id) FROM shows").fetchone()[0]
+            return cached_latest == latest_show_id
+
+    def invalidate(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM meta WHERE key = 'loaded_at'")
+
+    def replace_all(self, shows):
+        """Replace the cached catalog, dropping queued shows that now exist"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM shows")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO shows (show_id, show_name, is_broadway) VALUES (?, ?, ?)",
+                [(show["show_id"], show["show_name"], show.get("is_broadway")) for show in shows]
+            )
+            self.connection.execute("DELETE FROM pending_shows WHERE show_name IN (SELECT show_name FROM shows)")
+            self.set_meta("loaded_at", datetime.now(timezone.utc).isoformat())
+            self.set_meta("ever_loaded", "1")
+            self.index = None
+
+    def add(self, shows):
+        """Add shows just created or fetched from the database"""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO shows (show_id, show_name, is_broadway) VALUES (?, ?, ?)",
+                [(show["show_id"], show["show_name"], show.get("is_broadway")) for show in shows]
+            )
+            self.connection.executemany("DELETE FROM pending_shows WHERE show_name = ?", [(show["show_name"],) for show in shows])
+            if self.index is not None:
+                for show in shows:
+                    self.index.add(show["show_name"], show["show_id"])
+
+    def get_id(self, show_name):
+        """Show ID of show_name as written; where shows share the name the oldest wins, as in get_index"""
+        with self.lock:
+            row = self.connection.execute("SELECT MIN(show_id) FROM shows WHERE show_name = ?", (show_name,)).fetchone()
+        return row[0] if row else None
+
+    def get_index(self):
+        """TitleIndex of show name -> show_id; where names share a canonical key the oldest show wins"""
+        with self.lock:
+            if self.index is None:
+                self.index = TitleIndex(self.connection.execute("SELECT show_name, show_id FROM shows ORDER BY show_id"))
+            return self.index
+
+    def find_id(self, show_name):
+        """Show ID of show_name as written or of a show whose name has the same canonical key"""
+        return self.get_id(show_name) or self.get_index().get(show_name)
+
+    def get_name(self, show_id):
+        with self.lock:
+            row = self.connection.execute("SELECT show_name FROM shows WHERE show_id = ?", (show_id,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, search_term, limit=None):
+        """Cached shows whose names contain search_term, allowing for small spelling differences, best first (all of them unless limit is given)"""
+        matches = self.get_index().search(search_term, limit)
+        with self.lock:
+            rows = {
+                show_id: (show_name, is_broadway)
+                for show_id, show_name, is_broadway in self.connection.execute(
+                    f"SELECT show_id, show_name, is_broadway FROM shows WHERE show_id IN ({', '.join('?' * len(matches))})",
+                    [show_id for _, show_id, _ in matches]
+                )
+            }
+        return [
+            {"show_id": show_id, "show_name": rows[show_id][0], "is_broadway": None if rows[show_id][1] is None else bool(rows[show_id][1])}
+            for _, show_id, _ in matches if show_id in rows
+        ]
+
+    def queue(self, show_name, is_broadway):
+        """Queue a show for creation; the queue survives across runs until it is flushed"""
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO pending_shows (show_name, is_broadway) VALUES (?, ?)", (show_name, is_broadway))
+
+    def pending(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT show_name, is_broadway FROM pending_shows").fetchall()
+        return [{"show_name": show_name, "is_broadway": None if is_broadway is None else bool(is_broadway)} for show_name, is_broadway in rows]
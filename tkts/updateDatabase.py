@@ -1,82 +1,211 @@
 import database
 import scraper
+import price_history
+from normalize import cents_to_dollars
 import datetime
 from pytz import timezone
+from common import instrument
+
+# Booths that also have a column of their own in the Logs table, from before booths_open held every booth
+LOG_COLUMNS = {"Times Square": "times_square_open", "Lincoln Center": "lincoln_center_open"}
+
+def get_change_log(booths_open):
+    """Log entry of the booth status: every booth in booths_open, plus the column of each booth that has one"""
+    return {
+        "booths_open": booths_open,
+        **{column: booths_open[booth] for booth, column in LOG_COLUMNS.items() if booth in booths_open}
+    }
+
+def get_last_available_time():
+    return datetime.datetime.now(timezone('US/Eastern')).strftime("%Y-%m-%d %H:%M:%S%z")
+
+def merge_discount_record(new_record, previous_record, last_available_time):
+    """
+    Merge a freshly scraped record into a previously stored one
+
+    Keeps the highest discount, lowest low price and highest high price seen
+    for the performance and bumps the last available time.
+
+    Args:
+        new_record (TktsRow): Scraped row
+        previous_record (dict): Stored (or pending) discount record
+        last_available_time (str): Timestamp of this run
+
+    Returns:
+        dict: The merged discount record
+    """
+    merged = dict(previous_record)
+    merged["last_available_time"] = last_available_time
+
+    if new_record.discount_percent > float(previous_record["discount_percent"]):
+        print(f"Updating discount for {new_record.title} from {previous_record['discount_percent']}% to {new_record.discount_percent}%")
+        merged["discount_percent"] = new_record.discount_percent
+
+    low_price = cents_to_dollars(new_record.low_price_cents)
+    if previous_record["low_price"] and low_price and low_price < float(previous_record["low_price"]):
+        print(f"Updating low price for {new_record.title} from {previous_record['low_price']} to {low_price}")
+        merged["low_price"] = low_price
+
+    high_price = cents_to_dollars(new_record.high_price_cents)
+    if previous_record["high_price"] and high_price and high_price > float(previous_record["high_price"]):
+        print(f"Updating high price for {new_record.title} from {previous_record['high_price']} to {high_price}")
+        merged["high_price"] = high_price
+
+    return merged
+
+def get_show_ids(db, tkts_data):
+    """
+    Map every scraped title to its show ID, creating all missing shows in one bulk insert
+
+    Returns:
+        dict: show_name -> show_id, None if missing shows could not be created
+    """
+    shows = {}
+    for record in tkts_data:
+        shows.setdefault(record.title, record.on_broadway)
 
-def update_discount_record(new_record, previous_record):
-    print(f"Found previous record for {new_record['title']} on {new_record['performance_date']} (Matinee: {new_record['is_matinee']})")
-    db = database.SupabaseConnection()
-
-    print(f"Updating last available time for {new_record['title']}.")
-    db.update_discount(
-        record_id=previous_record["id"],
-        last_available_time=datetime.datetime.now(timezone('US/Eastern')).strftime("%Y-%m-%d %H:%M:%S%z")
-    )
-
-    if float(new_record["discount_percent"]) > float(previous_record["discount_percent"]):
-        print(f"Updating discount for {new_record['title']} from {previous_record['discount_percent']}% to {new_record['discount_percent']}%")
-        db.update_discount(
-            record_id=previous_record["id"],
-            discount_percent=new_record["discount_percent"]
-        )
-
-    if previous_record["low_price"] and float(new_record["low_price"]) < float(previous_record["low_price"]):
-        print(f"Updating low price for {new_record['title']} from {previous_record['low_price']} to {new_record['low_price']}")
-        db.update_discount(
-            record_id=previous_record["id"],
-            low_price=new_record["low_price"]
-        )
-
-    if previous_record["high_price"] and float(new_record["high_price"]) > float(previous_record["high_price"]):
-        print(f"Updating high price for {new_record['title']} from {previous_record['high_price']} to {new_record['high_price']}")
-        db.update_discount(
-            record_id=previous_record["id"],
-            high_price=new_record["high_price"]
-        )
-
-def update_database():
+    return db.get_show_ids_by_names_or_create(shows)
 
-    print("Updating TKTS database...")
+@instrument.timed()
+def sync_discount_records(db, tkts_data):
+    """
+    Sync scraped records into the TKTS Discounts table with a constant number of requests
+
+    Prefetches the stored records for the scraped performance dates, merges
+    the scraped rows into them in memory and writes the result back as one
+    bulk insert (new performances) and one bulk upsert (known performances).
+
+    Returns:
+        list: The synced discount records (including their ids), None if the sync failed
+    """
+    if not tkts_data:
+        return []
 
-    db = database.SupabaseConnection()
-    db.test_connection()
+    show_ids = get_show_ids(db, tkts_data)
+    if show_ids is None:
+        print("❌ Could not load show mappings, skipping discount sync.")
+        return None
 
-    # Get TKTS data
-    tkts_data = scraper.get_tkts_data()
+    performance_dates = sorted({record.performance_date for record in tkts_data})
+    previous_records = db.get_discount_records_by_dates(performance_dates)
+    if previous_records is None:
+        print("❌ Could not load previous discount records, skipping discount sync.")
+        return None
+
+    previous_by_key = {
+        (record["show_id"], record["performance_date"], record["is_matinee"]): record
+        for record in previous_records
+    }
+
+    last_available_time = get_last_available_time()
+    new_records = {}
+    updated_records = {}
 
     for record in tkts_data:
+        show_id = show_ids[record.title]
+        key = (show_id, record.performance_date, record.is_matinee)
+
+        if key in new_records:
+            new_records[key] = merge_discount_record(record, new_records[key], last_available_time)
+        elif key in updated_records:
+            updated_records[key] = merge_discount_record(record, updated_records[key], last_available_time)
+        elif key in previous_by_key:
+            print(f"Found previous record for {record.title} on {record.performance_date} (Matinee: {record.is_matinee})")
+            updated_records[key] = merge_discount_record(record, previous_by_key[key], last_available_time)
+        else:
+            new_records[key] = {
+                "show_id": show_id,
+                "discount_percent": record.discount_percent,
+                "low_price": cents_to_dollars(record.low_price_cents),
+                "high_price": cents_to_dollars(record.high_price_cents),
+                "performance_time": record.performance_time.strftime("%H:%M:%S"),
+                "performance_date": record.performance_date,
+                "is_matinee": record.is_matinee,
+                "last_available_time": last_available_time,
+            }
+
+    inserted = db.add_discount_records(list(new_records.values()))
+    upserted = db.upsert_discount_records(list(updated_records.values()))
+    if inserted is None or upserted is None:
+        return None
+
+    instrument.count("discount_records_written", len(inserted), operation="insert")
+    instrument.count("discount_records_written", len(upserted), operation="upsert")
+    return inserted + upserted
+
+@instrument.timed()
+def record_price_snapshots(db, snapshot, discount_records, previous_state):
+    """
+    Append what changed on the board since the last committed run to the TKTS Price Snapshots table
+
+    The values written last are kept in the fetch state; when the state has none (e.g. the cache
+    was lost) they are read back from the table instead.
+
+    Args:
+        db (SupabaseConnection): Database connection
+        snapshot (TktsSnapshot): The board of this run
+        discount_records (list): Result of sync_discount_records
+        previous_state (dict): Sync state committed by the last run (see TktsPoll.previous)
+
+    Returns:
+        dict: The baseline to commit for the next run, None if the snapshots could not be written
+    """
+    baseline = previous_state.get("prices")
+    if baseline is None:
+        latest = db.get_latest_price_snapshots([record["id"] for record in discount_records])
+        if latest is None:
+            return None
+        baseline = price_history.get_baseline(latest)
+
+    show_ids = get_show_ids(db, snapshot.rows) if snapshot.rows else {}
+    observations = price_history.get_observations(snapshot.rows, show_ids)
+    rows, next_baseline = price_history.get_price_deltas(observations, discount_records, baseline, snapshot.fetched_at.isoformat())
+
+    if db.add_price_snapshots(rows) is None:
+        return None
+    instrument.count("price_snapshots_written", len(rows))
+    return next_baseline
+
+# pass a connection to reuse it across runs (e.g. from the long-running service)
+# returns True if the board had changed since the last run, False otherwise
+@instrument.timed()
+def update_database(db=None):
 
-        # Get show ID by title
-        # If show does not exist, create a new record
-        show_id = db.get_show_id_by_name_or_create(record["title"], record["on_broadway"])
-
-        # Find if discount record already exists
-        previous_record = db.get_discount_record_by_fields(
-            show_id=show_id,
-            performance_date=record["performance_date"],
-            is_matinee=record["is_matinee"]
-        )
-
-        if previous_record:
-            update_discount_record(record, previous_record)
-            continue
-
-        # Add each new record to the TKTS Discounts table
-        db.add_discount_record(
-            show_id=show_id,
-            discount_percent=record["discount_percent"],
-            low_price=record["low_price"],
-            high_price=record["high_price"],
-            performance_time=record["performance_time"],
-            performance_date=record["performance_date"],
-            is_matinee=record["is_matinee"]
-        )
+    print("Updating TKTS database...")
+
+    if db is None:
+        db = database.get_connection()
+        db.test_connection()
+
+    # Fetch and parse the TKTS board once for both the discount sync and the change log,
+    # skipping both when the board has not changed since the last run
+    snapshot, poll = scraper.poll_tkts_snapshot()
+
+    if snapshot is None:
+        print("TKTS board unchanged since last run.")
+        instrument.count("board_polls", board="unchanged")
+        record_ids = poll.previous.get("record_ids", [])
+        if db.touch_discount_records(record_ids, get_last_available_time()) is not None:
+            poll.commit(record_ids=record_ids, prices=poll.previous.get("prices"))
+        return False
+
+    instrument.count("board_polls", board="changed")
+    discount_records = sync_discount_records(db, snapshot.rows)
+
+    # append the price changes since the last run to the price history
+    prices = None
+    if discount_records is not None:
+        prices = record_price_snapshots(db, snapshot, discount_records, poll.previous)
 
     # update the change log
-    html = scraper.get_tkts_html()
-    db.add_change_log(lincoln_center_open=not scraper.location_is_closed("Lincoln Center", html),
-                      times_square_open=not scraper.location_is_closed("Times Square", html))
+    db.add_change_log(**get_change_log(snapshot.booths_open))
+
+    # without committing, the next run syncs this board again, which is safe since syncs merge
+    if discount_records is not None and prices is not None:
+        poll.commit(record_ids=[record["id"] for record in discount_records], prices=prices)
     print("TKTS database updated successfully.")
+    return True
 
 if __name__ == "__main__":
-    update_database()
\ No newline at end of file
+    update_database()
+    instrument.export("tkts")